@@ -30,7 +30,14 @@ setup(name='sptrans',
       install_requires=[
           'requests',
       ],
+      extras_require={
+          'pandas': ['pandas'],
+          'arrow': ['pyarrow'],
+          'msgpack': ['msgpack'],
+      },
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      sptrans = sptrans.cli:main
       """,
       )
@@ -0,0 +1,265 @@
+"""Module for measuring how accurate the arrival forecasts are, online.
+
+A :class:`ForecastAccuracyTracker` records the arrival times predicted for each (vehicle prefix, stop) pair in the forecasts,
+and detects the actual arrivals in later position snapshots, when the vehicles get close enough to the stops - found through
+a grid index of the stop locations. Each prediction is then compared with the actual arrival, and the error goes into
+streaming statistics per forecast horizon (how long before the arrival the prediction was made):
+::
+
+    import time
+
+    from sptrans.v0 import Client
+    from sptrans.accuracy import ForecastAccuracyTracker
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    tracker = ForecastAccuracyTracker()
+    while True:
+        tracker.record_forecast(client.get_forecast(route_code=1234))
+        tracker.record_positions(client.get_positions(1234))
+        time.sleep(30)
+
+    for stats in tracker.stats():
+        print(stats.horizon, stats.count, stats.mean_error, stats.mean_absolute_error)
+
+Errors are the predicted minus the actual arrival times, so positive errors mean late predictions (vehicles arrived earlier than
+predicted). The memory used is bounded: predictions for vehicles that are never seen arriving are dropped after a while, the
+number of (vehicle, stop) pairs waiting for arrivals is capped, and the statistics have a fixed size.
+"""
+
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from math import sqrt
+
+from sptrans.geo import Grid
+from sptrans.tracking import to_timestamp
+
+
+EXPIRY_INTERVAL = 60
+
+AccuracyStats = namedtuple('AccuracyStats', ['horizon', 'count', 'mean_error', 'mean_absolute_error', 'deviation'])
+"""A namedtuple representing the accuracy of the predictions made within a forecast horizon.
+
+:var horizon: (:class:`tuple`) The (minimum, maximum) horizon, in minutes, with `None` as maximum for the last one, or `None`
+    for the statistics of all horizons together.
+:var count: (:class:`int`) How many predictions were compared with actual arrivals.
+:var mean_error: (:class:`float`) The mean error, in seconds, or `None` without predictions.
+:var mean_absolute_error: (:class:`float`) The mean absolute error, in seconds, or `None` without predictions.
+:var deviation: (:class:`float`) The standard deviation of the error, in seconds, or `None` without predictions.
+"""
+
+ObservedArrival = namedtuple('ObservedArrival', ['prefix', 'stop_code', 'arrived_at', 'predictions'])
+"""A namedtuple representing an arrival detected from the vehicle positions.
+
+:var prefix: (:class:`str`) The vehicle prefix painted in the bus.
+:var stop_code: (:class:`int`) The stop code.
+:var arrived_at: (:class:`float`) When the vehicle was seen at the stop, as the local time - the one of the API -
+    converted by :func:`sptrans.tracking.to_timestamp`.
+:var predictions: (:class:`int`) How many predictions were evaluated with the arrival.
+"""
+
+
+class _RunningStats(object):
+    __slots__ = ('count', 'mean', 'm2', 'absolute')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.absolute = 0.0
+
+    def add(self, error):
+        self.count += 1
+        delta = error - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (error - self.mean)
+        self.absolute += (abs(error) - self.absolute) / self.count
+
+    def summary(self, horizon):
+        if not self.count:
+            return AccuracyStats(horizon, 0, None, None, None)
+        return AccuracyStats(horizon, self.count, self.mean, self.absolute, sqrt(self.m2 / self.count))
+
+
+def _local_timestamp(moment):
+    # The predicted arrival times are naive local times, so seconds since the epoch are converted to the local time too,
+    # instead of being compared with them as if they were in UTC.
+    if not isinstance(moment, datetime):
+        moment = datetime.fromtimestamp(moment)
+    return to_timestamp(moment)
+
+
+class ForecastAccuracyTracker(object):
+    """Tracker of the accuracy of arrival forecasts, comparing predictions with the arrivals seen in vehicle positions.
+
+    :param arrival_distance: How close, in meters, a vehicle must be to a stop to be considered arrived.
+    :type arrival_distance: :class:`float`
+    :param horizons: The upper bounds, in minutes, of the forecast horizons to keep statistics for.
+    :type horizons: sequence of :class:`float`
+    :param max_predictions: How many distinct predictions to keep per (vehicle, stop) pair, the most recent ones.
+    :type max_predictions: :class:`int`
+    :param max_pending: How many (vehicle, stop) pairs may be waiting for arrivals; the oldest ones are dropped first.
+    :type max_pending: :class:`int`
+    :param max_delay: For how many seconds after the predicted arrival a vehicle may still arrive, before its predictions are dropped.
+    :type max_delay: :class:`float`
+    :param cooldown: For how many seconds after an arrival new predictions for the same vehicle and stop are ignored.
+    :type cooldown: :class:`float`
+    """
+
+    def __init__(self, arrival_distance=50, horizons=(2, 5, 10, 20, 40), max_predictions=8, max_pending=100000,
+                 max_delay=1800, cooldown=600):
+        self.arrival_distance = arrival_distance
+        self.horizons = tuple(horizons)
+        self.max_predictions = max_predictions
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+        self.expired = 0
+        self._grid = Grid(arrival_distance)
+        self._pending = OrderedDict()
+        self._by_prefix = {}
+        self._arrived = OrderedDict()
+        self._stops = {}
+        self._cells = {}
+        self._stats = [_RunningStats() for _ in range(len(self.horizons) + 1)]
+        self._overall = _RunningStats()
+        self._expired_at = None
+
+    @property
+    def pending(self):
+        """How many (vehicle, stop) pairs are waiting for arrivals."""
+        return len(self._pending)
+
+    def add_stop(self, stop):
+        """Indexes the location of a stop. Stops found in the forecasts are indexed automatically.
+
+        :param stop: The stop, or any object with `code`, `latitude` and `longitude` attributes.
+        """
+        if stop.code in self._stops:
+            return
+        x, y = self._grid.projection.project(stop.latitude, stop.longitude)
+        self._stops[stop.code] = (x, y)
+        self._cells.setdefault(self._grid.key(x, y), []).append(stop.code)
+
+    def record_forecast(self, forecast, observed_at=None):
+        """Records the predictions of a forecast.
+
+        :param forecast: The forecast, by stop or by route.
+        :type forecast: :class:`sptrans.v0.ForecastWithStop` or :class:`sptrans.v0.ForecastWithStops`
+        :param observed_at: When the forecast was fetched, defaults to the time reported by the API.
+        :type observed_at: A naive :class:`datetime.datetime` in the local time, like the API times, or a :class:`float` of
+                           seconds since the epoch, like :func:`time.time` returns
+        :return: How many predictions were recorded.
+        """
+        moment = _local_timestamp(forecast.time if observed_at is None else observed_at)
+        if hasattr(forecast, 'stops'):
+            stops = [(stop, stop.vehicles) for stop in forecast.stops]
+        else:
+            stops = [(forecast.stop, route.vehicles) for route in forecast.stop.routes]
+        recorded = 0
+        for stop, vehicles in stops:
+            self.add_stop(stop)
+            for vehicle in vehicles:
+                key = (vehicle.prefix, stop.code)
+                if key in self._arrived:
+                    continue
+                predicted = to_timestamp(vehicle.arriving_at)
+                predictions = self._pending.pop(key, None)
+                if predictions is None:
+                    predictions = []
+                    self._by_prefix.setdefault(vehicle.prefix, set()).add(stop.code)
+                self._pending[key] = predictions
+                if predictions and predictions[-1][1] == predicted:
+                    continue
+                predictions.append((moment, predicted))
+                del predictions[:-self.max_predictions]
+                recorded += 1
+        while len(self._pending) > self.max_pending:
+            self._drop(next(iter(self._pending)))
+            self.expired += 1
+        return recorded
+
+    def record_positions(self, positions, observed_at=None):
+        """Detects arrivals in a positions snapshot, and compares them with their predictions.
+
+        :param positions: The positions, as returned by :meth:`sptrans.v0.Client.get_positions`.
+        :type positions: :class:`sptrans.v0.Positions`
+        :param observed_at: When the positions were fetched, defaults to the time reported by the API.
+        :type observed_at: A naive :class:`datetime.datetime` in the local time, like the API times, or a :class:`float` of
+                           seconds since the epoch, like :func:`time.time` returns
+        :return: A :class:`list` of :class:`ObservedArrival` objects.
+        """
+        moment = _local_timestamp(positions.time if observed_at is None else observed_at)
+        arrivals = []
+        for vehicle in positions.vehicles:
+            stop_codes = self._by_prefix.get(vehicle.prefix)
+            if not stop_codes:
+                continue
+            for stop_code in self._near(vehicle.latitude, vehicle.longitude):
+                if stop_code not in stop_codes:
+                    continue
+                predictions = self._pending[(vehicle.prefix, stop_code)]
+                for made_at, predicted in predictions:
+                    if made_at <= moment:
+                        self._add_error(moment - made_at, predicted - moment)
+                self._drop((vehicle.prefix, stop_code))
+                self._arrived[(vehicle.prefix, stop_code)] = moment
+                arrivals.append(ObservedArrival(vehicle.prefix, stop_code, moment, len(predictions)))
+        self._expire(moment)
+        return arrivals
+
+    def stats(self):
+        """Gets the accuracy statistics per forecast horizon.
+
+        :return: A :class:`list` of :class:`AccuracyStats` objects, from the shortest horizon to the longest.
+        """
+        bounds = (0, ) + self.horizons + (None, )
+        return [stats.summary((bounds[index], bounds[index + 1])) for index, stats in enumerate(self._stats)]
+
+    def overall(self):
+        """Gets the accuracy statistics of all horizons together.
+
+        :return: An :class:`AccuracyStats` object.
+        """
+        return self._overall.summary(None)
+
+    def _add_error(self, horizon_seconds, error):
+        self._stats[bisect_left(self.horizons, horizon_seconds / 60.0)].add(error)
+        self._overall.add(error)
+
+    def _drop(self, key):
+        del self._pending[key]
+        prefix, stop_code = key
+        stop_codes = self._by_prefix[prefix]
+        stop_codes.discard(stop_code)
+        if not stop_codes:
+            del self._by_prefix[prefix]
+
+    def _expire(self, moment):
+        # Looking for expired predictions goes through all of them, so it's done at most once per EXPIRY_INTERVAL seconds.
+        if self._expired_at is not None and moment - self._expired_at < EXPIRY_INTERVAL:
+            return
+        self._expired_at = moment
+        for key in [key for key, predictions in self._pending.items() if predictions[-1][1] + self.max_delay < moment]:
+            self._drop(key)
+            self.expired += 1
+        while self._arrived:
+            key, arrived_at = next(iter(self._arrived.items()))
+            if arrived_at + self.cooldown >= moment:
+                break
+            del self._arrived[key]
+
+    def _near(self, latitude, longitude):
+        x, y = self._grid.projection.project(latitude, longitude)
+        cell_x, cell_y = self._grid.key(x, y)
+        near = []
+        for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+            for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+                for stop_code in self._cells.get((neighbour_x, neighbour_y), ()):
+                    stop_x, stop_y = self._stops[stop_code]
+                    if sqrt((stop_x - x) ** 2 + (stop_y - y) ** 2) <= self.arrival_distance:
+                        near.append(stop_code)
+        return near
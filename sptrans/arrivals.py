@@ -0,0 +1,200 @@
+"""Module for answering "next arrivals at a stop" questions from memory.
+
+Instead of asking the API for a forecast of each stop (``Previsao/Parada``), an :class:`ArrivalIndex` sweeps the forecasts for whole routes
+(``Previsao/Linha``) and keeps, for every stop attended by those routes, the arrivals sorted by time.
+This means one API call per route, instead of one per stop:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.arrivals import ArrivalIndex
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    index = ArrivalIndex(client, route_codes=[1273, 34041])
+    index.refresh()
+    for arrival in index.next_arrivals(700016623, count=3):
+        print(arrival.route_code, arrival.vehicle.prefix, arrival.arriving_at)
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+import heapq
+
+
+Arrival = namedtuple('Arrival', ['arriving_at', 'route_code', 'stop_code', 'vehicle'])
+"""A namedtuple representing a forecast arrival of a vehicle at a stop.
+
+:var arriving_at: (:class:`datetime.datetime`) The time that the vehicle is expected to arrive.
+:var route_code: (:class:`int`) The code of the route the vehicle is running.
+:var stop_code: (:class:`int`) The stop code.
+:var vehicle: (:class:`sptrans.v0.VehicleForecast`) The vehicle itself.
+"""
+
+
+class ArrivalIndex(object):
+    """In-memory index of forecast arrivals per stop, fed by route-wide forecasts.
+
+    Each route is refreshed independently, so the index can be updated incrementally - for example, a few routes at a time with
+    :meth:`refresh_next` -, and only the stops attended by the refreshed routes get their arrivals rebuilt.
+
+    :param client: The (authenticated) client used to fetch the forecasts.
+    :type client: :class:`sptrans.v0.Client`
+    :param route_codes: The codes of the routes to keep track of.
+    :type route_codes: iterable of :class:`int`
+    """
+
+    def __init__(self, client, route_codes=()):
+        self.client = client
+        self._route_codes = []
+        self._route_arrivals = {}
+        self._route_times = {}
+        self._stop_routes = {}
+        self._stop_arrivals = {}
+        self._cursor = 0
+        for code in route_codes:
+            self.add_route(code)
+
+    @property
+    def route_codes(self):
+        """The codes of the routes being tracked, in the order they're refreshed."""
+        return list(self._route_codes)
+
+    @property
+    def stop_codes(self):
+        """The codes of the stops that currently have arrivals in the index."""
+        return list(self._stop_routes)
+
+    def add_route(self, code):
+        """Starts tracking a route. It will only have arrivals after it's refreshed.
+
+        :param code: The route code.
+        :type code: :class:`int`
+        """
+        if code not in self._route_arrivals:
+            self._route_codes.append(code)
+            self._route_arrivals[code] = {}
+
+    def remove_route(self, code):
+        """Stops tracking a route, dropping all its arrivals from the index.
+
+        :param code: The route code.
+        :type code: :class:`int`
+        """
+        if code not in self._route_arrivals:
+            return
+        self._replace_route_arrivals(code, {})
+        del self._route_arrivals[code]
+        self._route_times.pop(code, None)
+        position = self._route_codes.index(code)
+        del self._route_codes[position]
+        if position < self._cursor:
+            self._cursor -= 1
+
+    def refreshed_at(self, code):
+        """Tells when the forecast for a route was generated, according to the API.
+
+        :param code: The route code.
+        :type code: :class:`int`
+        :return: A :class:`datetime.datetime`, or `None` if the route was never refreshed.
+        """
+        return self._route_times.get(code)
+
+    def update(self, code, forecast):
+        """Replaces the arrivals of a route with the ones from a forecast already fetched.
+
+        :param code: The route code.
+        :type code: :class:`int`
+        :param forecast: The forecast for the route, as returned by :meth:`sptrans.v0.Client.get_forecast` with only a `route_code`.
+        :type forecast: :class:`sptrans.v0.ForecastWithStops`
+        """
+        self.add_route(code)
+        stop_arrivals = {}
+        for stop in forecast.stops:
+            arrivals = [Arrival(vehicle.arriving_at, code, stop.code, vehicle) for vehicle in stop.vehicles]
+            if arrivals:
+                arrivals.sort()
+                stop_arrivals[stop.code] = arrivals
+        self._replace_route_arrivals(code, stop_arrivals)
+        self._route_times[code] = forecast.time
+
+    def refresh(self, route_codes=None):
+        """Fetches the forecasts for some routes - or all of them - and updates the index.
+
+        :param route_codes: The codes of the routes to refresh. Defaults to all tracked routes.
+        :type route_codes: iterable of :class:`int`
+        """
+        if route_codes is None:
+            route_codes = self.route_codes
+        for code in route_codes:
+            self.update(code, self.client.get_forecast(route_code=code))
+
+    def refresh_next(self, count=1):
+        """Refreshes the next `count` routes, in a round-robin fashion.
+
+        Calling this periodically spreads the API calls over time, instead of sweeping every route at once.
+
+        :param count: How many routes to refresh.
+        :type count: :class:`int`
+        :return: The list of refreshed route codes.
+        """
+        if not self._route_codes:
+            return []
+        count = min(count, len(self._route_codes))
+        codes = []
+        for _ in range(count):
+            self._cursor %= len(self._route_codes)
+            codes.append(self._route_codes[self._cursor])
+            self._cursor += 1
+        self.refresh(codes)
+        return codes
+
+    def arrivals(self, stop_code):
+        """Lists all the known arrivals at a stop, sorted by arrival time.
+
+        :param stop_code: The stop code.
+        :type stop_code: :class:`int`
+        :return: A :class:`list` of :class:`Arrival` objects.
+        """
+        arrivals = self._stop_arrivals.get(stop_code)
+        if arrivals is None:
+            routes = self._stop_routes.get(stop_code, ())
+            arrivals = list(heapq.merge(*[self._route_arrivals[code][stop_code] for code in routes]))
+            self._stop_arrivals[stop_code] = arrivals
+        return arrivals
+
+    def next_arrivals(self, stop_code, count=1, after=None, route_code=None):
+        """Gets the next arrivals at a stop, sorted by arrival time.
+
+        :param stop_code: The stop code.
+        :type stop_code: :class:`int`
+        :param count: The maximum number of arrivals to return.
+        :type count: :class:`int`
+        :param after: Only consider arrivals after this moment.
+        :type after: :class:`datetime.datetime`
+        :param route_code: Only consider arrivals of this route.
+        :type route_code: :class:`int`
+        :return: A :class:`list` of :class:`Arrival` objects.
+        """
+        if route_code is None:
+            arrivals = self.arrivals(stop_code)
+        else:
+            arrivals = self._route_arrivals.get(route_code, {}).get(stop_code, [])
+        start = 0
+        if after is not None:
+            start = bisect_right([arrival.arriving_at for arrival in arrivals], after)
+        return arrivals[start:start + count]
+
+    def _replace_route_arrivals(self, code, stop_arrivals):
+        previous = self._route_arrivals[code]
+        for stop_code in set(previous) | set(stop_arrivals):
+            self._stop_arrivals.pop(stop_code, None)
+            routes = self._stop_routes.setdefault(stop_code, set())
+            if stop_code in stop_arrivals:
+                routes.add(code)
+            else:
+                routes.discard(code)
+                if not routes:
+                    del self._stop_routes[stop_code]
+        self._route_arrivals[code] = stop_arrivals
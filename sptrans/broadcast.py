@@ -0,0 +1,322 @@
+"""Module for sharing live vehicle positions among many consumers, with a single poller.
+
+A :class:`PositionsBroadcaster` polls the positions of each subscribed route once per interval - no matter how many
+subscribers the route has -, keeps the latest :class:`sptrans.v0.Positions` of each route, and pushes to the subscribers
+only what changed, as compact JSON deltas (see :func:`positions_delta`):
+::
+
+    from sptrans.v0 import Client
+    from sptrans.broadcast import PositionsBroadcaster, serve_sse
+
+
+    client = Client(token='this is my token')
+    client.authenticate()
+
+    broadcaster = PositionsBroadcaster(client, interval=15)
+    broadcaster.start()
+
+    # In-process consumers:
+    subscription = broadcaster.subscribe(1234)
+    message = subscription.get(timeout=60)
+
+    # Or other processes, with Server-Sent Events at http://localhost:8000/positions/1234
+    server = serve_sse(broadcaster, 'localhost', 8000)
+    server.serve_forever()
+
+Each message is a JSON object with the following keys:
+
+- ``route``: the route code;
+- ``time``: the time reported by the API, as "HH:MM";
+- ``full``: `true` when the message carries all the vehicles, which is the case for the first message of a subscription;
+- ``added``: the new vehicles, as ``[prefix, accessible, latitude, longitude]`` lists;
+- ``moved``: the vehicles that changed position, as ``[prefix, latitude, longitude]`` lists;
+- ``removed``: the prefixes of the vehicles that are gone.
+"""
+
+from collections import deque
+import json
+import logging
+import re
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from SocketServer import ThreadingMixIn
+
+
+logger = logging.getLogger(__name__)
+
+
+def positions_delta(route_code, previous, current):
+    """Calculates what changed between two positions snapshots of a route.
+
+    :param route_code: The route code.
+    :type route_code: :class:`int`
+    :param previous: The previous snapshot, or `None` to describe the current one in full.
+    :type previous: :class:`sptrans.v0.Positions`
+    :param current: The current snapshot.
+    :type current: :class:`sptrans.v0.Positions`
+    :return: A :class:`dict` with the message keys described in this module, or `None` if nothing changed.
+    """
+    known = {}
+    if previous is not None:
+        known = dict((vehicle.prefix, vehicle) for vehicle in previous.vehicles)
+    added = []
+    moved = []
+    for vehicle in current.vehicles:
+        old = known.pop(vehicle.prefix, None)
+        if old is None:
+            added.append([vehicle.prefix, vehicle.accessible, vehicle.latitude, vehicle.longitude])
+        elif (old.latitude, old.longitude) != (vehicle.latitude, vehicle.longitude):
+            moved.append([vehicle.prefix, vehicle.latitude, vehicle.longitude])
+    removed = sorted(known)
+    changed_time = previous is None or previous.time != current.time
+    if not (added or moved or removed or changed_time):
+        return None
+    return {
+        'route': route_code,
+        'time': current.time.strftime('%H:%M'),
+        'full': previous is None,
+        'added': added,
+        'moved': moved,
+        'removed': removed,
+    }
+
+
+def encode(message):
+    """Encodes a message as compact JSON bytes."""
+    return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+
+class Subscription(object):
+    """A subscription to the positions of a route, created by :meth:`PositionsBroadcaster.subscribe`.
+
+    Messages are kept in a bounded queue; if the subscriber is too slow and the queue overflows, the pending deltas are
+    dropped and replaced by a full snapshot, so that the subscriber can always rebuild the current state.
+    """
+
+    def __init__(self, broadcaster, route_code, max_pending):
+        self.broadcaster = broadcaster
+        self.route_code = route_code
+        self.closed = False
+        self._messages = deque()
+        self._max_pending = max_pending
+        self._condition = threading.Condition()
+
+    def get(self, timeout=None):
+        """Waits for the next message.
+
+        :param timeout: How many seconds to wait, at most. Waits forever by default.
+        :type timeout: :class:`float`
+        :return: The encoded message, as JSON :class:`bytes`, or `None` on timeout or if the subscription is closed.
+        """
+        with self._condition:
+            if not self._messages and not self.closed:
+                self._condition.wait(timeout)
+            if self._messages:
+                return self._messages.popleft()
+            return None
+
+    def close(self):
+        """Stops receiving messages."""
+        self.broadcaster.unsubscribe(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _push(self, message, snapshot):
+        with self._condition:
+            if len(self._messages) >= self._max_pending:
+                self._messages.clear()
+                message = snapshot()
+            self._messages.append(message)
+            self._condition.notify_all()
+
+
+class PositionsBroadcaster(object):
+    """Poller of the positions of the subscribed routes, which fans out the changes to the subscribers.
+
+    :param client: The (authenticated) client used to fetch the positions.
+    :type client: :class:`sptrans.v0.Client`
+    :param interval: How many seconds to wait between polls of the same route.
+    :type interval: :class:`float`
+    :param max_pending: How many messages may be waiting for a subscriber before it's resynchronized with a full snapshot.
+    :type max_pending: :class:`int`
+    """
+
+    def __init__(self, client, interval=30, max_pending=100):
+        self.client = client
+        self.interval = interval
+        self.max_pending = max_pending
+        self._subscriptions = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def route_codes(self):
+        """The codes of the routes with subscribers."""
+        with self._lock:
+            return [code for code, subscriptions in self._subscriptions.items() if subscriptions]
+
+    def latest(self, route_code):
+        """Gets the latest positions of a subscribed route.
+
+        :return: A :class:`sptrans.v0.Positions` object, or `None` if the route wasn't polled yet or has no subscribers.
+        """
+        return self._latest.get(route_code)
+
+    def subscribe(self, route_code):
+        """Subscribes to the positions of a route. If the route was already polled, its full snapshot is the first message.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :return: A :class:`Subscription` object.
+        """
+        subscription = Subscription(self, route_code, self.max_pending)
+        with self._lock:
+            self._subscriptions.setdefault(route_code, []).append(subscription)
+            positions = self._latest.get(route_code)
+            if positions is not None:
+                snapshot = self._snapshot(route_code, positions)
+                subscription._push(snapshot(), snapshot)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Removes a subscription. Routes without subscribers are not polled anymore."""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.route_code, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.route_code, None)
+                self._latest.pop(subscription.route_code, None)
+
+    def poll(self, route_code):
+        """Polls a route once and pushes the changes to its subscribers. The message is encoded only once, no matter how
+        many subscribers there are.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :return: The message sent, as a :class:`dict`, or `None` if nothing changed.
+        """
+        positions = self.client.get_positions(route_code)
+        with self._lock:
+            previous = self._latest.get(route_code)
+            if positions is previous:
+                return None
+            message = positions_delta(route_code, previous, positions)
+            subscriptions = self._subscriptions.get(route_code)
+            if subscriptions:
+                self._latest[route_code] = positions
+            if message is None or not subscriptions:
+                return message
+            encoded = encode(message)
+            snapshot = self._snapshot(route_code, positions)
+            for subscription in subscriptions:
+                subscription._push(encoded, snapshot)
+        return message
+
+    def poll_all(self):
+        """Polls every route with subscribers once. A route whose poll fails is logged and skipped, so that it doesn't keep
+        the other routes from being polled; its subscribers just don't get a message this time.
+
+        :return: The :class:`list` of messages sent.
+        """
+        messages = []
+        for route_code in self.route_codes:
+            try:
+                message = self.poll(route_code)
+            except Exception:
+                logger.exception('Failed to poll the positions of route %s', route_code)
+                continue
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def start(self):
+        """Starts polling in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops polling, waiting for the background thread to finish."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _snapshot(self, route_code, positions):
+        return lambda: encode(positions_delta(route_code, None, positions))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll_all()
+            except Exception:
+                logger.exception('Failed to poll the positions')
+            self._stopped.wait(self.interval)
+
+
+class _SSEHandler(BaseHTTPRequestHandler):
+    path_pattern = re.compile(r'^/positions/(\d+)$')
+
+    def do_GET(self):
+        match = self.path_pattern.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        subscription = self.server.broadcaster.subscribe(int(match.group(1)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while not subscription.closed:
+                message = subscription.get(timeout=self.server.keepalive)
+                if message is None:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    self.wfile.write(b'data: ' + message + b'\n\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            subscription.close()
+
+    def log_message(self, *args):
+        pass
+
+
+class SSEServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server streaming the messages of a :class:`PositionsBroadcaster` as Server-Sent Events, at ``/positions/<route code>``."""
+    daemon_threads = True
+
+    def __init__(self, broadcaster, address, keepalive=15):
+        HTTPServer.__init__(self, address, _SSEHandler)
+        self.broadcaster = broadcaster
+        self.keepalive = keepalive
+
+
+def serve_sse(broadcaster, host='localhost', port=8000, keepalive=15):
+    """Creates an :class:`SSEServer` for a broadcaster. Call its ``serve_forever`` method to start serving.
+
+    :param broadcaster: The broadcaster whose messages will be streamed.
+    :type broadcaster: :class:`PositionsBroadcaster`
+    :param host: The host to listen at.
+    :type host: :class:`str`
+    :param port: The port to listen at.
+    :type port: :class:`int`
+    :param keepalive: How many seconds without messages to wait before sending a keepalive comment.
+    :type keepalive: :class:`float`
+    :return: A :class:`SSEServer` object.
+    """
+    return SSEServer(broadcaster, (host, port), keepalive)
@@ -0,0 +1,338 @@
+"""Command-line tool for extracting data from the API in bulk.
+
+Installing the package provides an ``sptrans`` command, with subcommands for downloading the catalogue of routes, stops and
+lanes, for recording vehicle positions continuously, and for sweeping arrival forecasts. Results are flattened into rows (see
+:mod:`sptrans.frames`) and streamed, as they arrive, as NDJSON, CSV or Parquet:
+::
+
+    export SPTRANS_TOKEN='this is my token'
+
+    sptrans catalogue lanes
+    sptrans --format csv --output stops.csv catalogue lane-stops
+    sptrans --concurrency 8 --rate 4 positions 1234 5678 --interval 30 --count 120
+    sptrans --format parquet --output forecasts.parquet forecasts --stops 4200953 340015329
+
+Run ``sptrans --help`` or ``sptrans <subcommand> --help`` for all the options. Parquet output needs
+`pyarrow <https://arrow.apache.org/>`_ to be installed, and an output file. CSV and Parquet files have a single set of
+columns, so forecasts of stops and of routes, which are flattened into different columns, need separate sweeps for them.
+"""
+
+import argparse
+from collections import OrderedDict
+import csv
+from datetime import datetime
+from importlib import import_module
+import io
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from sptrans.frames import to_columns
+from sptrans.v0 import (
+    BASE_URL,
+    AuthenticationError,
+    Client,
+    ForecastWithStop,
+    ForecastWithStops,
+    Lane,
+    Positions,
+    RequestError,
+    Route,
+    Stop,
+)
+
+
+FORMATS = ('ndjson', 'csv', 'parquet')
+_PY2 = sys.version_info[0] == 2
+_text = type(u'')
+
+
+def rows(tuple_class, result, extra=()):
+    """Flattens a result into rows.
+
+    :param tuple_class: The model class of the result, like :class:`sptrans.v0.Positions`.
+    :param result: The result, as a model.
+    :param extra: (name, value) pairs of columns to prepend to every row.
+    :return: A :class:`list` of :class:`collections.OrderedDict` objects, one per row.
+    """
+    columns = to_columns(tuple_class, result)
+    flattened = []
+    for values in zip(*columns.values()):
+        row = OrderedDict(extra)
+        row.update(zip(columns, values))
+        flattened.append(row)
+    return flattened
+
+
+class RateLimiter(object):
+    """Limiter of how many calls are made per second, shared by many threads.
+
+    :param rate: How many calls per second are allowed, or `None` for no limit.
+    :type rate: :class:`float`
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed."""
+        if not self.rate:
+            return
+        with self._lock:
+            moment = time.time()
+            wait_until = max(moment, self._next_at)
+            self._next_at = wait_until + 1.0 / self.rate
+        if wait_until > moment:
+            time.sleep(wait_until - moment)
+
+
+class NDJSONWriter(object):
+    """Writer of rows as newline-delimited JSON objects, with datetimes in ISO 8601 format."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, batch):
+        for row in batch:
+            self.stream.write(json.dumps(row, default=_serialize))
+            self.stream.write('\n')
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class CSVWriter(object):
+    """Writer of rows as CSV, with a header taken from the first row."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._writer = None
+
+    def write(self, batch):
+        for row in batch:
+            if self._writer is None:
+                self._writer = csv.DictWriter(self.stream, list(row), extrasaction='ignore')
+                self._writer.writeheader()
+            if _PY2:  # pragma: no cover
+                # The csv module of Python 2 only writes byte strings.
+                row = dict((name, value.encode('utf-8') if isinstance(value, _text) else value) for name, value in row.items())
+            self._writer.writerow(row)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class ParquetWriter(object):
+    """Writer of rows as a Parquet file, with one row group per batch and the schema taken from the first batch."""
+
+    def __init__(self, path):
+        self.path = path
+        self._pyarrow = _import_pyarrow('pyarrow')
+        self._parquet = _import_pyarrow('pyarrow.parquet')
+        self._writer = None
+
+    def write(self, batch):
+        if not batch:
+            return
+        columns = OrderedDict((name, [row.get(name) for row in batch]) for name in batch[0])
+        if self._writer is None:
+            table = self._pyarrow.table(columns)
+            self._writer = self._parquet.ParquetWriter(self.path, table.schema)
+        else:
+            table = self._pyarrow.Table.from_pydict(columns, schema=self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def build_parser():
+    """Builds the command-line arguments parser.
+
+    :return: An :class:`argparse.ArgumentParser`.
+    """
+    parser = argparse.ArgumentParser(prog='sptrans', description='Extracts data from the SPTrans API in bulk.')
+    parser.add_argument('--token', default=os.environ.get('SPTRANS_TOKEN'),
+                        help='the API token, defaults to the SPTRANS_TOKEN environment variable')
+    parser.add_argument('--base-url', default=BASE_URL, help='the base URL of the API')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='the output format (default: %(default)s)')
+    parser.add_argument('--output', default='-', help='the output file, or "-" for the standard output (default)')
+    parser.add_argument('--concurrency', type=int, default=4, help='how many requests to make at once (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=None, help='the maximum number of requests per second')
+    subparsers = parser.add_subparsers(dest='command')
+
+    catalogue = subparsers.add_parser('catalogue', help='downloads routes, stops and lanes')
+    catalogue.add_argument('kind', choices=('routes', 'stops', 'lanes', 'lane-stops', 'route-stops'))
+    catalogue.add_argument('terms', nargs='*',
+                           help='the search keywords, for routes and stops, or the route codes, for route-stops')
+
+    positions = subparsers.add_parser('positions', help='records the vehicle positions of routes, continuously')
+    positions.add_argument('route_codes', nargs='+', type=int, metavar='route_code')
+    positions.add_argument('--interval', type=float, default=30, help='the seconds between sweeps (default: %(default)s)')
+    positions.add_argument('--count', type=int, default=0, help='how many sweeps to make, or 0 to never stop (default)')
+
+    forecasts = subparsers.add_parser('forecasts', help='sweeps the arrival forecasts of stops or routes')
+    forecasts.add_argument('--stops', nargs='+', type=int, default=[], metavar='stop_code')
+    forecasts.add_argument('--routes', nargs='+', type=int, default=[], metavar='route_code')
+    return parser
+
+
+def main(argv=None):
+    """Runs the command-line tool.
+
+    :param argv: The arguments, defaults to the ones the process was called with.
+    :type argv: :class:`list` of :class:`str`
+    :return: The process exit status.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a subcommand is required')
+    if args.token is None:
+        parser.error('provide a token with --token or the SPTRANS_TOKEN environment variable')
+    if args.format == 'parquet' and args.output == '-':
+        parser.error('Parquet output needs an output file')
+    if args.command == 'catalogue' and args.kind in ('routes', 'stops', 'route-stops') and not args.terms:
+        parser.error('catalogue {} needs at least one term'.format(args.kind))
+    if args.command == 'forecasts' and not (args.stops or args.routes):
+        parser.error('forecasts needs --stops or --routes')
+    if args.command == 'forecasts' and args.stops and args.routes and args.format != 'ndjson':
+        parser.error('forecasts of stops and routes have different columns; sweep them separately for {} output'.format(
+            args.format))
+
+    client = Client(token=args.token, base_url=args.base_url, pool_size=max(args.concurrency, 1))
+    try:
+        client.authenticate()
+    except AuthenticationError as error:
+        sys.stderr.write('sptrans: {}\n'.format(error))
+        return 1
+    limiter = RateLimiter(args.rate)
+    writer, stream = _open_writer(args.format, args.output)
+    pool = ThreadPool(max(args.concurrency, 1))
+    try:
+        commands = {'catalogue': _catalogue, 'positions': _positions, 'forecasts': _forecasts}
+        commands[args.command](client, args, pool, limiter, writer)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.terminate()
+        writer.close()
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+    return 0
+
+
+def _catalogue(client, args, pool, limiter, writer):
+    if args.kind == 'lanes':
+        limiter.wait()
+        for lane in client.list_lanes():
+            writer.write(rows(Lane, lane))
+        return
+    if args.kind == 'lane-stops':
+        limiter.wait()
+        tasks = [('lane_code', lane.code, client.search_stops_by_lane) for lane in client.list_lanes()]
+        tuple_class = Stop
+    elif args.kind == 'route-stops':
+        tasks = [('route_code', int(code), client.search_stops_by_route) for code in args.terms]
+        tuple_class = Stop
+    elif args.kind == 'routes':
+        tasks = [('terms', terms, client.search_routes) for terms in args.terms]
+        tuple_class = Route
+    else:
+        tasks = [('terms', terms, client.search_stops) for terms in args.terms]
+        tuple_class = Stop
+
+    def fetch(task):
+        name, value, search = task
+        limiter.wait()
+        return [(name, value)], list(search(value))
+
+    for extra, items in _fetch_all(pool, fetch, tasks):
+        for item in items:
+            writer.write(rows(tuple_class, item, extra))
+
+
+def _positions(client, args, pool, limiter, writer):
+    def fetch(route_code):
+        limiter.wait()
+        return route_code, client.get_positions(route_code)
+
+    sweeps = 0
+    while not args.count or sweeps < args.count:
+        started_at = time.time()
+        observed_at = datetime.now().replace(microsecond=0)
+        for route_code, positions in _fetch_all(pool, fetch, args.route_codes):
+            writer.write(rows(Positions, positions, [('observed_at', observed_at), ('route_code', route_code)]))
+        sweeps += 1
+        if not args.count or sweeps < args.count:
+            time.sleep(max(0.0, args.interval - (time.time() - started_at)))
+
+
+def _forecasts(client, args, pool, limiter, writer):
+    def fetch(task):
+        kind, code = task
+        limiter.wait()
+        if kind == 'stop':
+            return ForecastWithStop, [], client.get_forecast(stop_code=code)
+        return ForecastWithStops, [('route_code', code)], client.get_forecast(route_code=code)
+
+    tasks = [('stop', code) for code in args.stops] + [('route', code) for code in args.routes]
+    for tuple_class, extra, forecast in _fetch_all(pool, fetch, tasks):
+        writer.write(rows(tuple_class, forecast, extra))
+
+
+def _fetch_all(pool, fetch, tasks):
+    # Results are yielded in the order of the tasks, as soon as they arrive; failed requests are reported and skipped, so that
+    # a single failure doesn't interrupt a whole sweep.
+    def guarded(task):
+        try:
+            return fetch(task)
+        except (RequestError, requests.RequestException) as error:
+            sys.stderr.write('sptrans: {!r} failed: {}\n'.format(task, error))
+            return None
+
+    for result in pool.imap(guarded, tasks):
+        if result is not None:
+            yield result
+
+
+def _open_writer(output_format, output):
+    if output_format == 'parquet':
+        return ParquetWriter(output), None
+    if output == '-':
+        stream = sys.stdout
+    elif _PY2:  # pragma: no cover
+        # Both json.dumps and the csv module write byte strings on Python 2, like its sys.stdout takes.
+        stream = open(output, 'wb')
+    else:
+        stream = io.open(output, 'w', encoding='utf-8', newline='')
+    if output_format == 'csv':
+        return CSVWriter(stream), stream
+    return NDJSONWriter(stream), stream
+
+
+def _import_pyarrow(name):
+    try:
+        return import_module(name)
+    except ImportError:
+        raise ImportError('Parquet output needs the "pyarrow" package to be installed')
+
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
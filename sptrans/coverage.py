@@ -0,0 +1,243 @@
+"""Module for keeping fleet-wide statistics of the vehicles and their accessibility, per route and per area of the city.
+
+A :class:`CoverageEngine` consumes sweeps of vehicle positions and keeps, per route and per cell of a grid over the city,
+how many positions were seen, how many of them were of accessible vehicles, and how many distinct vehicles - all of them and
+the accessible ones - were seen, estimated with :class:`HyperLogLog` sketches:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.coverage import CoverageEngine
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    engine = CoverageEngine(cell_size=500)
+    for route_code in route_codes:
+        engine.record(route_code, client.get_positions(route_code))
+
+    stats = engine.route(1234)
+    print(stats.ratio, stats.vehicles, stats.accessible_vehicles)
+    downtown = engine.region([(-23.54, -46.64), (-23.54, -46.62), (-23.56, -46.62), (-23.56, -46.64)])
+
+The memory used depends only on how many routes and cells were seen, never on how many sweeps were recorded, so an engine
+can be fed for weeks; the sketches of the cells are merged when querying regions.
+"""
+
+from collections import namedtuple
+import hashlib
+from math import log
+import struct
+
+from sptrans.geo import Grid, within
+
+
+MAX_HASHES = 65536
+
+CoverageStats = namedtuple('CoverageStats', ['key', 'observations', 'accessible', 'ratio', 'vehicles', 'accessible_vehicles'])
+"""A namedtuple representing the coverage statistics of a route, a grid cell or a region.
+
+:var key: The route code, the (latitude, longitude) of the center of the grid cell, or `None` for regions and the whole fleet.
+:var observations: (:class:`int`) How many vehicle positions were recorded.
+:var accessible: (:class:`int`) How many of the positions were of accessible vehicles.
+:var ratio: (:class:`float`) The fraction of the positions that were of accessible vehicles, or `None` without positions.
+:var vehicles: (:class:`int`) The estimated number of distinct vehicles seen.
+:var accessible_vehicles: (:class:`int`) The estimated number of distinct accessible vehicles seen.
+"""
+
+
+def _locate(value, precision):
+    # The register and the rank of a value, from a 64 bits hash that is the same in every process, unlike hash().
+    hashed = struct.unpack('>Q', hashlib.sha1(u'{}'.format(value).encode('utf-8')).digest()[:8])[0]
+    remaining_bits = 64 - precision
+    return hashed >> remaining_bits, remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+
+
+class HyperLogLog(object):
+    """Sketch estimating how many distinct strings were added to it, in constant memory.
+
+    The registers take ``2 ** precision`` bytes, and the standard error of the estimates is about
+    ``1.04 / sqrt(2 ** precision)`` - 3.25% with the default precision.
+
+    :param precision: How many bits of the hashes select the registers, from 4 to 16.
+    :type precision: :class:`int`
+    :raises: :class:`ValueError` when the precision is out of range.
+    """
+
+    def __init__(self, precision=10):
+        if not 4 <= precision <= 16:
+            raise ValueError('The precision must be from 4 to 16, not {!r}'.format(precision))
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """Adds a string to the sketch.
+
+        :param value: The string.
+        :type value: :class:`str`
+        """
+        self._set(*_locate(value, self.precision))
+
+    def count(self):
+        """Estimates how many distinct strings were added.
+
+        :return: The estimate, as an :class:`int`.
+        """
+        size = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more precise for small cardinalities.
+            estimate = size * log(float(size) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """Adds all the strings added to another sketch, of the same precision.
+
+        :param other: The other sketch.
+        :type other: :class:`HyperLogLog`
+        :raises: :class:`ValueError` when the precisions differ.
+        """
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of precisions {} and {}'.format(self.precision, other.precision))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def _set(self, index, rank):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+
+class _Counter(object):
+    __slots__ = ('observations', 'accessible', 'vehicles', 'accessible_vehicles')
+
+    def __init__(self, precision):
+        self.observations = 0
+        self.accessible = 0
+        self.vehicles = HyperLogLog(precision)
+        self.accessible_vehicles = HyperLogLog(precision)
+
+    def add(self, location, accessible):
+        self.observations += 1
+        self.vehicles._set(*location)
+        if accessible:
+            self.accessible += 1
+            self.accessible_vehicles._set(*location)
+
+    def stats(self, key):
+        ratio = float(self.accessible) / self.observations if self.observations else None
+        return CoverageStats(key, self.observations, self.accessible, ratio, self.vehicles.count(),
+                             self.accessible_vehicles.count())
+
+
+class CoverageEngine(object):
+    """Engine keeping running coverage statistics per route and per grid cell, from sweeps of vehicle positions.
+
+    :param cell_size: The side of the grid cells, in meters.
+    :type cell_size: :class:`float`
+    :param precision: The precision of the :class:`HyperLogLog` sketches; each route and each cell keeps two sketches of
+                      ``2 ** precision`` bytes.
+    :type precision: :class:`int`
+    """
+
+    def __init__(self, cell_size=500, precision=10):
+        self.cell_size = cell_size
+        self.precision = precision
+        self._grid = Grid(cell_size)
+        self._routes = {}
+        self._cells = {}
+        self._overall = _Counter(precision)
+        self._locations = {}
+
+    def record(self, route_code, positions):
+        """Records a sweep of the positions of a route.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param positions: The positions, as returned by :meth:`sptrans.v0.Client.get_positions`.
+        :type positions: :class:`sptrans.v0.Positions`
+        :return: How many positions were recorded.
+        """
+        route = self._routes.get(route_code)
+        if route is None:
+            route = self._routes[route_code] = _Counter(self.precision)
+        for vehicle in positions.vehicles:
+            location = self._locate(vehicle.prefix)
+            cell_key = self._grid.cell(vehicle.latitude, vehicle.longitude)
+            cell = self._cells.get(cell_key)
+            if cell is None:
+                cell = self._cells[cell_key] = _Counter(self.precision)
+            for counter in (route, cell, self._overall):
+                counter.add(location, vehicle.accessible)
+        return len(positions.vehicles)
+
+    def route(self, route_code):
+        """Gets the statistics of a route.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :return: A :class:`CoverageStats` object, or `None` if the route was never recorded.
+        """
+        counter = self._routes.get(route_code)
+        return None if counter is None else counter.stats(route_code)
+
+    def routes(self):
+        """Gets the statistics of all the recorded routes.
+
+        :return: A :class:`dict` mapping the route codes to :class:`CoverageStats` objects.
+        """
+        return dict((route_code, counter.stats(route_code)) for route_code, counter in self._routes.items())
+
+    def cell(self, latitude, longitude):
+        """Gets the statistics of the grid cell containing a point.
+
+        :return: A :class:`CoverageStats` object, or `None` if no vehicle was seen in the cell.
+        """
+        cell_key = self._grid.cell(latitude, longitude)
+        counter = self._cells.get(cell_key)
+        return None if counter is None else counter.stats(self._grid.center(cell_key))
+
+    def cells(self):
+        """Gets the statistics of all the grid cells where vehicles were seen.
+
+        :return: A :class:`list` of :class:`CoverageStats` objects, keyed by the centers of the cells.
+        """
+        return [counter.stats(self._grid.center(cell_key)) for cell_key, counter in self._cells.items()]
+
+    def region(self, polygon):
+        """Gets the statistics of a region, merging the grid cells whose centers are within it.
+
+        :param polygon: The region vertices, in any of the forms accepted by :func:`sptrans.geo.coordinates`.
+        :return: A :class:`CoverageStats` object.
+        """
+        cell_keys = list(self._cells)
+        centers = [self._grid.center(cell_key) for cell_key in cell_keys]
+        counters = [self._cells[cell_key] for cell_key, inside in zip(cell_keys, within(centers, polygon)) if inside]
+        merged = _Counter(self.precision)
+        merged.observations = sum(counter.observations for counter in counters)
+        merged.accessible = sum(counter.accessible for counter in counters)
+        # The registers of all the cells are merged in a single pass, instead of one cell at a time.
+        if len(counters) > 1:
+            merged.vehicles.registers = bytearray(map(max, *[counter.vehicles.registers for counter in counters]))
+            merged.accessible_vehicles.registers = bytearray(
+                map(max, *[counter.accessible_vehicles.registers for counter in counters]))
+        elif counters:
+            merged.vehicles.merge(counters[0].vehicles)
+            merged.accessible_vehicles.merge(counters[0].accessible_vehicles)
+        return merged.stats(None)
+
+    def overall(self):
+        """Gets the statistics of the whole fleet.
+
+        :return: A :class:`CoverageStats` object.
+        """
+        return self._overall.stats(None)
+
+    def _locate(self, prefix):
+        # Vehicles are seen again at every sweep, so their hashes are kept, up to a limit.
+        location = self._locations.get(prefix)
+        if location is None:
+            if len(self._locations) >= MAX_HASHES:
+                self._locations.clear()
+            location = self._locations[prefix] = _locate(prefix, self.precision)
+        return location
@@ -0,0 +1,137 @@
+"""Module for finding what changed between consecutive route-wide forecasts.
+
+Polling ``Previsao/Linha`` returns every stop of a route at each time, even though most of them are unchanged since the last
+poll. A :class:`ForecastDiffer` keeps a fingerprint of each stop - its vehicles and their forecast arrival times - and
+returns just the stops that changed, each as a compact :class:`StopChange`, so that downstream work depends on how much
+changed, not on the size of the routes:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.diffing import ForecastDiffer
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    differ = ForecastDiffer()
+    for change in differ.update(1234, client.get_forecast(route_code=1234)):
+        print(change.kind, change.stop_code, [vehicle.prefix for vehicle in change.added], change.removed)
+
+Vehicle positions are not part of the fingerprints, since they change at every poll; a stop only changes when vehicles are
+added to or removed from it, or when their arrival times change. The first update of a route returns all of its stops as
+added.
+"""
+
+from collections import namedtuple
+
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+StopChange = namedtuple('StopChange', ['route_code', 'stop_code', 'kind', 'stop', 'added', 'removed', 'updated'])
+"""A namedtuple representing the changes in the forecast of a stop.
+
+:var route_code: (:class:`int`) The route code.
+:var stop_code: (:class:`int`) The stop code.
+:var kind: (:class:`str`) Either :data:`ADDED`, for stops that were not in the previous forecast, :data:`REMOVED`, for stops
+    that are not in the current one, or :data:`CHANGED`.
+:var stop: (:class:`sptrans.v0.StopWithVehicles`) The stop in the current forecast, or `None` if it was removed.
+:var added: (:class:`list` of :class:`sptrans.v0.VehicleForecast`) The vehicles that started being forecast for the stop.
+:var removed: (:class:`list` of :class:`str`) The prefixes of the vehicles that stopped being forecast for the stop.
+:var updated: (:class:`list`) (:class:`sptrans.v0.VehicleForecast`, previous arrival time) pairs, for the vehicles whose
+    arrival times changed.
+"""
+
+
+def diff_forecasts(route_code, previous, current):
+    """Finds the stops that changed between two forecasts of a route.
+
+    :param route_code: The route code.
+    :type route_code: :class:`int`
+    :param previous: The previous forecast, or `None` if there is none.
+    :type previous: :class:`sptrans.v0.ForecastWithStops`
+    :param current: The current forecast.
+    :type current: :class:`sptrans.v0.ForecastWithStops`
+    :return: A :class:`list` of :class:`StopChange` objects, in the order of the stops.
+    """
+    fingerprints = {} if previous is None else dict((stop.code, _fingerprint(stop)) for stop in previous.stops)
+    return _diff(route_code, fingerprints, current)[0]
+
+
+class ForecastDiffer(object):
+    """Differ of the consecutive forecasts of many routes.
+
+    Only the fingerprints of the last forecast of each route are kept, not the forecasts themselves.
+    """
+
+    def __init__(self):
+        self._fingerprints = {}
+
+    def update(self, route_code, forecast):
+        """Compares a new forecast of a route with the previous one, and keeps it for the next comparison.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param forecast: The forecast for the route, as returned by :meth:`sptrans.v0.Client.get_forecast` with only a `route_code`.
+        :type forecast: :class:`sptrans.v0.ForecastWithStops`
+        :return: A :class:`list` of :class:`StopChange` objects, in the order of the stops.
+        """
+        changes, self._fingerprints[route_code] = _diff(route_code, self._fingerprints.get(route_code, {}), forecast)
+        return changes
+
+    def forget(self, route_code):
+        """Drops everything known about a route, so that its next update returns all of its stops as added.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        """
+        self._fingerprints.pop(route_code, None)
+
+    def route_codes(self):
+        """Lists the routes known by the differ.
+
+        :return: A :class:`list` of route codes.
+        """
+        return list(self._fingerprints)
+
+    def stop_codes(self, route_code):
+        """Lists the stops of a route, as of its last update.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :return: A :class:`list` of stop codes.
+        """
+        return list(self._fingerprints.get(route_code, {}))
+
+
+def _fingerprint(stop):
+    return tuple((vehicle.prefix, vehicle.arriving_at) for vehicle in stop.vehicles)
+
+
+def _diff(route_code, previous, forecast):
+    # Fingerprints are compared as a whole first, which is enough for the unchanged stops; only the changed ones are compared
+    # vehicle by vehicle.
+    changes = []
+    fingerprints = {}
+    for stop in forecast.stops:
+        fingerprint = _fingerprint(stop)
+        fingerprints[stop.code] = fingerprint
+        old = previous.get(stop.code)
+        if old == fingerprint:
+            continue
+        if old is None:
+            changes.append(StopChange(route_code, stop.code, ADDED, stop, list(stop.vehicles), [], []))
+            continue
+        arrivals = dict(old)
+        prefixes = set(vehicle.prefix for vehicle in stop.vehicles)
+        added = [vehicle for vehicle in stop.vehicles if vehicle.prefix not in arrivals]
+        removed = [prefix for prefix, _ in old if prefix not in prefixes]
+        updated = [(vehicle, arrivals[vehicle.prefix]) for vehicle in stop.vehicles
+                   if vehicle.prefix in arrivals and arrivals[vehicle.prefix] != vehicle.arriving_at]
+        if added or removed or updated:
+            changes.append(StopChange(route_code, stop.code, CHANGED, stop, added, removed, updated))
+    for stop_code, old in previous.items():
+        if stop_code not in fingerprints:
+            changes.append(StopChange(route_code, stop_code, REMOVED, None, [], [prefix for prefix, _ in old], []))
+    return changes, fingerprints
@@ -0,0 +1,121 @@
+"""Module for exporting the API results as dataframes.
+
+Nested results are flattened into tidy, long tables, with one row per innermost item - for example, one row per vehicle in
+a :class:`sptrans.v0.ForecastWithStop`, repeating the stop and route columns -, and columns named after the attribute paths,
+like ``stop.routes.vehicles.prefix``:
+::
+
+    from sptrans.v0 import Client, ForecastWithStop
+    from sptrans.frames import to_pandas
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    frame = to_pandas(ForecastWithStop, client.get_forecast(stop_code=1234))
+    print(frame[['stop.routes.sign', 'stop.routes.vehicles.arriving_at']])
+
+Both the models returned by :class:`sptrans.v0.Client` and the raw decoded JSON results can be exported; the latter is
+faster, since the columns are built straight from the result dicts, without creating the models at all.
+Rows of parents without any children (like stops without vehicles) are left out of the tables.
+
+`pandas <http://pandas.pydata.org/>`_ and `pyarrow <https://arrow.apache.org/>`_ are optional dependencies, only imported
+when exporting to them.
+"""
+
+from collections import OrderedDict
+from importlib import import_module
+
+from sptrans.v0 import TupleField, TupleListField
+
+
+def to_columns(tuple_class, data):
+    """Flattens results into columns.
+
+    :param tuple_class: The model class of the results, like :class:`sptrans.v0.Positions`.
+    :param data: A single result or a sequence of results, either as models or as decoded JSON dicts.
+    :return: An :class:`collections.OrderedDict` mapping column names to lists of values.
+    """
+    if isinstance(data, (dict, tuple_class)):
+        data = [data]
+    else:
+        data = list(data)
+    raw = bool(data) and isinstance(data[0], dict)
+    return _flatten(tuple_class, data, '', raw)[0]
+
+
+def to_pandas(tuple_class, data):
+    """Exports results as a :class:`pandas.DataFrame`.
+
+    :param tuple_class: The model class of the results, like :class:`sptrans.v0.Positions`.
+    :param data: A single result or a sequence of results, either as models or as decoded JSON dicts.
+    :return: A :class:`pandas.DataFrame`.
+    """
+    pandas = _import('pandas')
+    columns = to_columns(tuple_class, data)
+    return pandas.DataFrame(columns, columns=list(columns))
+
+
+def to_arrow(tuple_class, data):
+    """Exports results as a :class:`pyarrow.Table`.
+
+    :param tuple_class: The model class of the results, like :class:`sptrans.v0.Positions`.
+    :param data: A single result or a sequence of results, either as models or as decoded JSON dicts.
+    :return: A :class:`pyarrow.Table`.
+    """
+    pyarrow = _import('pyarrow')
+    columns = to_columns(tuple_class, data)
+    return pyarrow.table(columns)
+
+
+def _import(name):
+    try:
+        return import_module(name)
+    except ImportError:
+        raise ImportError('Exporting to {0} needs the "{0}" package to be installed'.format(name))
+
+
+def _flatten(tuple_class, items, prefix, raw):
+    # Returns the columns, the index of the item each of their rows came from, and whether there are lists among the items.
+    identity = list(range(len(items)))
+    columns = OrderedDict()
+    exploded = None
+    for name in tuple_class._fields:
+        value = tuple_class.MAPPING[name]
+        path = prefix + name
+        if isinstance(value, TupleListField):
+            children = []
+            parents = []
+            for position, item in enumerate(items):
+                internal_items = item[value.field] if raw else getattr(item, name)
+                children.extend(internal_items)
+                parents.extend([position] * len(internal_items))
+            nested, index, _ = _flatten(value.tuple_class, children, path + '.', raw)
+            index = [parents[child] for child in index]
+            nested_exploded = True
+        elif isinstance(value, TupleField):
+            internal_items = [item[value.field] if raw else getattr(item, name) for item in items]
+            nested, index, nested_exploded = _flatten(value.tuple_class, internal_items, path + '.', raw)
+        else:
+            if not raw:
+                columns[path] = [getattr(item, name) for item in items]
+            elif isinstance(value, str):
+                columns[path] = [item[value] for item in items]
+            else:
+                columns[path] = value.resolve_many(items)
+            continue
+        if nested_exploded:
+            if exploded is not None:
+                raise ValueError('Cannot flatten {} into a single table, since it has more than one list of children'.format(
+                    tuple_class.__name__))
+            exploded = (path, index)
+        for nested_path, column in nested.items():
+            columns[nested_path] = column
+    if exploded is None:
+        return columns, identity, False
+    exploded_path, index = exploded
+    exploded_prefix = exploded_path + '.'
+    for path, column in columns.items():
+        if not path.startswith(exploded_prefix):
+            columns[path] = [column[position] for position in index]
+    return columns, index, True
@@ -0,0 +1,365 @@
+"""Module with geographic helpers for the coordinates returned by the API.
+
+Distances are in meters, and bearings in degrees, clockwise from the north. Besides the functions for a single pair of
+points, there are functions working on many points at once, which take sequences of models - like stops and vehicles -,
+sequences of (latitude, longitude) pairs or columns straight from :func:`sptrans.frames.to_columns`:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.geo import distance_matrix, nearest, within
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    stops = list(client.search_stops_by_lane(8))
+    positions = client.get_positions(1234)
+
+    matrix = distance_matrix(positions.vehicles, stops)
+    matches = nearest(positions.vehicles, stops, max_distance=200)
+    downtown = within(positions.vehicles, [(-23.54, -46.64), (-23.54, -46.62), (-23.56, -46.62), (-23.56, -46.64)])
+
+For indexing points by area, :class:`Projection` maps coordinates to planar meters and :class:`Grid` splits the plane in
+square cells; these are what the other modules use for their spatial indexes.
+"""
+
+from math import asin, atan2, ceil, cos, degrees, floor, radians, sin, sqrt
+
+try:
+    from collections import Mapping
+except ImportError:  # pragma: no cover
+    from collections.abc import Mapping
+
+
+EARTH_RADIUS = 6371008.8
+"""The mean Earth radius, in meters."""
+METERS_PER_DEGREE = radians(1) * EARTH_RADIUS
+"""The length of a degree of latitude, in meters."""
+SAO_PAULO_LATITUDE = -23.55
+"""The latitude of the center of Sao Paulo, the default reference of :class:`Projection`."""
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """Calculates the great-circle distance between two points, using the haversine formula.
+
+    :return: The distance, in meters, as a :class:`float`.
+    """
+    phi1 = radians(latitude1)
+    phi2 = radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = radians(longitude2 - longitude1)
+    a = sin(delta_phi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * atan2(sqrt(a), sqrt(1 - a))
+
+
+def bearing(latitude1, longitude1, latitude2, longitude2):
+    """Calculates the initial bearing when going from the first point to the second one.
+
+    :return: The bearing, in degrees from 0 to 360, as a :class:`float`.
+    """
+    phi1 = radians(latitude1)
+    phi2 = radians(latitude2)
+    delta_lambda = radians(longitude2 - longitude1)
+    y = sin(delta_lambda) * cos(phi2)
+    x = cos(phi1) * sin(phi2) - sin(phi1) * cos(phi2) * cos(delta_lambda)
+    return degrees(atan2(y, x)) % 360
+
+
+def coordinates(points):
+    """Extracts the coordinates of many points at once.
+
+    :param points: The points, as a sequence of models (any objects with `latitude` and `longitude` attributes, like
+        :class:`sptrans.v0.Stop` or :class:`sptrans.v0.Vehicle`), a sequence of (latitude, longitude) pairs, or columns - a
+        mapping with `latitude` and `longitude` sequences, like the ones from :func:`sptrans.frames.to_columns`, where the
+        names may also end with ``.latitude`` and ``.longitude``.
+    :return: A pair of :class:`list` objects, with the latitudes and the longitudes.
+    """
+    if isinstance(points, Mapping):
+        return list(_column(points, 'latitude')), list(_column(points, 'longitude'))
+    points = list(points)
+    if points and hasattr(points[0], 'latitude'):
+        return [point.latitude for point in points], [point.longitude for point in points]
+    return [point[0] for point in points], [point[1] for point in points]
+
+
+def distances(origins, destinations):
+    """Calculates the great-circle distances between pairs of points, the first origin to the first destination and so on.
+
+    :param origins: The origins, in any of the forms accepted by :func:`coordinates`.
+    :param destinations: The destinations, in any of the forms accepted by :func:`coordinates`.
+    :return: A :class:`list` of distances, in meters.
+    """
+    latitudes1, longitudes1 = coordinates(origins)
+    latitudes2, longitudes2 = coordinates(destinations)
+    return [distance(*pair) for pair in zip(latitudes1, longitudes1, latitudes2, longitudes2)]
+
+
+def bearings(origins, destinations):
+    """Calculates the initial bearings between pairs of points, the first origin to the first destination and so on.
+
+    :param origins: The origins, in any of the forms accepted by :func:`coordinates`.
+    :param destinations: The destinations, in any of the forms accepted by :func:`coordinates`.
+    :return: A :class:`list` of bearings, in degrees from 0 to 360.
+    """
+    latitudes1, longitudes1 = coordinates(origins)
+    latitudes2, longitudes2 = coordinates(destinations)
+    return [bearing(*pair) for pair in zip(latitudes1, longitudes1, latitudes2, longitudes2)]
+
+
+def distance_matrix(origins, destinations):
+    """Calculates the great-circle distances from every origin to every destination.
+
+    Each point is converted to a vector only once, so this is faster than calling :func:`distance` for each pair; still, the matrix grows with the product of both sizes, so prefer :func:`nearest` for finding the closest
+    points among large sets.
+
+    :param origins: The origins, in any of the forms accepted by :func:`coordinates`.
+    :param destinations: The destinations, in any of the forms accepted by :func:`coordinates`.
+    :return: A :class:`list` with a row per origin, each a :class:`list` of distances, in meters, to the destinations.
+    """
+    origins = _unit_vectors(*coordinates(origins))
+    destinations = _unit_vectors(*coordinates(destinations))
+    diameter = 2 * EARTH_RADIUS
+    # The great-circle distance follows from the straight (chord) distance between the points on a unit sphere.
+    return [[diameter * asin(min(sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) / 2, 1.0))
+             for x2, y2, z2 in destinations]
+            for x1, y1, z1 in origins]
+
+
+def nearest(points, candidates, max_distance=None):
+    """Finds, for each point, the nearest of the candidates - like the nearest stop to each vehicle.
+
+    The candidates are indexed in a grid over a local planar projection, so each point is only compared with the candidates
+    around it; at the scale of a city, the planar distances pick the same candidates as the great-circle ones.
+    Example:
+    ::
+
+        from sptrans.geo import nearest
+
+
+        stops = list(client.search_stops_by_lane(8))
+        for vehicle, match in zip(positions.vehicles, nearest(positions.vehicles, stops, max_distance=100)):
+            if match is not None:
+                index, meters = match
+                print(vehicle.prefix, stops[index].name, meters)
+
+    :param points: The points, in any of the forms accepted by :func:`coordinates`.
+    :param candidates: The candidates, in any of the forms accepted by :func:`coordinates`.
+    :param max_distance: How far, in meters, the candidates may be, or `None` for no limit.
+    :type max_distance: :class:`float`
+    :raises: :class:`ValueError` when the maximum distance is not positive.
+    :return: A :class:`list` with, for each point, an (index of the nearest candidate, great-circle distance in meters) pair,
+        or `None` when there are no candidates within the maximum distance.
+    """
+    if max_distance is not None and not max_distance > 0:
+        raise ValueError('The maximum distance must be positive, not {!r}'.format(max_distance))
+    latitudes, longitudes = coordinates(points)
+    candidate_latitudes, candidate_longitudes = coordinates(candidates)
+    if not candidate_latitudes:
+        return [None] * len(latitudes)
+    projection = Projection.around(candidate_latitudes)
+    projected = [projection.project(*pair) for pair in zip(candidate_latitudes, candidate_longitudes)]
+    cell_size = _cell_size(projected)
+    if max_distance is not None:
+        cell_size = min(cell_size, max_distance)
+    grid = Grid(cell_size, projection)
+    cells = {}
+    for index, (x, y) in enumerate(projected):
+        cells.setdefault(grid.key(x, y), []).append((x, y, index))
+    columns = [cell[0] for cell in cells]
+    rows = [cell[1] for cell in cells]
+    first_column, last_column, first_row, last_row = min(columns), max(columns), min(rows), max(rows)
+
+    matches = []
+    project, key = projection.project, grid.key
+    for latitude, longitude in zip(latitudes, longitudes):
+        x, y = project(latitude, longitude)
+        cell_x, cell_y = key(x, y)
+        # Beyond this ring, there are no more cells with candidates, or they are all too far.
+        last_ring = max(cell_x - first_column, last_column - cell_x, cell_y - first_row, last_row - cell_y)
+        if max_distance is not None:
+            last_ring = min(last_ring, int(ceil(max_distance / cell_size)))
+        best = None
+        best_squared = float('inf')
+        for ring in range(last_ring + 1):
+            if (2 * ring + 1) ** 2 > len(cells):
+                # Points far from the candidates - like bogus (0, 0) positions - would go through many empty rings, so once
+                # the rings cover more cells than the ones with candidates, these are scanned instead.
+                best, best_squared = _scan(cells, cell_size, x, y, cell_x, cell_y, ring, last_ring, best, best_squared)
+                break
+            for cell in _ring(cell_x, cell_y, ring):
+                for candidate_x, candidate_y, index in cells.get(cell, ()):
+                    squared = (candidate_x - x) ** 2 + (candidate_y - y) ** 2
+                    if squared < best_squared:
+                        best, best_squared = index, squared
+            # Candidates in the next rings are at least this far from the point.
+            if best_squared <= (ring * cell_size) ** 2:
+                break
+        if best is None or (max_distance is not None and best_squared > max_distance ** 2):
+            matches.append(None)
+        else:
+            matches.append((best, distance(latitude, longitude, candidate_latitudes[best], candidate_longitudes[best])))
+    return matches
+
+
+def within(points, polygon):
+    """Tells which points are inside a polygon, like a neighbourhood or a bus lane corridor.
+
+    :param points: The points, in any of the forms accepted by :func:`coordinates`.
+    :param polygon: The polygon vertices, in order and in any of the forms accepted by :func:`coordinates`; closing it, by
+        repeating the first vertex at the end, is optional.
+    :return: A :class:`list` of :class:`bool` values, one per point.
+    """
+    vertex_latitudes, vertex_longitudes = coordinates(polygon)
+    edges = list(zip(vertex_longitudes, vertex_latitudes, vertex_longitudes[-1:] + vertex_longitudes[:-1],
+                     vertex_latitudes[-1:] + vertex_latitudes[:-1]))
+    bottom, top = min(vertex_latitudes or [0]), max(vertex_latitudes or [0])
+    left, right = min(vertex_longitudes or [0]), max(vertex_longitudes or [0])
+    inside = []
+    for latitude, longitude in zip(*coordinates(points)):
+        crossings = False
+        if edges and bottom <= latitude <= top and left <= longitude <= right:
+            # Ray casting: counts how many edges a ray going east from the point crosses.
+            for x1, y1, x2, y2 in edges:
+                if (y1 > latitude) != (y2 > latitude) and longitude < x1 + (latitude - y1) * (x2 - x1) / (y2 - y1):
+                    crossings = not crossings
+        inside.append(crossings)
+    return inside
+
+
+class Projection(object):
+    """Equirectangular projection of coordinates to planar (x, y) meters, east and north.
+
+    Distances are exact along the reference latitude and stretch slowly away from it, which is precise enough within a city -
+    not for comparing points hundreds of kilometers apart.
+
+    :param latitude: The reference latitude, where the scale of the longitudes is exact.
+    :type latitude: :class:`float`
+    """
+
+    def __init__(self, latitude=SAO_PAULO_LATITUDE):
+        self.latitude = latitude
+        self.x_scale = METERS_PER_DEGREE * cos(radians(latitude))
+
+    @classmethod
+    def around(cls, latitudes):
+        """Builds a projection whose reference is the mean of some latitudes.
+
+        :param latitudes: The latitudes; the default reference is used if there are none.
+        :type latitudes: sequence of :class:`float`
+        :return: A :class:`Projection`.
+        """
+        return cls(sum(latitudes) / len(latitudes)) if latitudes else cls()
+
+    def project(self, latitude, longitude):
+        """Projects a point.
+
+        :return: The (x, y) pair, in meters.
+        """
+        return longitude * self.x_scale, latitude * METERS_PER_DEGREE
+
+    def unproject(self, x, y):
+        """Finds the point of a projected pair.
+
+        :return: The (latitude, longitude) pair.
+        """
+        return y / METERS_PER_DEGREE, x / self.x_scale
+
+
+class Grid(object):
+    """Grid of square cells over a :class:`Projection`, for indexing points by area.
+
+    Each cell is identified by a (column, row) key.
+    Example:
+    ::
+
+        from sptrans.geo import Grid
+
+
+        grid = Grid(500)
+        cells = {}
+        for stop in stops:
+            cells.setdefault(grid.cell(stop.latitude, stop.longitude), []).append(stop)
+        print(grid.center(grid.cell(-23.55, -46.63)))
+
+    :param cell_size: The side of the cells, in meters.
+    :type cell_size: :class:`float`
+    :param projection: The projection, which defaults to the one centered at the latitude of Sao Paulo.
+    :type projection: :class:`Projection`
+    """
+
+    def __init__(self, cell_size, projection=None):
+        self.cell_size = cell_size
+        self.projection = projection or Projection()
+
+    def key(self, x, y):
+        """Finds the cell of a projected point.
+
+        :return: The (column, row) key of the cell.
+        """
+        return int(floor(x / self.cell_size)), int(floor(y / self.cell_size))
+
+    def cell(self, latitude, longitude):
+        """Finds the cell of a point.
+
+        :return: The (column, row) key of the cell.
+        """
+        return self.key(*self.projection.project(latitude, longitude))
+
+    def center(self, key):
+        """Finds the center of a cell.
+
+        :param key: The (column, row) key of the cell.
+        :type key: :class:`tuple`
+        :return: The (latitude, longitude) pair.
+        """
+        column, row = key
+        return self.projection.unproject((column + 0.5) * self.cell_size, (row + 0.5) * self.cell_size)
+
+
+def _cell_size(projected):
+    # Cells holding about two candidates each, on average, if they were spread evenly over their bounding box.
+    xs = [x for x, _ in projected]
+    ys = [y for _, y in projected]
+    area = max(max(xs) - min(xs), 1.0) * max(max(ys) - min(ys), 1.0)
+    return max(sqrt(2 * area / len(projected)), 1.0)
+
+
+def _ring(cell_x, cell_y, ring):
+    if ring == 0:
+        yield cell_x, cell_y
+        return
+    for offset in range(-ring, ring + 1):
+        yield cell_x + offset, cell_y - ring
+        yield cell_x + offset, cell_y + ring
+    for offset in range(-ring + 1, ring):
+        yield cell_x - ring, cell_y + offset
+        yield cell_x + ring, cell_y + offset
+
+
+def _scan(cells, cell_size, x, y, cell_x, cell_y, first_ring, last_ring, best, best_squared):
+    for (column, row), candidates in cells.items():
+        ring = max(abs(column - cell_x), abs(row - cell_y))
+        # Candidates in a ring are at least one ring less of cells away from the point.
+        if ring < first_ring or ring > last_ring or ((ring - 1) * cell_size) ** 2 >= best_squared:
+            continue
+        for candidate_x, candidate_y, index in candidates:
+            squared = (candidate_x - x) ** 2 + (candidate_y - y) ** 2
+            if squared < best_squared:
+                best, best_squared = index, squared
+    return best, best_squared
+
+
+def _unit_vectors(latitudes, longitudes):
+    vectors = []
+    for latitude, longitude in zip(latitudes, longitudes):
+        phi = radians(latitude)
+        lambda_ = radians(longitude)
+        vectors.append((cos(phi) * cos(lambda_), cos(phi) * sin(lambda_), sin(phi)))
+    return vectors
+
+
+def _column(columns, name):
+    for key in columns:
+        if key == name or key.endswith('.' + name):
+            return columns[key]
+    raise KeyError('The columns have no {!r} column'.format(name))
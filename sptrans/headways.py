@@ -0,0 +1,167 @@
+"""Module for analysing the headways - the time between consecutive vehicles - of the routes.
+
+A :class:`HeadwayMonitor` consumes the route-wide forecasts (``Previsao/Linha``) and, for every stop, calculates the
+time between consecutive forecast arrivals. Vehicles arriving too close to each other are flagged as bunching, and
+vehicles arriving too far apart are flagged as gaps:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.headways import HeadwayMonitor
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    monitor = HeadwayMonitor(bunching=60, gap=1200)
+    for alert in monitor.update(1234, client.get_forecast(route_code=1234)):
+        print(alert.kind, alert.stop_code, alert.leading.prefix, alert.trailing.prefix, alert.seconds)
+
+Only new alerts are returned by :meth:`HeadwayMonitor.update`, so calling it every minute for every route yields just what
+changed since the last forecast.
+"""
+
+from collections import namedtuple
+
+
+BUNCHING = 'bunching'
+GAP = 'gap'
+
+Headway = namedtuple('Headway', ['route_code', 'stop_code', 'leading', 'trailing', 'seconds'])
+"""A namedtuple representing the headway between two consecutive vehicles arriving at a stop.
+
+:var route_code: (:class:`int`) The route code.
+:var stop_code: (:class:`int`) The stop code.
+:var leading: (:class:`sptrans.v0.VehicleForecast`) The vehicle arriving first.
+:var trailing: (:class:`sptrans.v0.VehicleForecast`) The vehicle arriving next.
+:var seconds: (:class:`float`) The time between the two arrivals, in seconds.
+"""
+HeadwayAlert = namedtuple('HeadwayAlert', ['kind', 'route_code', 'stop_code', 'leading', 'trailing', 'seconds'])
+"""A namedtuple representing an irregular headway.
+
+:var kind: (:class:`str`) Either :data:`BUNCHING` or :data:`GAP`.
+:var route_code: (:class:`int`) The route code.
+:var stop_code: (:class:`int`) The stop code.
+:var leading: (:class:`sptrans.v0.VehicleForecast`) The vehicle arriving first.
+:var trailing: (:class:`sptrans.v0.VehicleForecast`) The vehicle arriving next.
+:var seconds: (:class:`float`) The time between the two arrivals, in seconds.
+"""
+HeadwaySummary = namedtuple('HeadwaySummary', ['route_code', 'count', 'mean', 'minimum', 'maximum', 'bunching', 'gaps'])
+"""A namedtuple summarizing the headways of a route.
+
+:var route_code: (:class:`int`) The route code.
+:var count: (:class:`int`) How many headways were measured, considering all stops.
+:var mean: (:class:`float`) The mean headway, in seconds, or `None` if there are none.
+:var minimum: (:class:`float`) The minimum headway, in seconds, or `None` if there are none.
+:var maximum: (:class:`float`) The maximum headway, in seconds, or `None` if there are none.
+:var bunching: (:class:`int`) How many headways are flagged as bunching.
+:var gaps: (:class:`int`) How many headways are flagged as gaps.
+"""
+
+
+def stop_headways(route_code, stop):
+    """Calculates the headways between the vehicles forecast to arrive at a stop.
+
+    :param route_code: The route code.
+    :type route_code: :class:`int`
+    :param stop: A stop from a route-wide forecast.
+    :type stop: :class:`sptrans.v0.StopWithVehicles`
+    :return: A :class:`list` of :class:`Headway` objects, in arrival order.
+    """
+    vehicles = sorted(stop.vehicles, key=_arriving_at)
+    return [Headway(route_code, stop.code, leading, trailing, (trailing.arriving_at - leading.arriving_at).total_seconds())
+            for leading, trailing in zip(vehicles, vehicles[1:])]
+
+
+class HeadwayMonitor(object):
+    """Monitor of headways, bunching and gaps for many routes.
+
+    :param bunching: Headways up to this many seconds are flagged as bunching.
+    :type bunching: :class:`float`
+    :param gap: Headways of at least this many seconds are flagged as gaps. `None` disables gap detection.
+    :type gap: :class:`float`
+    """
+
+    def __init__(self, bunching=60, gap=None):
+        self.bunching = bunching
+        self.gap = gap
+        self._headways = {}
+        self._alerts = {}
+
+    def update(self, route_code, forecast):
+        """Recalculates the headways of a route from a new forecast.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param forecast: The forecast for the route, as returned by :meth:`sptrans.v0.Client.get_forecast` with only a `route_code`.
+        :type forecast: :class:`sptrans.v0.ForecastWithStops`
+        :return: A :class:`list` of the :class:`HeadwayAlert` objects that were not active in the previous update of the route.
+        """
+        headways = []
+        for stop in forecast.stops:
+            headways.extend(stop_headways(route_code, stop))
+        alerts = {}
+        for headway in headways:
+            kind = self._classify(headway.seconds)
+            if kind is not None:
+                key = (kind, headway.stop_code, headway.leading.prefix, headway.trailing.prefix)
+                alerts[key] = HeadwayAlert(kind, *headway)
+        previous = self._alerts.get(route_code, {})
+        self._headways[route_code] = headways
+        self._alerts[route_code] = alerts
+        return [alert for key, alert in alerts.items() if key not in previous]
+
+    def forget(self, route_code):
+        """Drops everything known about a route.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        """
+        self._headways.pop(route_code, None)
+        self._alerts.pop(route_code, None)
+
+    def headways(self, route_code, stop_code=None):
+        """Lists the headways of a route, as of its last update.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param stop_code: Only list the headways at this stop.
+        :type stop_code: :class:`int`
+        :return: A :class:`list` of :class:`Headway` objects.
+        """
+        return [headway for headway in self._headways.get(route_code, [])
+                if stop_code is None or headway.stop_code == stop_code]
+
+    def alerts(self, route_code=None):
+        """Lists the currently active alerts.
+
+        :param route_code: Only list the alerts of this route.
+        :type route_code: :class:`int`
+        :return: A :class:`list` of :class:`HeadwayAlert` objects.
+        """
+        if route_code is not None:
+            return list(self._alerts.get(route_code, {}).values())
+        return [alert for alerts in self._alerts.values() for alert in alerts.values()]
+
+    def summary(self, route_code):
+        """Summarizes the headways of a route, as of its last update.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :return: A :class:`HeadwaySummary` object.
+        """
+        seconds = [headway.seconds for headway in self._headways.get(route_code, [])]
+        kinds = [alert.kind for alert in self._alerts.get(route_code, {}).values()]
+        if not seconds:
+            return HeadwaySummary(route_code, 0, None, None, None, 0, 0)
+        return HeadwaySummary(route_code, len(seconds), sum(seconds) / len(seconds), min(seconds), max(seconds),
+                              kinds.count(BUNCHING), kinds.count(GAP))
+
+    def _classify(self, seconds):
+        if seconds <= self.bunching:
+            return BUNCHING
+        if self.gap is not None and seconds >= self.gap:
+            return GAP
+
+
+def _arriving_at(vehicle):
+    return vehicle.arriving_at
@@ -0,0 +1,191 @@
+"""Module for aggregating vehicle positions and arrival forecasts per bus lane (corridor).
+
+A :class:`LaneIndex` fetches the lanes and their stops once, and indexes them both ways - lane to stops and stop to lanes -,
+plus a grid of the stop locations. With it, sweeps of positions and forecasts are aggregated per lane in a single pass each:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.lanes import LaneIndex
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    index = LaneIndex.build(client)
+    positions = [client.get_positions(route_code) for route_code in [1234, 5678]]
+    forecasts = [client.get_forecast(stop_code=stop_code) for stop_code in index.stops(8)]
+    for stats in index.aggregate(positions, forecasts).values():
+        print(stats.name, stats.vehicles, stats.average_gap)
+
+A vehicle is counted in a lane when it's close enough to any of the lane stops.
+"""
+
+from array import array
+from collections import namedtuple
+from math import sqrt
+
+from sptrans.geo import Grid, Projection
+from sptrans.tracking import to_timestamp
+
+
+LaneStats = namedtuple('LaneStats', ['lane_code', 'name', 'stops', 'vehicles', 'arrivals', 'average_gap'])
+"""A namedtuple representing the aggregated state of a bus lane.
+
+:var lane_code: (:class:`int`) The lane code.
+:var name: (:class:`str`) The lane name.
+:var stops: (:class:`int`) How many stops the lane has.
+:var vehicles: (:class:`int`) How many distinct vehicles are close to the lane stops.
+:var arrivals: (:class:`int`) How many arrivals are forecast for the lane stops.
+:var average_gap: (:class:`float`) The average time, in seconds, between consecutive arrivals at the same stop of the lane,
+    or `None` if no stop has more than one arrival forecast.
+"""
+
+
+class LaneIndex(object):
+    """Index of bus lanes and their stops, aggregating positions and forecasts per lane.
+
+    :param lanes: The lanes, as returned by :meth:`sptrans.v0.Client.list_lanes`.
+    :type lanes: iterable of :class:`sptrans.v0.Lane`
+    :param stops_by_lane: The stops of each lane, as returned by :meth:`sptrans.v0.Client.search_stops_by_lane`.
+    :type stops_by_lane: :class:`dict` mapping lane codes to iterables of :class:`sptrans.v0.Stop`
+    :param max_distance: How far, in meters, a vehicle may be from a lane stop to be counted in the lane.
+    :type max_distance: :class:`float`
+    """
+
+    def __init__(self, lanes, stops_by_lane, max_distance=150):
+        self.max_distance = max_distance
+        self._lanes = dict((lane.code, lane) for lane in lanes)
+        self._lane_stops = {}
+        self._stop_lanes = {}
+        stops = {}
+        for lane_code in self._lanes:
+            codes = []
+            for stop in stops_by_lane.get(lane_code, ()):
+                codes.append(stop.code)
+                stops[stop.code] = stop
+                lane_codes = self._stop_lanes.setdefault(stop.code, [])
+                if lane_code not in lane_codes:
+                    lane_codes.append(lane_code)
+            self._lane_stops[lane_code] = codes
+        self._stop_codes = list(stops)
+        self._grid = Grid(max_distance, Projection.around([stop.latitude for stop in stops.values()]))
+        projected = [self._grid.projection.project(stops[code].latitude, stops[code].longitude) for code in self._stop_codes]
+        self._xs = array('d', [x for x, _ in projected])
+        self._ys = array('d', [y for _, y in projected])
+        self._cells = {}
+        for position in range(len(self._stop_codes)):
+            self._cells.setdefault(self._grid.key(self._xs[position], self._ys[position]), []).append(position)
+
+    @classmethod
+    def build(cls, client, max_distance=150):
+        """Fetches all the lanes and their stops, and indexes them.
+
+        :param client: The (authenticated) client used to fetch the lanes and stops.
+        :type client: :class:`sptrans.v0.Client`
+        :param max_distance: How far, in meters, a vehicle may be from a lane stop to be counted in the lane.
+        :type max_distance: :class:`float`
+        :return: A :class:`LaneIndex` object.
+        """
+        lanes = list(client.list_lanes())
+        stops_by_lane = dict((lane.code, list(client.search_stops_by_lane(lane.code))) for lane in lanes)
+        return cls(lanes, stops_by_lane, max_distance)
+
+    @property
+    def lane_codes(self):
+        """The codes of the indexed lanes."""
+        return list(self._lanes)
+
+    def stops(self, lane_code):
+        """Gets the codes of the stops of a lane.
+
+        :return: A :class:`list` of stop codes, in the order they were returned by the API.
+        """
+        return list(self._lane_stops[lane_code])
+
+    def lanes_of(self, stop_code):
+        """Gets the codes of the lanes a stop belongs to.
+
+        :return: A :class:`list` of lane codes, empty if the stop is not in any lane.
+        """
+        return list(self._stop_lanes.get(stop_code, ()))
+
+    def nearest_stop(self, latitude, longitude):
+        """Finds the closest lane stop to a location, within the maximum distance.
+
+        :return: The stop code, or `None` if there's no lane stop close enough.
+        """
+        x, y = self._grid.projection.project(latitude, longitude)
+        cell_x, cell_y = self._grid.key(x, y)
+        best = None
+        best_distance = self.max_distance
+        for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+            for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+                for position in self._cells.get((neighbour_x, neighbour_y), ()):
+                    distance = sqrt((self._xs[position] - x) ** 2 + (self._ys[position] - y) ** 2)
+                    if distance <= best_distance:
+                        best = self._stop_codes[position]
+                        best_distance = distance
+        return best
+
+    def vehicle_counts(self, positions):
+        """Counts the distinct vehicles close to the stops of each lane.
+
+        :param positions: A sweep of positions, for as many routes as wanted.
+        :type positions: iterable of :class:`sptrans.v0.Positions`
+        :return: A :class:`dict` mapping every lane code to its vehicle count.
+        """
+        prefixes = dict((lane_code, set()) for lane_code in self._lanes)
+        for result in positions:
+            for vehicle in result.vehicles:
+                stop_code = self.nearest_stop(vehicle.latitude, vehicle.longitude)
+                if stop_code is not None:
+                    for lane_code in self._stop_lanes[stop_code]:
+                        prefixes[lane_code].add(vehicle.prefix)
+        return dict((lane_code, len(lane_prefixes)) for lane_code, lane_prefixes in prefixes.items())
+
+    def arrival_gaps(self, forecasts):
+        """Calculates the gaps between consecutive arrivals forecast for each lane stop.
+
+        :param forecasts: A sweep of forecasts, by stop or by route, for as many of them as wanted. Arrivals of the same
+            vehicle at the same stop found in more than one forecast are counted once.
+        :type forecasts: iterable of :class:`sptrans.v0.ForecastWithStop` or :class:`sptrans.v0.ForecastWithStops`
+        :return: A :class:`dict` mapping every lane code to a (arrivals count, average gap in seconds or `None`) tuple.
+        """
+        arrivals = {}
+        for forecast in forecasts:
+            if hasattr(forecast, 'stops'):
+                stops = [(stop.code, stop.vehicles) for stop in forecast.stops]
+            else:
+                stops = [(forecast.stop.code, route.vehicles) for route in forecast.stop.routes]
+            for stop_code, vehicles in stops:
+                if stop_code in self._stop_lanes:
+                    stop_arrivals = arrivals.setdefault(stop_code, {})
+                    for vehicle in vehicles:
+                        stop_arrivals[vehicle.prefix] = to_timestamp(vehicle.arriving_at)
+        counts = dict((lane_code, 0) for lane_code in self._lanes)
+        gap_counts = dict(counts)
+        totals = dict((lane_code, 0.0) for lane_code in self._lanes)
+        for stop_code, stop_arrivals in arrivals.items():
+            moments = sorted(stop_arrivals.values())
+            total = moments[-1] - moments[0]
+            for lane_code in self._stop_lanes[stop_code]:
+                counts[lane_code] += len(moments)
+                gap_counts[lane_code] += len(moments) - 1
+                totals[lane_code] += total
+        return dict((lane_code, (counts[lane_code], totals[lane_code] / gap_counts[lane_code] if gap_counts[lane_code] else None))
+                    for lane_code in self._lanes)
+
+    def aggregate(self, positions=(), forecasts=()):
+        """Aggregates sweeps of positions and forecasts per lane.
+
+        :param positions: A sweep of positions, for as many routes as wanted.
+        :type positions: iterable of :class:`sptrans.v0.Positions`
+        :param forecasts: A sweep of forecasts, by stop or by route, for as many of them as wanted.
+        :type forecasts: iterable of :class:`sptrans.v0.ForecastWithStop` or :class:`sptrans.v0.ForecastWithStops`
+        :return: A :class:`dict` mapping every lane code to its :class:`LaneStats`.
+        """
+        vehicles = self.vehicle_counts(positions)
+        gaps = self.arrival_gaps(forecasts)
+        return dict((lane_code, LaneStats(lane_code, lane.name, len(self._lane_stops[lane_code]), vehicles[lane_code],
+                                          gaps[lane_code][0], gaps[lane_code][1]))
+                    for lane_code, lane in self._lanes.items())
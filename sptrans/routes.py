@@ -0,0 +1,179 @@
+"""Module for resolving the public signs of the routes, like ``8000-10``, to the route codes used by the API.
+
+A :class:`RouteResolver` sweeps the routes once, with a few searches (``Linha/Buscar``), and keeps a table from the signs
+and directions to the route codes, so that resolving them doesn't need to call the API anymore:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.routes import RouteResolver
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    resolver = RouteResolver(client)
+    resolver.refresh()
+    positions = client.get_positions(resolver.resolve('8000-10', direction=1))
+    codes = resolver.resolve_many(['8000-10', '675K-10', '5111-10'])
+
+Since routes are created and changed from time to time, the table can also be refreshed periodically, in a background
+thread, with :meth:`RouteResolver.start`; it's replaced at once, so resolving never waits for a refresh. Failed refreshes
+are logged, kept in :attr:`RouteResolver.last_error` and retried sooner, backing off, so that a resolver started before the
+client could authenticate doesn't stay empty until the next refresh.
+"""
+
+from array import array
+import logging
+import threading
+from time import time as now
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TERMS = tuple('0123456789')
+"""The search terms that sweep all the routes, since every route sign has digits."""
+
+
+def route_sign(route):
+    """Builds the public sign of a route, from its sign and its type.
+
+    :param route: The route.
+    :type route: :class:`sptrans.v0.Route`
+    :return: The sign, like ``8000-10``, as a :class:`str`.
+    """
+    return '{}-{}'.format(route.sign, route.type).upper()
+
+
+class RouteResolver(object):
+    """Resolver of route signs and directions to route codes.
+
+    The signs are kept in a dict, pointing to their positions in an array with the codes of both directions.
+
+    :param client: The client for sweeping the routes, which is not needed if the routes are loaded with :meth:`load`.
+    :type client: :class:`sptrans.v0.Client`
+    :param terms: The search terms used for sweeping the routes.
+    :type terms: iterable of :class:`str`
+    :param refresh_interval: How many seconds to wait between refreshes, when refreshing in the background.
+    :type refresh_interval: :class:`float`
+    :param retry_interval: How many seconds to wait before retrying a failed refresh, in the background; the wait doubles at
+                           each failure in a row, up to `refresh_interval`.
+    :type retry_interval: :class:`float`
+    """
+
+    def __init__(self, client=None, terms=DEFAULT_TERMS, refresh_interval=24 * 60 * 60, retry_interval=5):
+        self.client = client
+        self.terms = tuple(terms)
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.refreshed_at = None
+        self.last_error = None
+        self._table = ({}, array('l'))
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._table[0])
+
+    def load(self, routes):
+        """Replaces the table with the one built from some routes.
+
+        :param routes: The routes.
+        :type routes: iterable of :class:`sptrans.v0.Route`
+        :return: How many distinct signs were loaded.
+        """
+        slots = {}
+        codes = array('l')
+        for route in routes:
+            if route.direction not in (1, 2):
+                continue
+            sign = route_sign(route)
+            slot = slots.get(sign)
+            if slot is None:
+                slot = slots[sign] = len(codes) // 2
+                codes.extend((0, 0))
+            codes[slot * 2 + route.direction - 1] = route.code
+        self._table = (slots, codes)
+        self.refreshed_at = now()
+        return len(slots)
+
+    def refresh(self):
+        """Sweeps the routes with the client, searching for each of the terms, and replaces the table.
+
+        :raises: :class:`sptrans.v0.RequestError` when a search fails, in which case the table is kept as it was.
+        :return: How many distinct signs were loaded.
+        """
+        routes = {}
+        for terms in self.terms:
+            for route in self.client.search_routes(terms):
+                routes[route.code] = route
+        return self.load(routes.values())
+
+    def resolve(self, sign, direction=1):
+        """Resolves a route sign and direction to a route code.
+
+        :param sign: The public sign of the route, like ``8000-10``.
+        :type sign: :class:`str`
+        :param direction: The route direction: 1 means "main to secondary terminal", 2 means "secondary to main terminal".
+        :type direction: :class:`int`
+        :raises: :class:`ValueError` when the direction is neither 1 nor 2.
+        :return: The route code, or `None` if there's no such route.
+        """
+        if direction not in (1, 2):
+            raise ValueError('The direction must be either 1 or 2, not {!r}'.format(direction))
+        slots, codes = self._table
+        slot = slots.get(sign.strip().upper())
+        if slot is None:
+            return None
+        return codes[slot * 2 + direction - 1] or None
+
+    def resolve_many(self, signs, direction=1):
+        """Resolves many route signs at once.
+
+        :param signs: The public signs of the routes, or (sign, direction) pairs.
+        :type signs: iterable of :class:`str` or of :class:`tuple`
+        :param direction: The direction of the signs given without one.
+        :type direction: :class:`int`
+        :raises: :class:`ValueError` when a direction is neither 1 nor 2.
+        :return: A :class:`list` of route codes, with `None` for the routes that don't exist, in the order of the signs.
+        """
+        slots, codes = self._table
+        resolved = []
+        for sign in signs:
+            sign_direction = direction
+            if isinstance(sign, tuple):
+                sign, sign_direction = sign
+            if sign_direction not in (1, 2):
+                raise ValueError('The direction must be either 1 or 2, not {!r}'.format(sign_direction))
+            slot = slots.get(sign.strip().upper())
+            resolved.append(None if slot is None else codes[slot * 2 + sign_direction - 1] or None)
+        return resolved
+
+    def start(self):
+        """Starts refreshing the table in a background thread, right away and then every `refresh_interval` seconds."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops refreshing, waiting for the background thread to finish."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as error:
+                logger.exception('Failed to refresh the routes')
+                self.last_error = error
+                wait = min(self.retry_interval * 2 ** failures, self.refresh_interval)
+                failures += 1
+            else:
+                self.last_error = None
+                wait = self.refresh_interval
+                failures = 0
+            self._stopped.wait(wait)
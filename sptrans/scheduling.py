@@ -0,0 +1,261 @@
+"""Module for scheduling the polls of vehicle positions according to how active each route is.
+
+A :class:`PollScheduler` keeps a poll interval per route, and adapts it after every poll:
+
+- routes without vehicles, or whose time reported by the API (``hr``, in minutes) fell a minute or more behind the time
+  elapsed between the polls, back off;
+- routes where most vehicles changed position are polled more often;
+- routes where few vehicles moved are polled less often.
+
+On top of that, the intervals are stretched proportionally whenever they would add up to more requests than a global budget,
+and a token bucket keeps bursts of due routes within it too:
+::
+
+    import time
+
+    from sptrans.v0 import Client
+    from sptrans.scheduling import PollScheduler
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    scheduler = PollScheduler(budget=0.5)
+    for route_code in [1234, 5678, 9012]:
+        scheduler.add_route(route_code)
+
+    while True:
+        for route_code, positions in scheduler.run_once(client).items():
+            print(route_code, len(positions.vehicles))
+        time.sleep(scheduler.wait_time())
+"""
+
+from datetime import timedelta
+from heapq import heappop, heappush
+from time import time as now
+
+import requests
+
+from sptrans.v0 import RequestError
+
+
+TIME_RESOLUTION = 60
+ONE_DAY = timedelta(days=1)
+
+
+class _RouteSchedule(object):
+    __slots__ = ('interval', 'due_at', 'time', 'polled_at', 'vehicles')
+
+    def __init__(self, interval, due_at):
+        self.interval = interval
+        self.due_at = due_at
+        self.time = None
+        self.polled_at = None
+        self.vehicles = None
+
+
+class PollScheduler(object):
+    """Scheduler of position polls, adapting each route's interval to its activity within a global request budget.
+
+    :param min_interval: The shortest interval, in seconds, between polls of the same route.
+    :type min_interval: :class:`float`
+    :param max_interval: The longest interval, in seconds, between polls of the same route.
+    :type max_interval: :class:`float`
+    :param budget: How many requests per second may be made, on average, for all routes together.
+    :type budget: :class:`float`
+    :param burst: How many requests may be made at once, when many routes are due at the same time.
+    :type burst: :class:`int`
+    :param busy_fraction: The fraction of changed vehicles from which a route is polled more often.
+    :type busy_fraction: :class:`float`
+    :param quiet_fraction: The fraction of changed vehicles under which a route is polled less often.
+    :type quiet_fraction: :class:`float`
+    :param factor: How much an interval shrinks or grows at each adaptation.
+    :type factor: :class:`float`
+    """
+
+    def __init__(self, min_interval=15, max_interval=600, budget=1.0, burst=10, busy_fraction=0.5, quiet_fraction=0.1,
+                 factor=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.burst = burst
+        self.busy_fraction = busy_fraction
+        self.quiet_fraction = quiet_fraction
+        self.factor = factor
+        self._routes = {}
+        self._heap = []
+        self._demand = 0.0
+        self._tokens = float(burst)
+        self._refilled_at = None
+
+    @property
+    def route_codes(self):
+        """The codes of the scheduled routes."""
+        return list(self._routes)
+
+    @property
+    def demand(self):
+        """How many requests per second the current intervals add up to, before applying the budget."""
+        return self._demand
+
+    def add_route(self, route_code, interval=None, moment=None):
+        """Schedules a route, due immediately.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param interval: The initial interval, in seconds, defaults to the minimum interval.
+        :type interval: :class:`float`
+        :param moment: The current time, in seconds since the epoch, defaults to now.
+        :type moment: :class:`float`
+        """
+        self.remove_route(route_code)
+        moment = now() if moment is None else moment
+        interval = self._clamp(self.min_interval if interval is None else interval)
+        self._routes[route_code] = _RouteSchedule(interval, moment)
+        self._demand += 1.0 / interval
+        heappush(self._heap, (moment, route_code))
+
+    def remove_route(self, route_code):
+        """Stops scheduling a route."""
+        schedule = self._routes.pop(route_code, None)
+        if schedule is not None:
+            self._demand -= 1.0 / schedule.interval
+
+    def interval(self, route_code):
+        """Gets the adapted interval of a route, in seconds, before applying the budget."""
+        return self._routes[route_code].interval
+
+    def effective_interval(self, route_code):
+        """Gets the interval of a route, in seconds, stretched to fit the budget if needed."""
+        return self._routes[route_code].interval * max(1.0, self._demand / self.budget)
+
+    def due(self, moment=None):
+        """Takes the routes that are due for a poll, as long as the budget allows.
+
+        The routes taken are not scheduled again until their polls are recorded with :meth:`record`.
+
+        :param moment: The current time, in seconds since the epoch, defaults to now.
+        :type moment: :class:`float`
+        :return: A :class:`list` of route codes, the most overdue first.
+        """
+        moment = now() if moment is None else moment
+        self._refill(moment)
+        route_codes = []
+        while self._heap and self._heap[0][0] <= moment and self._tokens >= 1:
+            due_at, route_code = heappop(self._heap)
+            schedule = self._routes.get(route_code)
+            if schedule is None or schedule.due_at != due_at:
+                continue
+            schedule.due_at = None
+            self._tokens -= 1
+            route_codes.append(route_code)
+        return route_codes
+
+    def record(self, route_code, positions, moment=None):
+        """Adapts the interval of a route to the result of a poll, and schedules its next poll.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param positions: The polled positions, or `None` if the poll failed, which backs off the route.
+        :type positions: :class:`sptrans.v0.Positions`
+        :param moment: The current time, in seconds since the epoch, defaults to now.
+        :type moment: :class:`float`
+        :return: The new interval of the route, in seconds, before applying the budget.
+        """
+        schedule = self._routes.get(route_code)
+        if schedule is None:
+            return None
+        moment = now() if moment is None else moment
+        interval = schedule.interval
+        if positions is None:
+            interval *= self.factor
+        else:
+            vehicles = dict((vehicle.prefix, (vehicle.latitude, vehicle.longitude)) for vehicle in positions.vehicles)
+            if not vehicles or self._is_stale(schedule, positions.time, moment):
+                interval *= self.factor
+            elif schedule.vehicles is not None:
+                changed = sum(1 for prefix, position in vehicles.items() if schedule.vehicles.get(prefix) != position)
+                changed += sum(1 for prefix in schedule.vehicles if prefix not in vehicles)
+                fraction = float(changed) / max(len(vehicles), len(schedule.vehicles))
+                if fraction >= self.busy_fraction:
+                    interval /= self.factor
+                elif fraction < self.quiet_fraction:
+                    interval *= self.factor
+            schedule.vehicles = vehicles
+            schedule.time = positions.time
+            schedule.polled_at = moment
+        interval = self._clamp(interval)
+        self._demand += 1.0 / interval - 1.0 / schedule.interval
+        schedule.interval = interval
+        schedule.due_at = moment + self.effective_interval(route_code)
+        heappush(self._heap, (schedule.due_at, route_code))
+        return interval
+
+    def wait_time(self, moment=None):
+        """Gets how many seconds to wait until the next route is due and the budget allows polling it.
+
+        :param moment: The current time, in seconds since the epoch, defaults to now.
+        :type moment: :class:`float`
+        :return: A :class:`float`, or `None` if no route is waiting to be polled.
+        """
+        moment = now() if moment is None else moment
+        self._refill(moment)
+        while self._heap:
+            due_at, route_code = self._heap[0]
+            schedule = self._routes.get(route_code)
+            if schedule is not None and schedule.due_at == due_at:
+                break
+            heappop(self._heap)
+        else:
+            return None
+        until_token = max(0.0, (1 - self._tokens) / self.budget)
+        return max(0.0, self._heap[0][0] - moment, until_token)
+
+    def run_once(self, client, moment=None):
+        """Polls the routes that are due, records the results and schedules the next polls. Routes whose polls fail with
+        :class:`sptrans.v0.RequestError` or a network error (:class:`requests.RequestException`, like timeouts) are backed
+        off; if any other error interrupts the polls, the routes not polled yet are backed off as well before it's raised.
+
+        :param client: The (authenticated) client used to fetch the positions.
+        :type client: :class:`sptrans.v0.Client`
+        :param moment: The current time, in seconds since the epoch, defaults to now.
+        :type moment: :class:`float`
+        :return: A :class:`dict` mapping the polled route codes to their :class:`sptrans.v0.Positions`.
+        """
+        results = {}
+        route_codes = self.due(moment)
+        recorded = 0
+        try:
+            for route_code in route_codes:
+                try:
+                    positions = client.get_positions(route_code)
+                except (RequestError, requests.RequestException):
+                    positions = None
+                recorded += 1
+                self.record(route_code, positions, moment)
+                if positions is not None:
+                    results[route_code] = positions
+        finally:
+            # The routes taken by due() are only scheduled again when recorded, so none of them may be left behind.
+            for route_code in route_codes[recorded:]:
+                self.record(route_code, None, moment)
+        return results
+
+    def _is_stale(self, schedule, time, moment):
+        # The API time only has minutes, so it may not advance between polls less than a minute apart; the data is stale
+        # when it falls a whole minute behind the time elapsed since the previous poll.
+        if schedule.time is None:
+            return False
+        advance = time - schedule.time
+        if advance < -ONE_DAY / 2:
+            advance += ONE_DAY
+        return moment - schedule.polled_at - advance.total_seconds() >= TIME_RESOLUTION
+
+    def _clamp(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def _refill(self, moment):
+        if self._refilled_at is not None and moment > self._refilled_at:
+            self._tokens = min(float(self.burst), self._tokens + (moment - self._refilled_at) * self.budget)
+        if self._refilled_at is None or moment > self._refilled_at:
+            self._refilled_at = moment
@@ -0,0 +1,242 @@
+"""Module for serializing the models, to pass them between processes or to keep them in caches.
+
+The models are dynamic namedtuple classes, and pickling nested results - like a :class:`sptrans.v0.ForecastWithStop`, with
+routes and vehicles - repeats a lot of structure. :func:`dumps` encodes the models by position instead, following a schema
+derived from their fields, so that only the values are written; datetimes are kept, and nested models are rebuilt by
+:func:`loads`:
+::
+
+    from multiprocessing import Pool
+
+    from sptrans.v0 import Client
+    from sptrans.serialization import dumps, loads
+
+
+    def count_vehicles(data):
+        forecast = loads(data)
+        return sum(len(route.vehicles) for route in forecast.stop.routes)
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    forecasts = [dumps(client.get_forecast(stop_code=code)) for code in stop_codes]
+    with Pool(4) as pool:
+        counts = pool.map(count_vehicles, forecasts)
+
+The data is binary, with a small header telling the format version and the codec: `msgpack <https://msgpack.org/>`_, when
+it's installed, or JSON otherwise. Each model class has an id in a registry, where the models of :mod:`sptrans.v0` are
+already registered; user-defined models need to be registered with :func:`register` before being serialized.
+
+Nothing in the library serializes models by itself: callers opt in, as above. In particular, the shared cache of
+:class:`sptrans.v0.Client` (see :mod:`sptrans.sharedcache`) keeps the decoded JSON results, not models, since the filtered
+searches (:func:`sptrans.v0.select`) test the raw results before building any models; each process builds the models of a
+cached result only once, when it's first used.
+"""
+
+from datetime import datetime, timedelta
+import json
+
+from sptrans import v0
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+MAGIC = b'SM'
+FORMAT_VERSION = 1
+MSGPACK = b'm'
+JSON = b'j'
+EPOCH = datetime(1970, 1, 1)
+
+_PLAIN = 0
+_TIME = 1
+_MODEL = 2
+_MODELS = 3
+_INTERNED = 4
+
+_schemas = {}
+_classes = {}
+
+
+def register(tuple_class, model_id):
+    """Registers a model class, so that it can be serialized.
+
+    The id is written along with the data, so it must be the same in the processes reading and writing it.
+
+    :param tuple_class: The model class, built with :func:`sptrans.v0.build_tuple_class`.
+    :param model_id: The model id, which should be 100 or more for user-defined models.
+    :type model_id: :class:`int`
+    :raises: :class:`ValueError` when the id is already taken by another model class.
+    """
+    registered = _classes.get(model_id)
+    if registered is not None and registered is not tuple_class:
+        raise ValueError('The model id {} is already taken by {}'.format(model_id, registered.__name__))
+    _classes[model_id] = tuple_class
+    _schemas[tuple_class] = (model_id, _schema(tuple_class))
+
+
+def dumps(value, codec=None):
+    """Serializes a model, or a list of models of the same class.
+
+    :param value: The model or the list of models.
+    :param codec: Either :data:`MSGPACK` or :data:`JSON`; defaults to msgpack, if it's installed.
+    :type codec: :class:`bytes`
+    :raises: :class:`ValueError` when the model class is not registered.
+    :return: The serialized data, as :class:`bytes`.
+    """
+    many = isinstance(value, list)
+    models = value if many else [value]
+    if models:
+        model_id = _registration(type(models[0]))[0]
+        encoded = _encode(type(models[0]), models, {})
+    else:
+        model_id, encoded = 0, []
+    document = [model_id, many, encoded]
+    if codec is None:
+        codec = JSON if msgpack is None else MSGPACK
+    header = MAGIC + bytes(bytearray([FORMAT_VERSION])) + codec
+    if codec == MSGPACK:
+        return header + _msgpack().packb(document, use_bin_type=True)
+    return header + json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Deserializes data written by :func:`dumps`.
+
+    :param data: The serialized data.
+    :type data: :class:`bytes`
+    :raises: :class:`ValueError` when the data is not in a known format, or its model class is not registered.
+    :return: The model, or the list of models.
+    """
+    data = bytes(data)
+    if data[:2] != MAGIC or bytearray(data[2:3]) != bytearray([FORMAT_VERSION]):
+        raise ValueError('The data is not in the serialization format version {}'.format(FORMAT_VERSION))
+    codec = data[3:4]
+    if codec == MSGPACK:
+        model_id, many, encoded = _msgpack().unpackb(data[4:], raw=False)
+    elif codec == JSON:
+        model_id, many, encoded = json.loads(data[4:].decode('utf-8'))
+    else:
+        raise ValueError('Unknown codec {!r}'.format(codec))
+    if model_id == 0:
+        return []
+    tuple_class = _classes.get(model_id)
+    if tuple_class is None:
+        raise ValueError('The model id {} is not registered'.format(model_id))
+    models = _decode(tuple_class, encoded, {})
+    return models if many else models[0]
+
+
+def _msgpack():
+    if msgpack is None:
+        raise ImportError('Serializing with msgpack needs the "msgpack" package to be installed')
+    return msgpack
+
+
+def _registration(tuple_class):
+    registration = _schemas.get(tuple_class)
+    if registration is None:
+        raise ValueError('The model {} is not registered'.format(tuple_class.__name__))
+    return registration
+
+
+def _schema(tuple_class):
+    # The fields are in alphabetical order, since the order of the namedtuple fields may change between processes.
+    schema = []
+    for name in sorted(tuple_class._fields):
+        field = tuple_class.MAPPING[name]
+        if isinstance(field, v0.TimeField):
+            kind, argument = _TIME, None
+        elif isinstance(field, v0.TupleListField):
+            kind, argument = _MODELS, field.tuple_class
+        elif isinstance(field, v0.TupleField):
+            kind, argument = _MODEL, field.tuple_class
+        elif isinstance(field, v0.InternedField):
+            kind, argument = _INTERNED, field.pool
+        else:
+            kind, argument = _PLAIN, None
+        schema.append((tuple_class._fields.index(name), kind, argument))
+    return schema
+
+
+def _encode(tuple_class, models, times):
+    # Lists of models are encoded by columns - the values of each field, for all the models -, and the nested lists of all
+    # the models are encoded together, as a single list of children and the number of children of each model.
+    rows = list(zip(*models)) if models else [()] * len(tuple_class._fields)
+    encoded = [len(models)]
+    for index, kind, argument in _registration(tuple_class)[1]:
+        column = rows[index]
+        if kind in (_PLAIN, _INTERNED):
+            encoded.append(list(column))
+        elif kind == _TIME:
+            encoded.append([_encode_time(value, times) for value in column])
+        elif kind == _MODEL:
+            encoded.append(_encode(argument, list(column), times))
+        else:
+            encoded.append([[len(children) for children in column],
+                            _encode(argument, [child for children in column for child in children], times)])
+    return encoded
+
+
+def _decode(tuple_class, encoded, times):
+    count = encoded[0]
+    columns = [None] * len(tuple_class._fields)
+    for (index, kind, argument), column in zip(_registration(tuple_class)[1], encoded[1:]):
+        if kind == _PLAIN:
+            columns[index] = column
+        elif kind == _INTERNED:
+            columns[index] = list(map(argument.intern, column))
+        elif kind == _TIME:
+            columns[index] = [_decode_time(value, times) for value in column]
+        elif kind == _MODEL:
+            columns[index] = _decode(argument, column, times)
+        else:
+            lengths, children_encoded = column
+            children = _decode(argument, children_encoded, times)
+            values = []
+            start = 0
+            for length in lengths:
+                values.append(children[start:start + length])
+                start += length
+            columns[index] = values
+    if not count:
+        return []
+    return list(map(tuple_class._make, zip(*columns)))
+
+
+def _encode_time(value, times):
+    # Times repeat a lot in a result, so each distinct one is converted only once.
+    if value is None:
+        return value
+    encoded = times.get(value)
+    if encoded is None:
+        delta = value - EPOCH
+        encoded = times[value] = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return encoded
+
+
+def _decode_time(value, times):
+    if value is None:
+        return value
+    decoded = times.get(value)
+    if decoded is None:
+        decoded = times[value] = EPOCH + timedelta(microseconds=value)
+    return decoded
+
+
+for _model_id, _tuple_class in enumerate([
+        v0.Route,
+        v0.Stop,
+        v0.Lane,
+        v0.Vehicle,
+        v0.VehicleForecast,
+        v0.Positions,
+        v0.RouteWithVehicles,
+        v0.StopWithRoutes,
+        v0.StopWithVehicles,
+        v0.ForecastWithStop,
+        v0.ForecastWithStops], 1):
+    register(_tuple_class, _model_id)
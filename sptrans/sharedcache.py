@@ -0,0 +1,237 @@
+"""Module for sharing the API results among the processes of a host.
+
+Pre-forked servers run many processes, each with its own :class:`sptrans.v0.Client`, which would otherwise repeat the same
+calls to the API and keep their own copies of the same results. Given a :class:`SharedCache`, the clients store the results
+in files in shared memory (``/dev/shm``, where available), that all the processes read through memory maps:
+::
+
+    from sptrans.v0 import Client
+    from sptrans.sharedcache import SharedCache
+
+
+    # In each worker process:
+    client = Client(token='this is my token', cache=SharedCache(ttl=15, static_ttl=24 * 60 * 60))
+    client.authenticate()
+    positions = client.get_positions(1234)
+
+Entries younger than their time to live are served without calling the API. When an entry expires, a single process - the
+first one to lock it - refreshes it, while the other ones wait for the new entry instead of calling the API too. Entries are
+replaced atomically, by renaming new files over the old ones, so readers never see partial writes. The results are stored
+as JSON, along with the SHA-1 digest of the original response; a process only decodes an entry if its digest differs from
+the one of the result it already has, and otherwise keeps using the objects it built before.
+
+Since the processes trust the entries as API results, the cache directory must belong to the current user and be
+inaccessible to anyone else; the default one has the user id in its name, and any other one is checked before being used.
+
+This module needs ``fcntl``, so it's only available on POSIX systems.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import tempfile
+from time import time as now
+
+
+MAGIC = b'SPTC'
+VERSION = 1
+HEADER = struct.Struct('<4sHdHHHH')
+TEMPORARY_MAX_AGE = 60
+"""For how many seconds a temporary file may go unchanged before :meth:`SharedCache.purge` takes it as left by a crash."""
+
+CacheEntry = namedtuple('CacheEntry', ['url', 'digest', 'etag', 'last_modified', 'fetched_at', 'content'])
+"""A namedtuple representing a result stored in a :class:`SharedCache`.
+
+:var url: (:class:`str`) The requested URL.
+:var digest: (:class:`str`) The SHA-1 digest of the response the result came from, or `None`.
+:var etag: (:class:`str`) The ``ETag`` header of the response, or `None`.
+:var last_modified: (:class:`str`) The ``Last-Modified`` header of the response, or `None`.
+:var fetched_at: (:class:`float`) When the response was received, in seconds since the epoch.
+:var content: (:class:`memoryview`) The result, as UTF-8 encoded JSON, straight from the memory-mapped file.
+"""
+
+
+def default_directory():
+    """Gets the default directory of the caches of the current user, in shared memory if the system has it.
+
+    :return: The directory path, as a :class:`str`.
+    """
+    name = 'sptrans-{}'.format(os.getuid())
+    if os.path.isdir('/dev/shm'):
+        return os.path.join('/dev/shm', name)
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+class SharedCache(object):
+    """Cache of API results shared by the processes of a host, with one file per URL.
+
+    :param directory: The directory of the cache files, created if needed; defaults to :func:`default_directory`.
+    :type directory: :class:`str`
+    :param ttl: For how many seconds the results of the dynamic endpoints - positions and forecasts - are served from the cache.
+    :type ttl: :class:`float`
+    :param static_ttl: For how many seconds the results of the endpoints with static data (see
+                       :data:`sptrans.v0.STATIC_ENDPOINTS`) are served from the cache.
+    :type static_ttl: :class:`float`
+    :raises: :class:`OSError` when the directory already exists but doesn't belong to the current user, or other users have
+             access to it - since anyone able to write in it could plant entries.
+    """
+
+    def __init__(self, directory=None, ttl=15, static_ttl=24 * 60 * 60):
+        self.directory = directory or default_directory()
+        self.ttl = ttl
+        self.static_ttl = static_ttl
+        try:
+            os.makedirs(self.directory, 0o700)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        # The status of the path itself, not of what it may link to, so that a planted symbolic link is refused too.
+        status = os.lstat(self.directory)
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise OSError(errno.EPERM, 'The cache directory must belong to the current user, with mode 0700', self.directory)
+
+    def get(self, url):
+        """Reads the entry of a URL.
+
+        :param url: The URL.
+        :type url: :class:`str`
+        :return: A :class:`CacheEntry`, or `None` if there's no entry for the URL.
+        """
+        try:
+            with open(self._path(url), 'rb') as entry_file:
+                view = memoryview(mmap.mmap(entry_file.fileno(), 0, access=mmap.ACCESS_READ))
+        except (IOError, OSError, ValueError):
+            return None
+        if len(view) < HEADER.size:
+            return None
+        magic, version, fetched_at, digest_size, etag_size, last_modified_size, url_size = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            return None
+        offset = HEADER.size
+        strings = []
+        for size in (digest_size, etag_size, last_modified_size, url_size):
+            strings.append(view[offset:offset + size].tobytes().decode('utf-8') or None)
+            offset += size
+        digest, etag, last_modified, entry_url = strings
+        if entry_url != url:
+            return None
+        return CacheEntry(url, digest, etag, last_modified, fetched_at, view[offset:])
+
+    def put(self, url, digest, etag, last_modified, fetched_at, result):
+        """Stores the result of a URL, replacing its entry atomically.
+
+        :param url: The URL.
+        :type url: :class:`str`
+        :param digest: The SHA-1 digest of the response the result came from, or `None`.
+        :type digest: :class:`str`
+        :param etag: The ``ETag`` header of the response, or `None`.
+        :type etag: :class:`str`
+        :param last_modified: The ``Last-Modified`` header of the response, or `None`.
+        :type last_modified: :class:`str`
+        :param fetched_at: When the response was received, in seconds since the epoch.
+        :type fetched_at: :class:`float`
+        :param result: The decoded JSON result.
+        """
+        strings = [(value or '').encode('utf-8') for value in (digest, etag, last_modified, url)]
+        header = HEADER.pack(MAGIC, VERSION, fetched_at, *[len(string) for string in strings])
+        content = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as entry_file:
+                entry_file.write(header + b''.join(strings) + content)
+            os.rename(temporary_path, self._path(url))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def is_fresh(self, entry, static=False):
+        """Tells whether an entry may still be served without calling the API.
+
+        :param entry: The entry.
+        :type entry: :class:`CacheEntry`
+        :param static: Whether the entry belongs to an endpoint with static data.
+        :type static: :class:`bool`
+        :return: A :class:`bool`.
+        """
+        return now() - entry.fetched_at < (self.static_ttl if static else self.ttl)
+
+    @contextmanager
+    def lock(self, url):
+        """Locks the entry of a URL for refreshing it, blocking while another process or thread holds the lock.
+
+        Example:
+        ::
+
+            with cache.lock(url) as waited:
+                if waited:
+                    entry = cache.get(url)  # Refreshed by whoever held the lock.
+
+        :param url: The URL.
+        :type url: :class:`str`
+        :return: A context manager, giving whether it had to wait for the lock.
+        """
+        descriptor = os.open(self._path(url) + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            waited = False
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                waited = True
+                fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield waited
+        finally:
+            os.close(descriptor)
+
+    def purge(self, max_age=None):
+        """Removes the entries not refreshed for a while, along with their lock files - unless they're locked - and the
+        temporary files left by writes that crashed.
+
+        :param max_age: How many seconds since their last refresh the entries may be kept; by default, all entries are removed.
+        :type max_age: :class:`float`
+        :return: How many entries were removed.
+        """
+        removed = 0
+        moment = now()
+        names = os.listdir(self.directory)
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.entry'):
+                    if max_age is None or moment - os.path.getmtime(path) > max_age:
+                        os.unlink(path)
+                        removed += 1
+                elif name.endswith('.tmp') and moment - os.path.getmtime(path) > TEMPORARY_MAX_AGE:
+                    os.unlink(path)
+            except OSError:
+                pass
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith('.entry.lock') and not os.path.exists(path[:-len('.lock')]):
+                self._unlink_lock(path)
+        return removed
+
+    def _unlink_lock(self, path):
+        # Lock files are only removed while nobody holds them.
+        try:
+            descriptor = os.open(path, os.O_RDWR)
+        except OSError:
+            return
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.unlink(path)
+        except (IOError, OSError):
+            pass
+        finally:
+            os.close(descriptor)
+
+    def _path(self, url):
+        return os.path.join(self.directory, '{}.entry'.format(hashlib.sha1(url.encode('utf-8')).hexdigest()))
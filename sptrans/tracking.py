@@ -0,0 +1,200 @@
+"""Module for tracking vehicles over successive position snapshots.
+
+A :class:`VehicleTracker` keeps, for each vehicle prefix, a fixed-size ring buffer with its most recent positions, and
+from them estimates the vehicle speed, heading and for how long it's been stopped (its dwell time):
+::
+
+    import time
+
+    from sptrans.v0 import Client
+    from sptrans.tracking import VehicleTracker
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    tracker = VehicleTracker()
+    while True:
+        tracker.update(1234, client.get_positions(1234), observed_at=time.time())
+        for state in tracker.stalled(1234, min_dwell=300):
+            print(state.prefix, 'stopped for', state.dwell, 'seconds')
+        time.sleep(30)
+
+The memory used is bounded by the buffer size times the number of vehicles seen recently, since vehicles that are not seen for a
+while are forgotten.
+"""
+
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sptrans.geo import bearing, distance
+
+
+EPOCH = datetime(1970, 1, 1)
+
+VehicleState = namedtuple('VehicleState', ['prefix', 'route_code', 'latitude', 'longitude', 'seen_at', 'speed', 'heading', 'dwell'])
+"""A namedtuple representing the estimated state of a tracked vehicle.
+
+:var prefix: (:class:`str`) The vehicle prefix painted in the bus.
+:var route_code: (:class:`int`) The code of the route the vehicle was last seen running.
+:var latitude: (:class:`float`) The last known vehicle latitude.
+:var longitude: (:class:`float`) The last known vehicle longitude.
+:var seen_at: (:class:`float`) When the vehicle was last seen, in seconds since the epoch.
+:var speed: (:class:`float`) The estimated speed, in meters per second, or `None` if there are not enough positions yet.
+:var heading: (:class:`float`) The estimated heading, in degrees clockwise from the north, or `None` if the vehicle didn't move yet.
+:var dwell: (:class:`float`) For how many seconds the vehicle has been within the stall distance of its last position.
+"""
+
+
+def to_timestamp(moment):
+    """Converts a moment to seconds since the epoch.
+
+    :param moment: A naive :class:`datetime.datetime`, or a number of seconds that is returned as a :class:`float`.
+    :return: A :class:`float`.
+    """
+    if isinstance(moment, datetime):
+        return (moment - EPOCH).total_seconds()
+    return float(moment)
+
+
+class _Track(object):
+    __slots__ = ('route_code', 'times', 'latitudes', 'longitudes', 'next', 'count')
+
+    def __init__(self, size):
+        self.route_code = None
+        self.times = array('d', [0.0] * size)
+        self.latitudes = array('d', [0.0] * size)
+        self.longitudes = array('d', [0.0] * size)
+        self.next = 0
+        self.count = 0
+
+    def append(self, moment, latitude, longitude):
+        self.times[self.next] = moment
+        self.latitudes[self.next] = latitude
+        self.longitudes[self.next] = longitude
+        self.next = (self.next + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def last_time(self):
+        return self.times[self.next - 1]
+
+    def samples(self):
+        # From the newest to the oldest one.
+        size = len(self.times)
+        indexes = [(self.next - offset) % size for offset in range(1, self.count + 1)]
+        return ([self.times[i] for i in indexes],
+                [self.latitudes[i] for i in indexes],
+                [self.longitudes[i] for i in indexes])
+
+
+class VehicleTracker(object):
+    """Tracker of recent vehicle positions, with speed, heading and dwell time estimation.
+
+    :param size: How many positions to keep per vehicle.
+    :type size: :class:`int`
+    :param max_idle: After how many seconds without being seen a vehicle is forgotten.
+    :type max_idle: :class:`float`
+    :param stall_distance: How far, in meters, a vehicle may move and still be considered stopped.
+    :type stall_distance: :class:`float`
+    """
+
+    def __init__(self, size=16, max_idle=900, stall_distance=30):
+        self.size = size
+        self.max_idle = max_idle
+        self.stall_distance = stall_distance
+        self._tracks = OrderedDict()
+        self._latest = None
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def update(self, route_code, positions, observed_at=None):
+        """Records the vehicle positions of a route.
+
+        Since the time reported by the API has only minutes resolution, it's better to provide the moment when the positions
+        were fetched. Snapshots with the same time of the previous one, for a vehicle, are ignored for it.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param positions: The positions, as returned by :meth:`sptrans.v0.Client.get_positions`.
+        :type positions: :class:`sptrans.v0.Positions`
+        :param observed_at: When the positions were fetched, defaults to the time reported by the API.
+        :type observed_at: :class:`datetime.datetime` or :class:`float` (seconds since the epoch)
+        """
+        moment = to_timestamp(positions.time if observed_at is None else observed_at)
+        for vehicle in positions.vehicles:
+            track = self._tracks.get(vehicle.prefix)
+            if track is None:
+                track = _Track(self.size)
+            elif track.last_time() >= moment:
+                continue
+            else:
+                del self._tracks[vehicle.prefix]
+            self._tracks[vehicle.prefix] = track
+            track.route_code = route_code
+            track.append(moment, vehicle.latitude, vehicle.longitude)
+        if self._latest is None or moment > self._latest:
+            self._latest = moment
+        self._forget_idle()
+
+    def state(self, prefix):
+        """Estimates the state of a vehicle.
+
+        :param prefix: The vehicle prefix.
+        :type prefix: :class:`str`
+        :return: A :class:`VehicleState` object, or `None` if the vehicle is not being tracked.
+        """
+        track = self._tracks.get(prefix)
+        if track is None:
+            return None
+        return self._estimate(prefix, track)
+
+    def vehicles(self, route_code=None):
+        """Estimates the states of the tracked vehicles.
+
+        :param route_code: Only consider vehicles last seen running this route.
+        :type route_code: :class:`int`
+        :return: A :class:`list` of :class:`VehicleState` objects.
+        """
+        return [self._estimate(prefix, track) for prefix, track in self._tracks.items()
+                if route_code is None or track.route_code == route_code]
+
+    def stalled(self, route_code=None, min_dwell=300):
+        """Lists the vehicles that are stopped for a while.
+
+        :param route_code: Only consider vehicles last seen running this route.
+        :type route_code: :class:`int`
+        :param min_dwell: For how many seconds, at least, the vehicles must be stopped.
+        :type min_dwell: :class:`float`
+        :return: A :class:`list` of :class:`VehicleState` objects.
+        """
+        return [state for state in self.vehicles(route_code) if state.dwell >= min_dwell]
+
+    def _estimate(self, prefix, track):
+        times, latitudes, longitudes = track.samples()
+        latitude, longitude, now = latitudes[0], longitudes[0], times[0]
+        steps = [distance(latitudes[i + 1], longitudes[i + 1], latitudes[i], longitudes[i]) for i in range(len(times) - 1)]
+        speed = None
+        if steps:
+            speed = sum(steps) / (now - times[-1])
+        heading = None
+        for i, step in enumerate(steps):
+            if step > 0:
+                heading = bearing(latitudes[i + 1], longitudes[i + 1], latitudes[i], longitudes[i])
+                break
+        dwell_start = now
+        for moment, sample_latitude, sample_longitude in zip(times, latitudes, longitudes):
+            if distance(sample_latitude, sample_longitude, latitude, longitude) > self.stall_distance:
+                break
+            dwell_start = moment
+        return VehicleState(prefix, track.route_code, latitude, longitude, now, speed, heading, now - dwell_start)
+
+    def _forget_idle(self):
+        # The tracks are kept in the order the vehicles were last seen, so only the idle ones at the front are looked at.
+        limit = self._latest - self.max_idle
+        while self._tracks:
+            prefix = next(iter(self._tracks))
+            if self._tracks[prefix].last_time() >= limit:
+                break
+            del self._tracks[prefix]
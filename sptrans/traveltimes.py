@@ -0,0 +1,295 @@
+"""Module for estimating travel times between consecutive stops of the routes, from the recorded vehicle positions.
+
+A :class:`TravelTimeEstimator` knows the ordered stops of each route - as returned by
+:meth:`sptrans.v0.Client.search_stops_by_route` -, and snaps each vehicle position to the segment between two consecutive
+stops. When a vehicle is seen passing through consecutive stops, the time it took is accumulated in rolling statistics per
+segment and time of the day:
+::
+
+    import time
+    from datetime import datetime
+
+    from sptrans.v0 import Client
+    from sptrans.traveltimes import TravelTimeEstimator
+
+
+    client = Client()
+    client.authenticate('this is my token')
+
+    estimator = TravelTimeEstimator()
+    estimator.load_route(client, 1234)
+    while True:
+        estimator.update(1234, client.get_positions(1234), observed_at=datetime.now())
+        time.sleep(30)
+
+    print(estimator.travel_time(1234, 7014417, 60016784))
+
+Times of the day are taken from the moments of observation as they are, so use naive local times, like the ones returned by
+:meth:`datetime.datetime.now`.
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from math import ceil, sqrt
+
+from sptrans.geo import Grid, Projection
+from sptrans.tracking import to_timestamp
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+SegmentEstimate = namedtuple('SegmentEstimate', ['route_code', 'segment', 'from_stop', 'to_stop', 'bucket', 'count', 'mean', 'deviation'])
+"""A namedtuple representing the estimated travel time between two consecutive stops of a route.
+
+:var route_code: (:class:`int`) The route code.
+:var segment: (:class:`int`) The segment index, which is the index of its first stop in the route.
+:var from_stop: (:class:`int`) The code of the stop where the segment starts.
+:var to_stop: (:class:`int`) The code of the stop where the segment ends.
+:var bucket: (:class:`int`) The index of the time of the day bucket.
+:var count: (:class:`int`) How many travels were measured.
+:var mean: (:class:`float`) The rolling mean of the travel time, in seconds, or `None` if no travels were measured.
+:var deviation: (:class:`float`) The rolling standard deviation of the travel time, in seconds, or `None` if no travels were measured.
+"""
+
+
+class _RouteGeometry(object):
+
+    def __init__(self, stops, cell_size, margin):
+        self.stop_codes = [stop.code for stop in stops]
+        self.grid = Grid(cell_size, Projection.around([stop.latitude for stop in stops]))
+        projected = [self.grid.projection.project(stop.latitude, stop.longitude) for stop in stops]
+        self.xs = array('d', [x for x, _ in projected])
+        self.ys = array('d', [y for _, y in projected])
+        self.cumulative = array('d', [0.0])
+        for index in range(len(stops) - 1):
+            length = sqrt((self.xs[index + 1] - self.xs[index]) ** 2 + (self.ys[index + 1] - self.ys[index]) ** 2)
+            self.cumulative.append(self.cumulative[-1] + length)
+        self.cells = {}
+        for index in range(len(stops) - 1):
+            first_x, first_y = self.grid.key(min(self.xs[index], self.xs[index + 1]) - margin,
+                                             min(self.ys[index], self.ys[index + 1]) - margin)
+            last_x, last_y = self.grid.key(max(self.xs[index], self.xs[index + 1]) + margin,
+                                           max(self.ys[index], self.ys[index + 1]) + margin)
+            for cell_x in range(first_x, last_x + 1):
+                for cell_y in range(first_y, last_y + 1):
+                    self.cells.setdefault((cell_x, cell_y), []).append(index)
+
+    @property
+    def segments(self):
+        return len(self.stop_codes) - 1
+
+    def snap(self, latitude, longitude, max_distance):
+        # Returns the distance along the route of the closest point to the position, or None if it's too far from the route.
+        x, y = self.grid.projection.project(latitude, longitude)
+        best = None
+        best_distance = max_distance
+        for index in self.cells.get(self.grid.key(x, y), ()):
+            start_x, start_y = self.xs[index], self.ys[index]
+            delta_x, delta_y = self.xs[index + 1] - start_x, self.ys[index + 1] - start_y
+            length_squared = delta_x ** 2 + delta_y ** 2
+            fraction = 0.0
+            if length_squared:
+                fraction = min(1.0, max(0.0, ((x - start_x) * delta_x + (y - start_y) * delta_y) / length_squared))
+            distance = sqrt((start_x + fraction * delta_x - x) ** 2 + (start_y + fraction * delta_y - y) ** 2)
+            if distance <= best_distance:
+                best_distance = distance
+                start, end = self.cumulative[index], self.cumulative[index + 1]
+                best = end if fraction == 1.0 else start + fraction * (end - start)
+        return best
+
+
+class _RouteStats(object):
+
+    def __init__(self, segments, buckets):
+        size = segments * buckets
+        self.counts = array('l', [0] * size)
+        self.means = array('d', [0.0] * size)
+        self.variances = array('d', [0.0] * size)
+
+    def add(self, index, seconds, smoothing):
+        self.counts[index] += 1
+        weight = max(1.0 / self.counts[index], smoothing)
+        difference = seconds - self.means[index]
+        self.means[index] += weight * difference
+        self.variances[index] = (1 - weight) * (self.variances[index] + weight * difference ** 2)
+
+
+class TravelTimeEstimator(object):
+    """Estimator of travel times between consecutive stops, per route and time of the day.
+
+    :param bucket_minutes: The size, in minutes, of the time of the day buckets; when it doesn't divide a day, the last
+                           bucket is shorter.
+    :type bucket_minutes: :class:`int`
+    :param max_snap_distance: How far, in meters, a vehicle may be from the route to be snapped to it.
+    :type max_snap_distance: :class:`float`
+    :param smoothing: The minimum weight of a new travel in the rolling statistics; the higher, the faster they adapt.
+    :type smoothing: :class:`float`
+    :param max_idle: After how many seconds without being seen a vehicle is forgotten.
+    :type max_idle: :class:`float`
+    :param cell_size: The size, in meters, of the cells of the spatial index of segments.
+    :type cell_size: :class:`float`
+    """
+
+    def __init__(self, bucket_minutes=60, max_snap_distance=100, smoothing=0.05, max_idle=900, cell_size=500):
+        self.bucket_seconds = bucket_minutes * 60
+        self.buckets = int(ceil(float(SECONDS_PER_DAY) / self.bucket_seconds))
+        self.max_snap_distance = max_snap_distance
+        self.smoothing = smoothing
+        self.max_idle = max_idle
+        self.cell_size = cell_size
+        self._geometries = {}
+        self._stats = {}
+        self._vehicles = OrderedDict()
+
+    def add_route(self, route_code, stops):
+        """Precomputes the segments of a route, from its ordered stops.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param stops: The stops of the route, in order.
+        :type stops: iterable of :class:`sptrans.v0.Stop`
+        """
+        stops = list(stops)
+        if len(stops) < 2:
+            raise ValueError('A route needs at least two stops to have segments')
+        geometry = _RouteGeometry(stops, self.cell_size, self.max_snap_distance)
+        self._geometries[route_code] = geometry
+        self._stats[route_code] = _RouteStats(geometry.segments, self.buckets)
+        for key in [key for key in self._vehicles if key[0] == route_code]:
+            del self._vehicles[key]
+
+    def load_route(self, client, route_code):
+        """Fetches the stops of a route and precomputes its segments.
+
+        :param client: The (authenticated) client used to fetch the stops.
+        :type client: :class:`sptrans.v0.Client`
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        """
+        self.add_route(route_code, client.search_stops_by_route(route_code))
+
+    def update(self, route_code, positions, observed_at=None):
+        """Snaps the vehicle positions of a route to its segments, and accumulates the travel times of the traversed segments.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param positions: The positions, as returned by :meth:`sptrans.v0.Client.get_positions`.
+        :type positions: :class:`sptrans.v0.Positions`
+        :param observed_at: When the positions were fetched, defaults to the time reported by the API.
+        :type observed_at: :class:`datetime.datetime` or :class:`float` (seconds since the epoch)
+        :return: How many segment travels were accumulated.
+        """
+        geometry = self._geometries[route_code]
+        stats = self._stats[route_code]
+        moment = to_timestamp(positions.time if observed_at is None else observed_at)
+        travels = 0
+        for vehicle in positions.vehicles:
+            progress = geometry.snap(vehicle.latitude, vehicle.longitude, self.max_snap_distance)
+            if progress is None:
+                continue
+            key = (route_code, vehicle.prefix)
+            previous = self._vehicles.get(key)
+            if previous is not None:
+                if moment <= previous[0]:
+                    continue
+                del self._vehicles[key]
+            self._vehicles[key] = state = [moment, progress, None, None]
+            if previous is None:
+                continue
+            last_moment, last_progress, passed_stop, passed_at = previous
+            if progress < last_progress - self.max_snap_distance:
+                continue
+            if progress <= last_progress:
+                state[1:] = last_progress, passed_stop, passed_at
+                continue
+            state[2:] = passed_stop, passed_at
+            first = bisect_right(geometry.cumulative, last_progress) if last_progress > 0 else 0
+            for stop_index in range(first, bisect_right(geometry.cumulative, progress)):
+                crossed_at = last_moment + (geometry.cumulative[stop_index] - last_progress) / (progress - last_progress) * (moment - last_moment)
+                if state[2] == stop_index - 1:
+                    segment = stop_index - 1
+                    stats.add(segment * self.buckets + self._bucket(state[3]), crossed_at - state[3], self.smoothing)
+                    travels += 1
+                state[2:] = stop_index, crossed_at
+        self._forget_idle(moment)
+        return travels
+
+    def estimate(self, route_code, segment, at=None):
+        """Gets the estimated travel time for a segment of a route.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param segment: The segment index, which is the index of its first stop in the route.
+        :type segment: :class:`int`
+        :param at: The time of the day to get the estimate for, defaults to the statistics of the whole day.
+        :type at: :class:`datetime.datetime` or :class:`float` (seconds since the epoch)
+        :return: A :class:`SegmentEstimate` object.
+        """
+        geometry = self._geometries[route_code]
+        stats = self._stats[route_code]
+        if at is None:
+            buckets = range(self.buckets)
+            bucket = None
+        else:
+            bucket = self._bucket(to_timestamp(at))
+            buckets = [bucket]
+        count = 0
+        total = 0.0
+        squares = 0.0
+        for index in buckets:
+            position = segment * self.buckets + index
+            bucket_count = stats.counts[position]
+            if bucket_count:
+                count += bucket_count
+                total += bucket_count * stats.means[position]
+                squares += bucket_count * (stats.variances[position] + stats.means[position] ** 2)
+        mean = deviation = None
+        if count:
+            mean = total / count
+            deviation = sqrt(max(0.0, squares / count - mean ** 2))
+        return SegmentEstimate(route_code, segment, geometry.stop_codes[segment], geometry.stop_codes[segment + 1],
+                               bucket, count, mean, deviation)
+
+    def estimates(self, route_code, at=None):
+        """Gets the estimated travel times for all segments of a route.
+
+        :return: A :class:`list` of :class:`SegmentEstimate` objects, in route order.
+        """
+        return [self.estimate(route_code, segment, at) for segment in range(self._geometries[route_code].segments)]
+
+    def travel_time(self, route_code, from_stop, to_stop, at=None):
+        """Estimates the travel time between two stops of a route.
+
+        :param route_code: The route code.
+        :type route_code: :class:`int`
+        :param from_stop: The code of the stop to start from.
+        :type from_stop: :class:`int`
+        :param to_stop: The code of a later stop in the route.
+        :type to_stop: :class:`int`
+        :param at: The time of the day to get the estimate for, defaults to the statistics of the whole day.
+        :type at: :class:`datetime.datetime` or :class:`float` (seconds since the epoch)
+        :return: The estimated time in seconds, or `None` if any of the segments in between has no measured travels.
+        """
+        stop_codes = self._geometries[route_code].stop_codes
+        start = stop_codes.index(from_stop)
+        end = stop_codes.index(to_stop, start)
+        total = 0.0
+        for segment in range(start, end):
+            mean = self.estimate(route_code, segment, at).mean
+            if mean is None:
+                return None
+            total += mean
+        return total
+
+    def _bucket(self, moment):
+        return int((moment % SECONDS_PER_DAY) // self.bucket_seconds)
+
+    def _forget_idle(self, moment):
+        # The vehicles are kept in the order they were last seen, so only the idle ones at the front are looked at.
+        limit = moment - self.max_idle
+        while self._vehicles:
+            key = next(iter(self._vehicles))
+            if self._vehicles[key][0] >= limit:
+                break
+            del self._vehicles[key]
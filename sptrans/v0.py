@@ -12,9 +12,17 @@ The first thing you have to do, in order to use it, is to instantiate a client a
 Then you can use the other methods to grab data from the API.
 """
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from datetime import date, datetime, time
+import hashlib
+from itertools import islice
 import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from time import time as now
 try:
     from urllib import urlencode
 except ImportError:  # pragma: no cover
@@ -24,6 +32,18 @@ import requests
 
 
 BASE_URL = 'http://api.olhovivo.sptrans.com.br/v0'
+STATIC_ENDPOINTS = frozenset([
+    'Linha/Buscar',
+    'Parada/Buscar',
+    'Parada/BuscarParadasPorLinha',
+    'Parada/BuscarParadasPorCorredor',
+    'Corredor',
+])
+"""The endpoints whose data rarely change - routes, stops and lanes."""
+SNAPSHOT_VERSION = 1
+CHUNK_SIZE = 64 * 1024
+_error_message = re.compile(br'\s*\{\s*"Message"\s*:')
+_content_encodings = None
 
 
 class RequestError(Exception):
@@ -38,6 +58,10 @@ class AuthenticationError(Exception):
     """Raised when the authentication fails - for example, with a wrong token -."""
 
 
+class CircuitOpenError(RequestError):
+    """Raised when an endpoint failed too many times in a row, and is not called again until its circuit breaker resets."""
+
+
 class TupleMapMixin(object):
     MAPPING = {}
 
@@ -51,6 +75,21 @@ class TupleMapMixin(object):
                 kwargs[key] = value.resolve(result_dict)
         return cls(**kwargs)
 
+    @classmethod
+    def from_dicts(cls, result_dicts):
+        if not isinstance(result_dicts, list):
+            result_dicts = list(result_dicts)
+        columns = []
+        for name in cls._fields:
+            value = cls.MAPPING[name]
+            if isinstance(value, str):
+                columns.append([result_dict[value] for result_dict in result_dicts])
+            elif hasattr(value, 'resolve_many'):
+                columns.append(value.resolve_many(result_dicts))
+            else:
+                columns.append([value.resolve(result_dict) for result_dict in result_dicts])
+        return list(map(cls._make, zip(*columns)))
+
 
 def build_tuple_class(name, mapping):
     base_classes = (namedtuple(name, mapping.keys()), TupleMapMixin)
@@ -63,32 +102,232 @@ def time_string_to_datetime(time_string):
     return datetime.combine(date.today(), time(hour=hour, minute=minute))
 
 
-class TimeField(object):
+class Field(object):
+    """Base class for the fields of the models, which tell how to get a value from the results of the API.
+
+    The models built with :func:`build_tuple_class` map each of their attributes either to a key of the result dicts,
+    or to a field object. Fields resolve values from a single result dict with :meth:`resolve`, and from a list of them at
+    once with :meth:`resolve_many`, which is what is used when decoding lists of results; subclasses must override at
+    least one of them, and should override :meth:`resolve_many` when decoding in batches can be done faster.
+
+    Example:
+    ::
+
+        from sptrans.v0 import Field, build_tuple_class
+
+
+        class UpperField(Field):
+            def resolve_many(self, result_dicts):
+                return [result_dict[self.field].upper() for result_dict in result_dicts]
+
+
+        Sign = build_tuple_class('Sign', {
+            'code': 'cl',
+            'sign': UpperField('c'),
+        })
+        signs = Sign.from_dicts([{'cl': 1, 'c': '675k-10'}])
+
+    :param field: The key of the value in the result dicts.
+    :type field: :class:`str`
+    """
 
     def __init__(self, field):
         self.field = field
 
+    def resolve(self, result_dict):
+        """Resolves the value from a single result dict."""
+        return self.resolve_many([result_dict])[0]
+
+    def resolve_many(self, result_dicts):
+        """Resolves the values from a list of result dicts, returning a list of values in the same order."""
+        return [self.resolve(result_dict) for result_dict in result_dicts]
+
+
+class TimeField(Field):
+    """A field for "HH:MM" strings, resolved as :class:`datetime.datetime` objects of the current day."""
+
     def resolve(self, result_dict):
         return time_string_to_datetime(result_dict[self.field])
 
+    def resolve_many(self, result_dicts):
+        # Times repeat a lot in a result, so each distinct one is parsed only once.
+        today = date.today()
+        parsed = {}
+        values = []
+        for result_dict in result_dicts:
+            time_string = result_dict[self.field]
+            value = parsed.get(time_string)
+            if value is None:
+                hour, minute = time_string.split(':')
+                value = parsed[time_string] = datetime.combine(today, time(hour=int(hour), minute=int(minute)))
+            values.append(value)
+        return values
+
+
+class FloatField(Field):
+    """A field for numbers that should always be resolved as :class:`float` objects, like coordinates. `None` is kept as it is."""
+
+    def resolve(self, result_dict):
+        value = result_dict[self.field]
+        return value if value is None else float(value)
+
+    def resolve_many(self, result_dicts):
+        field = self.field
+        return [None if result_dict[field] is None else float(result_dict[field]) for result_dict in result_dicts]
+
+
+class ChoiceField(Field):
+    """A field for values that are codes for a fixed set of choices, like route directions.
+
+    :param field: The key of the value in the result dicts.
+    :type field: :class:`str`
+    :param choices: A mapping from the codes to the values to resolve to.
+    :type choices: :class:`dict`
+    :param default: The value to resolve to when the code is not in the choices.
+    """
+
+    def __init__(self, field, choices, default=None):
+        super(ChoiceField, self).__init__(field)
+        self.choices = choices
+        self.default = default
+
+    def resolve_many(self, result_dicts):
+        field = self.field
+        get = self.choices.get
+        default = self.default
+        return [get(result_dict[field], default) for result_dict in result_dicts]
+
+
+PoolReport = namedtuple('PoolReport', ['size', 'hits', 'misses', 'saved_bytes'])
+"""A namedtuple representing how much a :class:`StringPool` saved so far.
+
+:var size: (:class:`int`) The number of distinct strings currently in the pool.
+:var hits: (:class:`int`) How many decoded strings were replaced by one already in the pool.
+:var misses: (:class:`int`) How many decoded strings were new to the pool.
+:var saved_bytes: (:class:`int`) The sum of the sizes of the replaced strings, which means memory that didn't have to be kept.
+"""
+
+
+class StringPool(object):
+    """A bounded pool of strings, used to deduplicate repeated values when decoding the API results.
+
+    Vehicle prefixes, route signs, terminal names and stop names repeat a lot between results, so keeping a single copy of
+    each of them saves a lot of memory when results are kept around. When the pool reaches its maximum size it's emptied,
+    so that it doesn't grow forever in long-running processes.
+
+    :param max_size: The maximum number of distinct strings to keep.
+    :type max_size: :class:`int`
+
+    Example:
+    ::
+
+        from sptrans.v0 import STRING_POOL
+
+
+        report = STRING_POOL.report()
+        print(report.hits, report.saved_bytes)
+    """
+
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self._strings = {}
+        self.clear()
+
+    def clear(self):
+        """Empties the pool and resets its counters."""
+        self._strings.clear()
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+
+    def intern(self, value):
+        """Gets the pooled copy of a string, adding it to the pool if it's new.
+
+        :param value: The string to deduplicate. `None` and values that are not hashable are returned as they are.
+        :return: The pooled string.
+        """
+        if value is None:
+            return value
+        try:
+            pooled = self._strings.get(value)
+        except TypeError:
+            return value
+        if pooled is None:
+            self.misses += 1
+            if len(self._strings) >= self.max_size:
+                self._strings.clear()
+            self._strings[value] = value
+            return value
+        if pooled is not value:
+            self.hits += 1
+            self.saved_bytes += sys.getsizeof(value)
+        return pooled
+
+    def report(self):
+        """Reports how much the pool has saved since it was created or cleared.
+
+        :return: A :class:`PoolReport` object.
+        """
+        return PoolReport(len(self._strings), self.hits, self.misses, self.saved_bytes)
+
+
+STRING_POOL = StringPool()
+"""The :class:`StringPool` used when decoding the API results."""
+
+
+class InternedField(Field):
+    """A field for strings that repeat a lot, which are deduplicated with a :class:`StringPool`."""
+
+    def __init__(self, field, pool=STRING_POOL):
+        super(InternedField, self).__init__(field)
+        self.pool = pool
+
+    def resolve(self, result_dict):
+        return self.pool.intern(result_dict[self.field])
+
+    def resolve_many(self, result_dicts):
+        field = self.field
+        intern = self.pool.intern
+        return [intern(result_dict[field]) for result_dict in result_dicts]
+
+
+class TupleField(Field):
+    """A field for a nested result, resolved as a model."""
 
-class TupleField(object):
     def __init__(self, field, tuple_class):
-        self.field = field
+        super(TupleField, self).__init__(field)
         self.tuple_class = tuple_class
 
     def resolve(self, result_dict):
         return self.tuple_class.from_dict(result_dict[self.field])
 
+    def resolve_many(self, result_dicts):
+        field = self.field
+        return self.tuple_class.from_dicts([result_dict[field] for result_dict in result_dicts])
+
+
+class TupleListField(Field):
+    """A field for a list of nested results, resolved as a list of models."""
 
-class TupleListField(object):
     def __init__(self, field, tuple_class):
-        self.field = field
+        super(TupleListField, self).__init__(field)
         self.tuple_class = tuple_class
 
     def resolve(self, result_dict):
-        return [self.tuple_class.from_dict(internal_dict)
-                for internal_dict in result_dict[self.field]]
+        return self.tuple_class.from_dicts(result_dict[self.field])
+
+    def resolve_many(self, result_dicts):
+        # The children of all the results are decoded in a single batch, and then split back.
+        field = self.field
+        children = [result_dict[field] for result_dict in result_dicts]
+        models = self.tuple_class.from_dicts([child for internal_dicts in children for child in internal_dicts])
+        values = []
+        start = 0
+        for internal_dicts in children:
+            end = start + len(internal_dicts)
+            values.append(models[start:end])
+            start = end
+        return values
 
 
 Route = build_tuple_class('Route', {
@@ -139,7 +378,7 @@ Lane = build_tuple_class('Lane', {
 :var name: (:class:`str`) The lane name.
 """
 Vehicle = build_tuple_class('Vehicle', {
-    'prefix': 'p',
+    'prefix': InternedField('p'),
     'accessible': 'a',
     'latitude': 'py',
     'longitude': 'px',
@@ -152,7 +391,7 @@ Vehicle = build_tuple_class('Vehicle', {
 :var longitude: (:class:`float`) The vehicle longitude.
 """
 VehicleForecast = build_tuple_class('VehicleForecast', {
-    'prefix': 'p',
+    'prefix': InternedField('p'),
     'accessible': 'a',
     'arriving_at': TimeField('t'),
     'latitude': 'py',
@@ -176,11 +415,11 @@ Positions = build_tuple_class('Positions', {
 :var vehicles: (:class:`list`) The list of :class:`vehicles <Vehicle>`.
 """
 RouteWithVehicles = build_tuple_class('RouteWithVehicles', {
-    'sign': 'c',
+    'sign': InternedField('c'),
     'code': 'cl',
     'direction': 'sl',
-    'main_to_sec': 'lt0',
-    'sec_to_main': 'lt1',
+    'main_to_sec': InternedField('lt0'),
+    'sec_to_main': InternedField('lt1'),
     'quantity': 'qv',
     'vehicles': TupleListField('vs', VehicleForecast),
 })
@@ -196,7 +435,7 @@ RouteWithVehicles = build_tuple_class('RouteWithVehicles', {
 """
 StopWithRoutes = build_tuple_class('StopWithRoutes', {
     'code': 'cp',
-    'name': 'np',
+    'name': InternedField('np'),
     'latitude': 'py',
     'longitude': 'px',
     'routes': TupleListField('l', RouteWithVehicles),
@@ -211,7 +450,7 @@ StopWithRoutes = build_tuple_class('StopWithRoutes', {
 """
 StopWithVehicles = build_tuple_class('StopWithVehicles', {
     'code': 'cp',
-    'name': 'np',
+    'name': InternedField('np'),
     'latitude': 'py',
     'longitude': 'px',
     'vehicles': TupleListField('vs', VehicleForecast),
@@ -244,6 +483,194 @@ ForecastWithStops = build_tuple_class('ForecastWithStops', {
 """
 
 
+def select(tuple_class, result_dicts, bbox=None, offset=0, limit=None, **filters):
+    """Filters and pages results before decoding them, so that only the selected ones become models.
+
+    Filters are given by the attribute names of the model, and are tested against the values in the result dicts, as sent by
+    the API (for example, route directions are :class:`int` codes); each filter is either a value, which must be equal to
+    the result's, or a predicate, called with the result's value.
+
+    Example:
+    ::
+
+        from sptrans.v0 import Route, select
+
+
+        routes = select(Route, route_dicts, direction=1, circular=False, type=lambda route_type: route_type in (10, 11),
+                        limit=20)
+
+    :param tuple_class: The model class of the results, like :class:`Stop`.
+    :param result_dicts: The decoded JSON results.
+    :type result_dicts: iterable of :class:`dict`
+    :param bbox: A (south, west, north, east) bounding box, in degrees, that the results must be within; only for models with
+                 `latitude` and `longitude` attributes.
+    :type bbox: :class:`tuple`
+    :param offset: How many matching results to skip.
+    :type offset: :class:`int`
+    :param limit: How many matching results to return at most, or `None` for no limit.
+    :type limit: :class:`int`
+    :raises: :class:`TypeError` when filtering by attributes that the model doesn't have, or that are not taken straight from a key of the results.
+    :return: A :class:`list` of models.
+    """
+    tests = [(_raw_key(tuple_class, name), value if callable(value) else _equals(value)) for name, value in filters.items()]
+    if bbox is not None:
+        south, west, north, east = bbox
+        tests.append((_raw_key(tuple_class, 'latitude'), lambda latitude: south <= latitude <= north))
+        tests.append((_raw_key(tuple_class, 'longitude'), lambda longitude: west <= longitude <= east))
+    matching = (result_dict for result_dict in result_dicts if all(test(result_dict[key]) for key, test in tests))
+    stop = None if limit is None else offset + limit
+    return tuple_class.from_dicts(list(islice(matching, offset, stop)))
+
+
+def _raw_key(tuple_class, name):
+    value = tuple_class.MAPPING.get(name)
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (InternedField, FloatField)):
+        return value.field
+    raise TypeError('{} cannot be filtered by "{}"'.format(tuple_class.__name__, name))
+
+
+def _equals(expected):
+    return lambda value: value == expected
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of an endpoint, failing fast while the API is unhealthy.
+
+    The circuit is closed while the calls succeed. After `failure_threshold` failures in a row, it opens, and calls are
+    refused for `reset_timeout` seconds; then it's half-open, letting a single trial call through - which closes it again
+    if it succeeds, or opens it for another `reset_timeout` seconds if it fails.
+
+    :param failure_threshold: How many failures in a row open the circuit.
+    :type failure_threshold: :class:`int`
+    :param reset_timeout: For how many seconds calls are refused once the circuit opens.
+    :type reset_timeout: :class:`float`
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Tells whether a call may be made now.
+
+        :return: `True` if the circuit is closed or if this is the trial call of a half-open circuit, `False` otherwise.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if now() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.opened_at = now()
+            return True
+
+    def succeed(self):
+        """Records a successful call, closing the circuit."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def fail(self):
+        """Records a failed call, opening the circuit if it was half-open or if the failures reached the threshold."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = now()
+
+
+TransferStats = namedtuple('TransferStats', ['requests', 'wire_bytes', 'decoded_bytes'])
+"""A namedtuple representing how much data was transferred from an endpoint.
+
+:var requests: (:class:`int`) The number of requests made to the endpoint.
+:var wire_bytes: (:class:`int`) The number of bytes received through the network, possibly compressed.
+:var decoded_bytes: (:class:`int`) The number of bytes after decompressing the content.
+"""
+RawResponse = namedtuple('RawResponse', ['url', 'content', 'content_type', 'etag', 'last_modified', 'fetched_at'])
+"""A namedtuple representing an undecoded API response, as returned by the endpoint methods in raw mode.
+
+:var url: (:class:`str`) The requested URL.
+:var content: (:class:`memoryview`) The response body, with the JSON bytes exactly as sent by the API (after undoing the
+    transfer compression).
+:var content_type: (:class:`str`) The ``Content-Type`` header, which tells the charset of the content.
+:var etag: (:class:`str`) The ``ETag`` header, or `None`.
+:var last_modified: (:class:`str`) The ``Last-Modified`` header, or `None`.
+:var fetched_at: (:class:`float`) When the response was received, in seconds since the epoch.
+"""
+
+
+def content_encodings():
+    """Lists the content encodings that can be decompressed in this environment.
+
+    "gzip" and "deflate" are always supported; "br" is supported only if the `brotli` (or `brotlicffi`) package is installed.
+
+    :return: A :class:`list` of :class:`str` encoding names.
+    """
+    global _content_encodings
+    if _content_encodings is None:
+        encodings = ['gzip', 'deflate']
+        try:
+            import brotli  # noqa
+        except ImportError:
+            try:
+                import brotlicffi  # noqa
+            except ImportError:
+                pass
+            else:  # pragma: no cover
+                encodings.append('br')
+        else:  # pragma: no cover
+            encodings.append('br')
+        _content_encodings = encodings
+    return list(_content_encodings)
+
+
+def _session_expiry(cookies):
+    try:
+        expirations = [cookie.expires for cookie in cookies if cookie.expires]
+    except (AttributeError, TypeError):
+        return None
+    return min(expirations) if expirations else None
+
+
+def _wire_bytes(response, decoded_bytes):
+    try:
+        wire_bytes = response.raw.tell()
+    except AttributeError:
+        wire_bytes = None
+    if isinstance(wire_bytes, int):
+        return wire_bytes
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        return int(content_length)
+    return decoded_bytes
+
+
+def _replace_file(path, content, mode):
+    # The content is written to a temporary file, renamed over the old one, so that no process ever reads a partial file.
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        os.chmod(temporary_path, mode)
+        with os.fdopen(descriptor, 'w') as temporary_file:
+            temporary_file.write(content)
+        os.rename(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+_Payload = namedtuple('_Payload', ['digest', 'etag', 'last_modified', 'fetched_at', 'result', 'model'])
+
+
 class Client(object):
     """Main client class.
 
@@ -259,45 +686,443 @@ class Client(object):
         client = Client()
         client.authenticate('this is my token')
 
+    Responses are remembered per URL, so that polling an endpoint faster than the API refreshes its data is cheap: the client sends
+    conditional headers (``If-None-Match`` and ``If-Modified-Since``) when the API provided validators, and, if the API answers with
+    ``304 Not Modified`` or with the very same body as before, the previously built objects are returned, without decoding the
+    content again. After each call, the :attr:`fresh` attribute tells whether the result was new or a repetition of the previous one, in the current thread:
+    ::
+
+        positions = client.get_positions(1234)
+        if client.fresh:
+            print('New positions at', positions.time)
+
+    The client asks for compressed responses (see :func:`content_encodings`) and decompresses them as they're streamed, keeping
+    account of how many bytes were received through the network and how many they became after decompressing, per endpoint:
+    ::
+
+        for endpoint, stats in client.transfer_stats.items():
+            print(endpoint, stats.wire_bytes, stats.decoded_bytes)
+
+    Processes that start often can skip the authentication and the fetching of static data by saving the session and the
+    static results once, and loading them when creating the next clients:
+    ::
+
+        client = Client(token='this is my token', static_ttl=24 * 60 * 60)
+        client.authenticate()
+        list(client.list_lanes())
+        client.save_session('/var/run/sptrans/session.json')
+        client.save_snapshot('/var/run/sptrans/snapshot.json')
+
+        # Later, in another process:
+        client = Client(token='this is my token', static_ttl=24 * 60 * 60,
+                        session_file='/var/run/sptrans/session.json', snapshot_file='/var/run/sptrans/snapshot.json')
+
+    A client can be shared by many threads: connections are pooled, and, if it was given a token, the client authenticates
+    again by itself when the session expires, with a single login shared by all threads:
+    ::
+
+        from concurrent.futures import ThreadPoolExecutor
+
+
+        client = Client(token='this is my token')
+        client.authenticate()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            all_positions = list(executor.map(client.get_positions, route_codes))
+
+    Requests time out (see `timeout`) instead of piling up threads when the API slows down, and each endpoint has a
+    :class:`CircuitBreaker` (in :attr:`breakers`) that, after repeated failures, refuses calls with :class:`CircuitOpenError`
+    for a while. With `serve_stale`, failed or refused calls return the last result of the same URL instead, if there's one:
+    ::
+
+        client = Client(token='this is my token', timeout=(2, 5), serve_stale=True)
+        client.authenticate()
+        positions = client.get_positions(1234)
+        if not client.fresh:
+            print('Positions may be outdated:', positions.time)
+
+    Every endpoint method also has a raw mode, for relaying or archiving responses: the body is returned as it came from the
+    API, in a :class:`RawResponse`, without decoding it, parsing the JSON or building any objects - and without going through
+    the caches, which only keep decoded results:
+    ::
+
+        response = client.get_positions(1234, raw=True)
+        archive.write(response.content)
+
+    Processes on the same host, like the workers of a pre-forked server, can share the results through a `cache` (see
+    :mod:`sptrans.sharedcache`), so that each URL is fetched by a single process and read by all the others:
+    ::
+
+        from sptrans.sharedcache import SharedCache
+
+
+        client = Client(token='this is my token', cache=SharedCache(ttl=15))
+
+    :param token: The API token, used by :meth:`authenticate` and for authenticating again when the session expires.
+    :type token: :class:`str`
+    :param base_url: The base URL of the API.
+    :type base_url: :class:`str`
+    :param max_payloads: How many responses (one per URL) to remember.
+    :type max_payloads: :class:`int`
+    :param headers: Extra headers to send in every request.
+    :type headers: :class:`dict`
+    :param pool_size: How many connections to keep open with the API, which should be at least the number of threads using the client.
+    :type pool_size: :class:`int`
+    :param static_ttl: For how many seconds the results of endpoints with static data (see :data:`STATIC_ENDPOINTS`) are served
+                       from memory, without calling the API.
+    :type static_ttl: :class:`float`
+    :param session_file: A file saved with :meth:`save_session`, to restore the session from, if it exists.
+    :type session_file: :class:`str`
+    :param snapshot_file: A file saved with :meth:`save_snapshot`, to warm up the caches from, if it exists.
+    :type snapshot_file: :class:`str`
+    :param timeout: The (connect, read) timeouts of the requests, in seconds, or `None` to wait forever.
+    :type timeout: :class:`tuple`
+    :param failure_threshold: How many failures in a row - timeouts, connection errors or server errors - open the circuit of an endpoint.
+    :type failure_threshold: :class:`int`
+    :param reset_timeout: For how many seconds an endpoint is not called once its circuit opens.
+    :type reset_timeout: :class:`float`
+    :param serve_stale: Whether to return the last result of a URL, instead of raising, when the API fails or the circuit is open.
+    :type serve_stale: :class:`bool`
+    :param cache: A cache shared with other processes, like :class:`sptrans.sharedcache.SharedCache`, checked before calling the API.
     """
     _cookies = None
 
+    def __init__(self, token=None, base_url=BASE_URL, max_payloads=1024, headers=None, pool_size=10,
+                 static_ttl=0, session_file=None, snapshot_file=None, timeout=(5, 30), failure_threshold=5,
+                 reset_timeout=30, serve_stale=False, cache=None):
+        self.token = token
+        self.base_url = base_url
+        self.max_payloads = max_payloads
+        self.pool_size = pool_size
+        self.static_ttl = static_ttl
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.serve_stale = serve_stale
+        self.cache = cache
+        self.breakers = {}
+        self.authenticated_at = None
+        self.session_expires_at = None
+        self.headers = {'Accept-Encoding': ', '.join(content_encodings())}
+        self.headers.update(headers or {})
+        self.transfer_stats = {}
+        self._payloads = OrderedDict()
+        self._session = None
+        self._lock = threading.RLock()
+        self._auth_lock = threading.Lock()
+        self._local = threading.local()
+        if session_file is not None and os.path.exists(session_file):
+            self.load_session(session_file)
+        if snapshot_file is not None and os.path.exists(snapshot_file):
+            self.load_snapshot(snapshot_file)
+
+    @property
+    def fresh(self):
+        """Whether the last result obtained by the current thread was new (`True`) or a repetition of the previous one (`False`)."""
+        return getattr(self._local, 'fresh', None)
+
+    @fresh.setter
+    def fresh(self, value):
+        self._local.fresh = value
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
     def _build_url(self, endpoint, **kwargs):
         query_string = urlencode(kwargs)
-        return '{}/{}?{}'.format(BASE_URL, endpoint, query_string)
+        return '{}/{}?{}'.format(self.base_url, endpoint, query_string)
 
     def _get_content(self, endpoint, **kwargs):
-        url = self._build_url(endpoint, **kwargs)
-        response = requests.get(url, cookies=self._cookies)
-        return response.content.decode('latin1')
+        payload, content = self._fetch(endpoint, self._build_url(endpoint, **kwargs), self._cookies)
+        return content
+
+    def _fetch(self, endpoint, url, cookies):
+        # The content is None when it didn't change since the last time the URL was fetched.
+        with self._lock:
+            cached = self._payloads.get(url)
+        if cached is not None and endpoint in STATIC_ENDPOINTS and now() - cached.fetched_at < self.static_ttl:
+            self.fresh = False
+            self._remember(url, cached)
+            return cached, None
+        headers = dict(self.headers)
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        try:
+            response, content, digest = self._download(endpoint, url, cookies, headers)
+        except (CircuitOpenError, requests.RequestException) as error:
+            return self._stale(url, cached, error)
+        if response.status_code == 304:
+            digest = None
+        if cached is not None and (digest is None or digest == cached.digest):
+            self.fresh = False
+            cached = cached._replace(fetched_at=now())
+            self._remember(url, cached)
+            return cached, None
+        self.fresh = True
+        payload = _Payload(digest, response.headers.get('ETag'), response.headers.get('Last-Modified'), now(), None, None)
+        return payload, content.decode('latin1')
+
+    def _download(self, endpoint, url, cookies, headers):
+        # Returns the response, its whole content and the SHA-1 digest of the content, going through the circuit breaker of
+        # the endpoint. The body is decompressed, hashed and counted chunk by chunk as it arrives, but decoding the JSON still
+        # needs the whole content, so the chunks are joined at the end.
+        breaker = self._breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError('The circuit for "{}" is open'.format(endpoint))
+        chunks = []
+        hasher = hashlib.sha1()
+        decoded_bytes = 0
+        try:
+            response = self._get_session().get(url, cookies=cookies, headers=headers, stream=True, timeout=self.timeout)
+            try:
+                if response.status_code >= 500:
+                    raise requests.HTTPError('{} Server Error for url: {}'.format(response.status_code, url), response=response)
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    decoded_bytes += len(chunk)
+                    chunks.append(chunk)
+            except BaseException:
+                # A streamed response only gives its connection back to the pool once it's read to the end or closed.
+                response.close()
+                raise
+        except requests.RequestException:
+            breaker.fail()
+            raise
+        breaker.succeed()
+        self._account(endpoint, _wire_bytes(response, decoded_bytes), decoded_bytes)
+        return response, b''.join(chunks), hasher.hexdigest()
+
+    def _breaker(self, endpoint):
+        with self._lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def _stale(self, url, cached, error):
+        if not self.serve_stale or cached is None or cached.result is None:
+            raise error
+        self.fresh = False
+        return cached, None
+
+    def _account(self, endpoint, wire_bytes, decoded_bytes):
+        with self._lock:
+            stats = self.transfer_stats.get(endpoint, TransferStats(0, 0, 0))
+            self.transfer_stats[endpoint] = TransferStats(
+                stats.requests + 1, stats.wire_bytes + wire_bytes, stats.decoded_bytes + decoded_bytes)
+
+    def _remember(self, url, payload):
+        with self._lock:
+            self._payloads.pop(url, None)
+            self._payloads[url] = payload
+            while len(self._payloads) > self.max_payloads:
+                self._payloads.popitem(last=False)
 
     def _get_json(self, endpoint, **kwargs):
-        content = self._get_content(endpoint, **kwargs)
+        return self._get_payload(endpoint, self._build_url(endpoint, **kwargs)).result
+
+    def _get_payload(self, endpoint, url):
+        cookies = self._cookies
+        try:
+            return self._load(endpoint, url, cookies)
+        except CircuitOpenError:
+            raise
+        except RequestError:
+            if self.token is None:
+                raise
+            self._reauthenticate(cookies)
+            return self._load(endpoint, url, self._cookies)
+
+    def _load(self, endpoint, url, cookies):
+        if self.cache is None:
+            return self._decode(url, *self._fetch(endpoint, url, cookies))
+        payload = self._load_shared(endpoint, url)
+        if payload is not None:
+            return payload
+        # Only one process (or thread) refreshes an entry at a time; the ones that waited for it use the new entry.
+        with self.cache.lock(url) as waited:
+            if waited:
+                payload = self._load_shared(endpoint, url)
+                if payload is not None:
+                    return payload
+            payload = self._decode(url, *self._fetch(endpoint, url, cookies))
+            self.cache.put(url, payload.digest, payload.etag, payload.last_modified, payload.fetched_at, payload.result)
+            return payload
+
+    def _load_shared(self, endpoint, url):
+        entry = self.cache.get(url)
+        if entry is None or not self.cache.is_fresh(entry, endpoint in STATIC_ENDPOINTS):
+            return None
+        with self._lock:
+            cached = self._payloads.get(url)
+        if cached is not None and cached.result is not None and cached.digest == entry.digest:
+            self.fresh = False
+            return cached
+        self.fresh = True
+        result = json.loads(entry.content.tobytes().decode('utf-8'))
+        payload = _Payload(entry.digest, entry.etag, entry.last_modified, entry.fetched_at, result, None)
+        self._remember(url, payload)
+        return payload
+
+    def _decode(self, url, payload, content):
+        if content is None:
+            return payload
         result = json.loads(content)
         if isinstance(result, dict) and tuple(result.keys()) == (u'Message', ):
             raise RequestError(result[u'Message'])
-        return result
+        payload = payload._replace(result=result)
+        self._remember(url, payload)
+        return payload
 
-    def authenticate(self, token):
+    def _get_raw(self, endpoint, **kwargs):
+        # Skips the caches altogether, since they keep decoded results, not bytes; only the error messages are decoded.
+        url = self._build_url(endpoint, **kwargs)
+        cookies = self._cookies
+        response, content, _ = self._download(endpoint, url, cookies, self.headers)
+        if _error_message.match(content[:64]) and self.token is not None:
+            self._reauthenticate(cookies)
+            response, content, _ = self._download(endpoint, url, self._cookies, self.headers)
+        if _error_message.match(content[:64]):
+            raise RequestError(json.loads(content.decode('latin1'))[u'Message'])
+        self.fresh = True
+        headers = response.headers
+        return RawResponse(url, memoryview(content), headers.get('Content-Type'), headers.get('ETag'),
+                           headers.get('Last-Modified'), now())
+
+    def _iterate(self, convert, endpoint, **kwargs):
+        for item in self._get_model(convert, endpoint, **kwargs):
+            yield item
+
+    def _get_model(self, convert, endpoint, **kwargs):
+        url = self._build_url(endpoint, **kwargs)
+        payload = self._get_payload(endpoint, url)
+        if payload.model is None:
+            payload = payload._replace(model=convert(payload.result))
+            self._remember(url, payload)
+        return payload.model
+
+    def _reauthenticate(self, stale_cookies):
+        # Only the first thread to notice the session expired authenticates again; the others just use the new session.
+        with self._auth_lock:
+            if self._cookies is stale_cookies:
+                self.authenticate()
+
+    def authenticate(self, token=None):
         """Authenticates to the webservice.
 
-        :param token: The API token string.
+        The session is shared by all the threads using the client, and replaced at once when authenticating again.
+
+        :param token: The API token string. Defaults to the token the client was created with, and is remembered for
+                      re-authenticating later.
         :type token: :class:`str`
         :raises: :class:`AuthenticationError` when there's an error during authentication.
         """
+        if token is None:
+            token = self.token
         url = self._build_url('Login/Autenticar', token=token)
-        response = requests.post(url)
+        response = self._get_session().post(url, timeout=self.timeout)
         result = json.loads(response.content.decode('latin1'))
         if not result:
             raise AuthenticationError('Cannot authenticate with token "{}"'.format(token))
+        self.token = token
         self._cookies = response.cookies
+        self.authenticated_at = now()
+        self.session_expires_at = _session_expiry(response.cookies)
 
-    def search_routes(self, keywords):
+    def save_session(self, path):
+        """Saves the authenticated session to a file, so that another process can use it without authenticating again.
+
+        The file contains the session cookies, so keep it as protected as the token itself; it's only readable and writable by
+        its owner. It's replaced atomically, so processes loading it never read a partially written session.
+
+        :param path: The file path.
+        :type path: :class:`str`
+        """
+        state = {
+            'cookies': dict(self._cookies or {}),
+            'authenticated_at': self.authenticated_at,
+            'expires_at': self.session_expires_at,
+        }
+        _replace_file(path, json.dumps(state), 0o600)
+
+    def load_session(self, path):
+        """Restores a session saved with :meth:`save_session`.
+
+        :param path: The file path.
+        :type path: :class:`str`
+        :return: `True` if the session was restored, `False` if it was already expired.
+        """
+        with open(path) as session_file:
+            state = json.load(session_file)
+        if not state['cookies'] or (state['expires_at'] is not None and state['expires_at'] <= now()):
+            return False
+        self._cookies = state['cookies']
+        self.authenticated_at = state['authenticated_at']
+        self.session_expires_at = state['expires_at']
+        return True
+
+    def save_snapshot(self, path, endpoints=STATIC_ENDPOINTS):
+        """Saves the remembered results of some endpoints to a file, to warm up the caches of other clients.
+
+        By default, only the endpoints with static data - routes, stops and lanes - are saved. The file is replaced
+        atomically, so clients starting meanwhile read either the old snapshot or the new one.
+
+        :param path: The file path.
+        :type path: :class:`str`
+        :param endpoints: The endpoints to save the results from.
+        :type endpoints: collection of :class:`str`
+        """
+        prefix = '{}/'.format(self.base_url)
+        with self._lock:
+            payloads = [(url, payload) for url, payload in self._payloads.items()
+                        if url[len(prefix):].split('?')[0] in endpoints]
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'payloads': dict((url, [payload.digest, payload.etag, payload.last_modified, payload.fetched_at, payload.result])
+                             for url, payload in payloads),
+        }
+        _replace_file(path, json.dumps(snapshot), 0o644)
+
+    def load_snapshot(self, path):
+        """Warms up the caches with the results saved with :meth:`save_snapshot`.
+
+        Results of static endpoints are then served without calling the API while they're younger than `static_ttl` seconds,
+        and the other ones are used for conditional requests. Snapshots that cannot be decoded are ignored, like the ones of
+        other versions, so that the client starts with cold caches instead.
+
+        :param path: The file path.
+        :type path: :class:`str`
+        :return: How many results were loaded.
+        """
+        with open(path) as snapshot_file:
+            try:
+                snapshot = json.load(snapshot_file)
+            except ValueError:
+                return 0
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            return 0
+        for url, (digest, etag, last_modified, fetched_at, result) in snapshot['payloads'].items():
+            self._remember(url, _Payload(digest, etag, last_modified, fetched_at, result, None))
+        return len(snapshot['payloads'])
+
+    def search_routes(self, keywords, raw=False):
         """Searches for routes that match the provided keywords.
 
         :param keywords: The keywords, in a single string, to use for matching.
         :type keywords: :class:`str`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A generator that yields :class:`Route` objects.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -311,16 +1136,19 @@ class Client(object):
                 print(route.code, route.sign)
 
         """
-        result_list = self._get_json('Linha/Buscar', termosBusca=keywords)
-        for result_dict in result_list:
-            yield Route.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Linha/Buscar', termosBusca=keywords)
+        return self._iterate(Route.from_dicts, 'Linha/Buscar', termosBusca=keywords)
 
-    def search_stops(self, keywords):
+    def search_stops(self, keywords, raw=False):
         """Searches for bus stops that match the provided keywords.
 
         :param keywords: The keywords, in a single string, to use for matching.
         :type keywords: :class:`str`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A generator that yields :class:`Stop` objects.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -333,16 +1161,77 @@ class Client(object):
             for stop in client.search_stops('butanta'):
                 print(stop.code, stop.name)
         """
-        result_list = self._get_json('Parada/Buscar', termosBusca=keywords)
-        for result_dict in result_list:
-            yield Stop.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Parada/Buscar', termosBusca=keywords)
+        return self._iterate(Stop.from_dicts, 'Parada/Buscar', termosBusca=keywords)
+
+    def iter_routes(self, keywords, offset=0, limit=None, **filters):
+        """Searches for routes that match the provided keywords, selecting some of them before decoding (see :func:`select`).
+
+        :param keywords: The keywords, in a single string, to use for matching.
+        :type keywords: :class:`str`
+        :param offset: How many matching routes to skip.
+        :type offset: :class:`int`
+        :param limit: How many matching routes to return at most, or `None` for no limit.
+        :type limit: :class:`int`
+        :param filters: Values or predicates for the :class:`Route` attributes, tested against the raw results.
+        :return: A generator that yields :class:`Route` objects.
+
+        Example:
+        ::
+
+            from sptrans.v0 import Client
+
+
+            client = Client()
+            client.authenticate('this is my token')
+            for route in client.iter_routes('8', direction=1, circular=False, limit=10):
+                print(route.code, route.sign)
+
+        """
+        return self._select(Route, 'Linha/Buscar', dict(termosBusca=keywords), None, offset, limit, filters)
+
+    def iter_stops(self, keywords, bbox=None, offset=0, limit=None, **filters):
+        """Searches for bus stops that match the provided keywords, selecting some of them before decoding (see :func:`select`).
+
+        :param keywords: The keywords, in a single string, to use for matching.
+        :type keywords: :class:`str`
+        :param bbox: A (south, west, north, east) bounding box, in degrees, that the stops must be within.
+        :type bbox: :class:`tuple`
+        :param offset: How many matching stops to skip.
+        :type offset: :class:`int`
+        :param limit: How many matching stops to return at most, or `None` for no limit.
+        :type limit: :class:`int`
+        :param filters: Values or predicates for the :class:`Stop` attributes, tested against the raw results.
+        :return: A generator that yields :class:`Stop` objects.
+
+        Example:
+        ::
+
+            from sptrans.v0 import Client
+
+
+            client = Client()
+            client.authenticate('this is my token')
+            for stop in client.iter_stops('paulista', bbox=(-23.58, -46.67, -23.55, -46.63), limit=10):
+                print(stop.code, stop.name)
+
+        """
+        return self._select(Stop, 'Parada/Buscar', dict(termosBusca=keywords), bbox, offset, limit, filters)
+
+    def _select(self, tuple_class, endpoint, params, bbox, offset, limit, filters):
+        for item in select(tuple_class, self._get_json(endpoint, **params), bbox, offset, limit, **filters):
+            yield item
 
-    def search_stops_by_route(self, code):
+    def search_stops_by_route(self, code, raw=False):
         """Searches for bus stops that are passed by the route specified by its code.
 
         :param code: The route code to use for matching.
         :type code: :class:`int`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A generator that yields :class:`Stop` objects.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -355,16 +1244,19 @@ class Client(object):
             for stop in client.search_stops_by_route(1234):
                 print(stop.code, stop.name)
         """
-        result_list = self._get_json('Parada/BuscarParadasPorLinha', codigoLinha=code)
-        for result_dict in result_list:
-            yield Stop.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Parada/BuscarParadasPorLinha', codigoLinha=code)
+        return self._iterate(Stop.from_dicts, 'Parada/BuscarParadasPorLinha', codigoLinha=code)
 
-    def search_stops_by_lane(self, code):
+    def search_stops_by_lane(self, code, raw=False):
         """Searches for bus stops that are contained in a lane specified by its code.
 
         :param code: The lane code to use for matching.
         :type code: :class:`int`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A generator that yields :class:`Stop` objects.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -377,14 +1269,17 @@ class Client(object):
             for stop in client.search_stops_by_lane(1234):
                 print(stop.code, stop.name)
         """
-        result_list = self._get_json('Parada/BuscarParadasPorCorredor', codigoCorredor=code)
-        for result_dict in result_list:
-            yield Stop.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Parada/BuscarParadasPorCorredor', codigoCorredor=code)
+        return self._iterate(Stop.from_dicts, 'Parada/BuscarParadasPorCorredor', codigoCorredor=code)
 
-    def list_lanes(self):
+    def list_lanes(self, raw=False):
         """Lists all the bus lanes in the city.
 
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A generator that yields :class:`Lane` objects.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -397,16 +1292,19 @@ class Client(object):
             for lane in client.list_lanes():
                 print(lane.code, lane.name)
         """
-        result_list = self._get_json('Corredor')
-        for result_dict in result_list:
-            yield Lane.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Corredor')
+        return self._iterate(Lane.from_dicts, 'Corredor')
 
-    def get_positions(self, code):
+    def get_positions(self, code, raw=False):
         """Gets the vehicles with their current positions, provided a route code.
 
         :param code: The route code to use for matching.
         :type code: :class:`int`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A single :class:`Positions` object.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -423,10 +1321,11 @@ class Client(object):
             for vehicle in positions.vehicles:
                 print(vehicle.prefix)
         """
-        result_dict = self._get_json('Posicao', codigoLinha=code)
-        return Positions.from_dict(result_dict)
+        if raw:
+            return self._get_raw('Posicao', codigoLinha=code)
+        return self._get_model(Positions.from_dict, 'Posicao', codigoLinha=code)
 
-    def get_forecast(self, stop_code=None, route_code=None):
+    def get_forecast(self, stop_code=None, route_code=None, raw=False):
         """Gets the arrival forecast, provided a route code or a stop code or both.
 
         You must provide at least one of the parameters.
@@ -438,8 +1337,11 @@ class Client(object):
         :type stop_code: :class:`int`
         :param route_code: The stop code to use for matching.
         :type route_code: :class:`int`
+        :param raw: Whether to return the undecoded response instead of the models.
+        :type raw: :class:`bool`
         :return: A single :class:`ForecastWithStop` object, when passing only `stop_code` or both.
         :return: A single :class:`ForecastWithStops` object, when passing only `route_code`.
+        :return: A :class:`RawResponse` object, in raw mode.
 
         Example:
         ::
@@ -466,11 +1368,14 @@ class Client(object):
                     print(vehicle.prefix)
         """
         if stop_code is None:
-            result_dict = self._get_json('Previsao/Linha', codigoLinha=route_code)
-            return ForecastWithStops.from_dict(result_dict)
+            if raw:
+                return self._get_raw('Previsao/Linha', codigoLinha=route_code)
+            return self._get_model(ForecastWithStops.from_dict, 'Previsao/Linha', codigoLinha=route_code)
 
         if route_code is None:
-            result_dict = self._get_json('Previsao/Parada', codigoParada=stop_code)
-        else:
-            result_dict = self._get_json('Previsao', codigoParada=stop_code, codigoLinha=route_code)
-        return ForecastWithStop.from_dict(result_dict)
+            if raw:
+                return self._get_raw('Previsao/Parada', codigoParada=stop_code)
+            return self._get_model(ForecastWithStop.from_dict, 'Previsao/Parada', codigoParada=stop_code)
+        if raw:
+            return self._get_raw('Previsao', codigoParada=stop_code, codigoLinha=route_code)
+        return self._get_model(ForecastWithStop.from_dict, 'Previsao', codigoParada=stop_code, codigoLinha=route_code)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Builders of models with just the vehicles and stops a test needs, next to the payloads of :mod:`tests.test_fixtures`."""
+from sptrans.v0 import ForecastWithStops, Positions
+
+
+def build_positions(vehicles, time='10:00'):
+    """Builds positions from (prefix, latitude[, longitude[, accessible]]) tuples."""
+    return Positions.from_dict({
+        'hr': time,
+        'vs': [{'p': vehicle[0], 'py': vehicle[1], 'px': _item(vehicle, 2, -46.6), 'a': _item(vehicle, 3, False)}
+               for vehicle in vehicles],
+    })
+
+
+def build_forecast(stops, time='10:00', vehicle_latitude=-23.5):
+    """Builds a route-wide forecast from (stop, vehicles) pairs, where the stop is a code or a (code, latitude, longitude)
+    tuple, and the vehicles are (prefix, arrival time) pairs."""
+    stop_dicts = []
+    for stop, vehicles in stops:
+        code, latitude, longitude = (stop, -23.5, -46.6) if isinstance(stop, int) else stop
+        stop_dicts.append({
+            'cp': code,
+            'np': 'STOP {}'.format(code),
+            'py': latitude,
+            'px': longitude,
+            'vs': [{'p': prefix, 't': arriving_at, 'a': False, 'py': vehicle_latitude, 'px': -46.6}
+                   for prefix, arriving_at in vehicles],
+        })
+    return ForecastWithStops.from_dict({'hr': time, 'ps': stop_dicts})
+
+
+def _item(values, index, default):
+    return values[index] if len(values) > index else default
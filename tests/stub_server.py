@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""A local HTTP server mimicking the SPTrans API, for tests that need real connections."""
+from collections import Counter
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from . import test_fixtures
+
+
+COOKIE_NAME = 'apiCredentials'
+TOKEN = 'valid token'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        self.server.count(path)
+        if path == '/Login/Autenticar' and 'token=valid+token' in self.path:
+            with self.server.lock:
+                self.server.sessions += 1
+                session = str(self.server.sessions)
+            self.respond(b'true', {'Set-Cookie': '{}={}; Path=/'.format(COOKIE_NAME, session)})
+        else:
+            self.respond(b'false')
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.count(path)
+        if self.server.delay:
+            self.server.delay.wait()
+        if '{}='.format(COOKIE_NAME) not in self.headers.get('Cookie', ''):
+            self.respond(test_fixtures.MESSAGE_ERROR)
+            return
+        content = self.server.responses.get(path)
+        if content is None:
+            content = 404
+        if isinstance(content, int):
+            self.send_error(content)
+            return
+        self.respond(content)
+
+    def respond(self, content, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, responses=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.responses = {
+            '/Posicao': test_fixtures.VEHICLE_POSITIONS,
+            '/Corredor': test_fixtures.LANES,
+        }
+        self.responses.update(responses or {})
+        self.requests = Counter()
+        self.sessions = 0
+        self.delay = None
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out close their connections before the delayed responses are written.
+        pass
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] += 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
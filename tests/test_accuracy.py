@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime, time, timedelta
+import os
+import time as clock
+from unittest import TestCase, skipUnless
+
+from nose.tools import istest
+
+from .factories import build_forecast, build_positions
+from sptrans.accuracy import ForecastAccuracyTracker
+from sptrans.tracking import to_timestamp
+from sptrans.v0 import ForecastWithStop
+
+
+STOP_A = (100, -23.50, -46.6)
+STOP_B = (200, -23.49, -46.6)
+
+
+def at(hours, minutes):
+    return datetime.combine(date.today(), time(hours, minutes))
+
+
+class ForecastAccuracyTrackerTest(TestCase):
+
+    def setUp(self):
+        self.tracker = ForecastAccuracyTracker(arrival_distance=50, horizons=(5, 10))
+
+    @istest
+    def compares_predictions_with_detected_arrivals(self):
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:12')])]), observed_at=at(10, 0))
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:09')])]), observed_at=at(10, 6))
+
+        arrivals = self.tracker.record_positions(build_positions([('X', -23.5002)]), observed_at=at(10, 10))
+
+        self.assertEqual(arrivals, [('X', 100, to_timestamp(at(10, 10)), 2)])
+        stats = self.tracker.stats()
+        self.assertEqual([(s.horizon, s.count, s.mean_error) for s in stats], [
+            ((0, 5), 1, -60.0), ((5, 10), 1, 120.0), ((10, None), 0, None),
+        ])
+        overall = self.tracker.overall()
+        self.assertEqual((overall.count, overall.mean_error, overall.mean_absolute_error, overall.deviation), (2, 30.0, 90.0, 90.0))
+        self.assertEqual(self.tracker.pending, 0)
+
+    @istest
+    @skipUnless(hasattr(clock, 'tzset'), 'the time zone cannot be changed')
+    def compares_seconds_since_the_epoch_in_the_local_time(self):
+        timezone = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/Sao_Paulo'
+        clock.tzset()
+        try:
+            self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:12')])]),
+                                         observed_at=clock.mktime(at(10, 0).timetuple()))
+
+            arrivals = self.tracker.record_positions(build_positions([('X', -23.5002)]),
+                                                     observed_at=clock.mktime(at(10, 10).timetuple()))
+        finally:
+            if timezone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = timezone
+            clock.tzset()
+
+        self.assertEqual(arrivals[0].arrived_at, to_timestamp(at(10, 10)))
+        self.assertEqual(self.tracker.overall().mean_error, 120)
+
+    @istest
+    def ignores_vehicles_far_from_their_predicted_stops(self):
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')]), (STOP_B, [('Y', '10:05')])]), observed_at=at(10, 0))
+
+        arrivals = self.tracker.record_positions(build_positions([('X', -23.495), ('Y', -23.5), ('Z', -23.49)]), observed_at=at(10, 5))
+
+        self.assertEqual(arrivals, [])
+        self.assertEqual(self.tracker.pending, 2)
+
+    @istest
+    def keeps_the_predictions_for_the_next_stops_after_an_arrival(self):
+        stop_c = (300, -23.5005, -46.6)
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')]), (stop_c, [('X', '10:06')])]), observed_at=at(10, 0))
+
+        arrivals = self.tracker.record_positions(build_positions([('X', -23.5)]), observed_at=at(10, 5))
+
+        self.assertEqual([arrival.stop_code for arrival in arrivals], [100])
+        self.assertEqual(self.tracker.pending, 1)
+
+    @istest
+    def scores_only_the_predictions_made_before_an_arrival(self):
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')])]), observed_at=at(10, 0))
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:07')])]), observed_at=at(10, 6))
+
+        arrivals = self.tracker.record_positions(build_positions([('X', -23.5)]), observed_at=at(10, 5))
+
+        self.assertEqual(arrivals[0].predictions, 2)
+        self.assertEqual(self.tracker.overall().count, 1)
+
+    @istest
+    def keeps_only_distinct_predictions(self):
+        forecast = build_forecast([(STOP_A, [('X', '10:05')])])
+
+        self.assertEqual(self.tracker.record_forecast(forecast, observed_at=at(10, 0)), 1)
+        self.assertEqual(self.tracker.record_forecast(forecast, observed_at=at(10, 1)), 0)
+
+    @istest
+    def ignores_new_predictions_right_after_an_arrival(self):
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')])]), observed_at=at(10, 0))
+        self.tracker.record_positions(build_positions([('X', -23.5)]), observed_at=at(10, 5))
+
+        self.tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:06')])]), observed_at=at(10, 6))
+
+        self.assertEqual(self.tracker.pending, 0)
+
+    @istest
+    def reads_forecasts_by_stop(self):
+        forecast = ForecastWithStop.from_dict({'hr': '10:00', 'p': {'cp': 100, 'np': 'A', 'py': -23.5, 'px': -46.6, 'l': [
+            {'c': '1', 'cl': 1, 'sl': 1, 'lt0': 'A', 'lt1': 'B', 'qv': 1,
+             'vs': [{'p': 'X', 't': '10:05', 'a': False, 'py': -23.6, 'px': -46.6}]},
+        ]}})
+        self.tracker.record_forecast(forecast, observed_at=at(10, 0))
+
+        arrivals = self.tracker.record_positions(build_positions([('X', -23.5)]), observed_at=at(10, 4))
+
+        self.assertEqual([arrival.stop_code for arrival in arrivals], [100])
+        self.assertEqual(self.tracker.overall().mean_error, 60)
+
+    @istest
+    def drops_predictions_of_vehicles_that_never_arrive(self):
+        tracker = ForecastAccuracyTracker(max_delay=600)
+        tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')]), (STOP_B, [('Y', '10:20')])]), observed_at=at(10, 0))
+
+        tracker.record_positions(build_positions([]), observed_at=at(10, 16))
+
+        self.assertEqual((tracker.pending, tracker.expired), (1, 1))
+
+    @istest
+    def looks_for_expired_predictions_once_a_minute(self):
+        tracker = ForecastAccuracyTracker(max_delay=600)
+        tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')])]), observed_at=at(10, 0))
+        tracker.record_positions(build_positions([]), observed_at=at(10, 15))
+
+        tracker.record_positions(build_positions([]), observed_at=at(10, 15) + timedelta(seconds=30))
+        self.assertEqual(tracker.expired, 0)
+        tracker.record_positions(build_positions([]), observed_at=at(10, 16))
+        self.assertEqual(tracker.expired, 1)
+
+    @istest
+    def takes_new_predictions_once_the_cooldown_is_over(self):
+        tracker = ForecastAccuracyTracker(cooldown=300)
+        tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05')])]), observed_at=at(10, 0))
+        tracker.record_positions(build_positions([('X', -23.5)]), observed_at=at(10, 5))
+        tracker.record_positions(build_positions([]), observed_at=at(10, 11))
+
+        self.assertEqual(tracker.record_forecast(build_forecast([(STOP_A, [('X', '11:05')])]), observed_at=at(10, 12)), 1)
+        self.assertEqual(tracker.pending, 1)
+
+    @istest
+    def caps_the_pairs_waiting_for_arrivals(self):
+        tracker = ForecastAccuracyTracker(max_pending=2)
+
+        tracker.record_forecast(build_forecast([(STOP_A, [('X', '10:05'), ('Y', '10:06'), ('Z', '10:07')])]), observed_at=at(10, 0))
+        arrivals = tracker.record_positions(build_positions([('X', -23.5), ('Z', -23.5)]), observed_at=at(10, 5))
+
+        self.assertEqual([arrival.prefix for arrival in arrivals], ['Z'])
+        self.assertEqual((tracker.pending, tracker.expired), (1, 1))
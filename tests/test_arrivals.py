@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime, time
+import json
+from unittest import TestCase
+
+from mock import MagicMock
+from nose.tools import istest
+
+from . import test_fixtures
+from .factories import build_forecast
+from sptrans.arrivals import Arrival, ArrivalIndex
+from sptrans.v0 import ForecastWithStops
+
+
+def at(hour, minute):
+    return datetime.combine(date.today(), time(hour=hour, minute=minute))
+
+
+class ArrivalIndexTest(TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.index = ArrivalIndex(self.client, route_codes=[1, 2])
+
+    @istest
+    def refreshes_all_routes_with_one_call_per_route(self):
+        self.client.get_forecast.return_value = ForecastWithStops.from_dict(
+            json.loads(test_fixtures.FORECAST_FOR_ROUTE.decode('latin1')))
+
+        self.index.refresh()
+
+        self.assertEqual(self.client.get_forecast.call_count, 2)
+        self.client.get_forecast.assert_any_call(route_code=1)
+        self.client.get_forecast.assert_any_call(route_code=2)
+        self.assertEqual(sorted(self.index.stop_codes), [7014417, 700016623])
+        self.assertEqual(self.index.refreshed_at(1), at(23, 18))
+
+    @istest
+    def merges_arrivals_from_different_routes_sorted_by_time(self):
+        self.index.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:20')])]))
+        self.index.update(2, build_forecast([(100, [('C', '10:10')]), (200, [('D', '10:01')])]))
+
+        arrivals = self.index.next_arrivals(100, count=3)
+
+        self.assertEqual([arrival.vehicle.prefix for arrival in arrivals], ['A', 'C', 'B'])
+        self.assertEqual([arrival.route_code for arrival in arrivals], [1, 2, 1])
+        self.assertIsInstance(arrivals[0], Arrival)
+        self.assertEqual(arrivals[0].stop_code, 100)
+        self.assertEqual(arrivals[0].arriving_at, at(10, 5))
+
+    @istest
+    def gets_next_arrivals_after_a_moment(self):
+        self.index.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:20'), ('C', '10:30')])]))
+
+        arrivals = self.index.next_arrivals(100, count=1, after=at(10, 5))
+
+        self.assertEqual([arrival.vehicle.prefix for arrival in arrivals], ['B'])
+
+    @istest
+    def gets_next_arrivals_of_a_single_route(self):
+        self.index.update(1, build_forecast([(100, [('A', '10:05')])]))
+        self.index.update(2, build_forecast([(100, [('C', '10:01')])]))
+
+        arrivals = self.index.next_arrivals(100, count=5, route_code=1)
+
+        self.assertEqual([arrival.vehicle.prefix for arrival in arrivals], ['A'])
+
+    @istest
+    def replaces_only_the_arrivals_of_the_updated_route(self):
+        self.index.update(1, build_forecast([(100, [('A', '10:05')]), (200, [('B', '10:06')])]))
+        self.index.update(2, build_forecast([(100, [('C', '10:10')])]))
+        self.index.next_arrivals(100)
+
+        self.index.update(1, build_forecast([(100, [('A', '10:07')])], '10:01'))
+
+        self.assertEqual([arrival.vehicle.prefix for arrival in self.index.arrivals(100)], ['A', 'C'])
+        self.assertEqual(self.index.arrivals(100)[0].arriving_at, at(10, 7))
+        self.assertEqual(self.index.arrivals(200), [])
+        self.assertEqual(self.index.stop_codes, [100])
+
+    @istest
+    def returns_no_arrivals_for_unknown_stops(self):
+        self.assertEqual(self.index.next_arrivals(999), [])
+        self.assertEqual(self.index.next_arrivals(999, route_code=5), [])
+
+    @istest
+    def refreshes_routes_in_round_robin(self):
+        self.client.get_forecast.return_value = build_forecast([])
+        self.index.add_route(3)
+
+        self.assertEqual(self.index.refresh_next(2), [1, 2])
+        self.assertEqual(self.index.refresh_next(2), [3, 1])
+        self.assertEqual(self.index.refresh_next(5), [2, 3, 1])
+
+    @istest
+    def refreshes_nothing_without_routes(self):
+        index = ArrivalIndex(self.client)
+
+        self.assertEqual(index.refresh_next(), [])
+        self.assertFalse(self.client.get_forecast.called)
+
+    @istest
+    def removes_a_route_with_its_arrivals(self):
+        self.client.get_forecast.return_value = build_forecast([])
+        self.index.update(1, build_forecast([(100, [('A', '10:05')])]))
+        self.index.update(2, build_forecast([(100, [('C', '10:10')])]))
+        self.index.refresh_next(2)
+
+        self.index.remove_route(1)
+        self.index.remove_route(42)
+
+        self.assertEqual(self.index.route_codes, [2])
+        self.assertIsNone(self.index.refreshed_at(1))
+        self.assertEqual(self.index.refresh_next(), [2])
+
+    @istest
+    def keeps_the_refresh_order_when_removing_a_route_not_refreshed_yet(self):
+        self.client.get_forecast.return_value = build_forecast([])
+        self.index.add_route(3)
+        self.index.refresh_next()
+
+        self.index.remove_route(3)
+
+        self.assertEqual(self.index.refresh_next(2), [2, 1])
+
+    @istest
+    def leaves_out_stops_without_vehicles(self):
+        self.index.update(1, build_forecast([(100, [('A', '10:05')]), (200, [])]))
+
+        self.assertEqual(self.index.stop_codes, [100])
+        self.assertEqual(self.index.next_arrivals(200), [])
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from unittest import TestCase
+
+try:
+    from urllib2 import HTTPError, urlopen
+except ImportError:  # pragma: no cover
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+from mock import MagicMock, patch
+from nose.tools import istest
+import requests
+
+from .factories import build_positions
+from sptrans.broadcast import PositionsBroadcaster, positions_delta, serve_sse
+
+
+class PositionsDeltaTest(TestCase):
+
+    @istest
+    def describes_the_first_snapshot_in_full(self):
+        current = build_positions([('A', -23.5, -46.6)], '10:00')
+
+        self.assertEqual(positions_delta(1, None, current), {
+            'route': 1, 'time': '10:00', 'full': True, 'added': [['A', False, -23.5, -46.6]], 'moved': [], 'removed': [],
+        })
+
+    @istest
+    def describes_added_moved_and_removed_vehicles(self):
+        previous = build_positions([('A', -23.5, -46.6), ('B', -23.5, -46.6), ('C', -23.5, -46.6)], '10:00')
+        current = build_positions([('A', -23.5, -46.6), ('B', -23.6, -46.7), ('D', -23.4, -46.5)], '10:01')
+
+        self.assertEqual(positions_delta(1, previous, current), {
+            'route': 1, 'time': '10:01', 'full': False,
+            'added': [['D', False, -23.4, -46.5]], 'moved': [['B', -23.6, -46.7]], 'removed': ['C'],
+        })
+
+    @istest
+    def has_no_delta_if_nothing_changed(self):
+        previous = build_positions([('A', -23.5, -46.6)], '10:00')
+        current = build_positions([('A', -23.5, -46.6)], '10:00')
+
+        self.assertIsNone(positions_delta(1, previous, current))
+
+
+class PositionsBroadcasterTest(TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.broadcaster = PositionsBroadcaster(self.client, max_pending=2)
+
+    @istest
+    def polls_each_route_once_for_all_subscribers(self):
+        self.client.get_positions.return_value = build_positions([('A', -23.5, -46.6)], '10:00')
+        subscriptions = [self.broadcaster.subscribe(1) for _ in range(10)]
+
+        self.broadcaster.poll_all()
+
+        self.client.get_positions.assert_called_once_with(1)
+        messages = [subscription.get(timeout=0) for subscription in subscriptions]
+        self.assertEqual(len(set(messages)), 1)
+        self.assertEqual(json.loads(messages[0].decode('utf-8'))['added'], [['A', False, -23.5, -46.6]])
+
+    @istest
+    def pushes_only_the_changes(self):
+        subscription = self.broadcaster.subscribe(1)
+        self.client.get_positions.return_value = build_positions([('A', -23.5, -46.6), ('B', -23.5, -46.6)], '10:00')
+        self.broadcaster.poll(1)
+        self.client.get_positions.return_value = build_positions([('A', -23.6, -46.6)], '10:01')
+        self.broadcaster.poll(1)
+
+        subscription.get(timeout=0)
+        message = json.loads(subscription.get(timeout=0).decode('utf-8'))
+
+        self.assertEqual((message['full'], message['moved'], message['removed']), (False, [['A', -23.6, -46.6]], ['B']))
+        self.assertIsNone(subscription.get(timeout=0))
+
+    @istest
+    def skips_unchanged_results(self):
+        positions = build_positions([('A', -23.5, -46.6)], '10:00')
+        self.client.get_positions.return_value = positions
+        subscription = self.broadcaster.subscribe(1)
+        self.broadcaster.poll(1)
+        subscription.get(timeout=0)
+
+        self.assertIsNone(self.broadcaster.poll(1))
+        self.assertIsNone(subscription.get(timeout=0))
+
+    @istest
+    def starts_late_subscribers_with_a_full_snapshot(self):
+        self.broadcaster.subscribe(1)
+        self.client.get_positions.return_value = build_positions([('A', -23.5, -46.6)], '10:00')
+        self.broadcaster.poll(1)
+
+        message = json.loads(self.broadcaster.subscribe(1).get(timeout=0).decode('utf-8'))
+
+        self.assertTrue(message['full'])
+        self.assertEqual(message['added'], [['A', False, -23.5, -46.6]])
+
+    @istest
+    def resynchronizes_slow_subscribers_with_a_full_snapshot(self):
+        subscription = self.broadcaster.subscribe(1)
+        for minute in range(4):
+            self.client.get_positions.return_value = build_positions([('A', -23.5 - minute, -46.6)], '10:0{}'.format(minute))
+            self.broadcaster.poll(1)
+
+        first = json.loads(subscription.get(timeout=0).decode('utf-8'))
+        second = json.loads(subscription.get(timeout=0).decode('utf-8'))
+
+        self.assertEqual((first['full'], first['time'], first['added']), (True, '10:02', [['A', False, -25.5, -46.6]]))
+        self.assertEqual((second['full'], second['time']), (False, '10:03'))
+
+    @istest
+    def stops_polling_routes_without_subscribers(self):
+        self.client.get_positions.return_value = build_positions([], '10:00')
+        subscription = self.broadcaster.subscribe(1)
+        self.broadcaster.subscribe(2)
+
+        subscription.close()
+        self.broadcaster.poll_all()
+
+        self.assertEqual(self.broadcaster.route_codes, [2])
+        self.client.get_positions.assert_called_once_with(2)
+        self.assertIsNone(subscription.get(timeout=0))
+
+    @istest
+    def keeps_polling_the_other_routes_when_one_fails(self):
+        positions = build_positions([('A', -23.5, -46.6)], '10:00')
+
+        def get_positions(route_code):
+            if route_code == 1:
+                raise requests.ReadTimeout()
+            return positions
+
+        self.client.get_positions.side_effect = get_positions
+        subscriptions = [self.broadcaster.subscribe(route_code) for route_code in (1, 2, 3)]
+
+        with patch('sptrans.broadcast.logger') as logger:
+            messages = self.broadcaster.poll_all()
+
+        self.assertEqual(sorted(message['route'] for message in messages), [2, 3])
+        self.assertIsNone(subscriptions[0].get(timeout=0))
+        self.assertIsNotNone(subscriptions[2].get(timeout=0))
+        self.assertEqual(logger.exception.call_count, 1)
+
+    @istest
+    def keeps_the_latest_positions_of_subscribed_routes_only(self):
+        positions = build_positions([('A', -23.5, -46.6)], '10:00')
+        self.client.get_positions.return_value = positions
+        self.broadcaster.subscribe(1)
+
+        self.assertIsNotNone(self.broadcaster.poll(2))
+        self.broadcaster.poll_all()
+        self.assertEqual(self.broadcaster.poll_all(), [])
+
+        self.assertIs(self.broadcaster.latest(1), positions)
+        self.assertIsNone(self.broadcaster.latest(2))
+
+    @istest
+    def closes_subscriptions_only_once(self):
+        first = self.broadcaster.subscribe(1)
+        second = self.broadcaster.subscribe(1)
+
+        first.close()
+        first.close()
+
+        self.assertEqual(self.broadcaster.route_codes, [1])
+        second.close()
+        self.assertEqual(self.broadcaster.route_codes, [])
+
+    @istest
+    def polls_in_the_background_until_stopped(self):
+        polled = threading.Event()
+        calls = []
+
+        def poll_all():
+            calls.append(None)
+            if len(calls) == 1:
+                raise ValueError('unexpected')
+            polled.set()
+            return []
+
+        broadcaster = PositionsBroadcaster(self.client, interval=0.01)
+        broadcaster.poll_all = poll_all
+
+        with patch('sptrans.broadcast.logger') as logger:
+            broadcaster.start()
+            self.assertTrue(polled.wait(5))
+            broadcaster.stop()
+            broadcaster.stop()
+
+        self.assertEqual(logger.exception.call_count, 1)
+        self.assertIsNone(broadcaster._thread)
+
+
+class SSEServerTest(TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.get_positions.return_value = build_positions([('A', -23.5, -46.6)], '10:00')
+        self.broadcaster = PositionsBroadcaster(self.client)
+        self.server = serve_sse(self.broadcaster, '127.0.0.1', 0, keepalive=0.05)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @istest
+    def streams_messages_as_server_sent_events(self):
+        self.broadcaster.subscribe(1234)
+        self.broadcaster.poll(1234)
+
+        response = urlopen('http://127.0.0.1:{}/positions/1234'.format(self.server.server_port), timeout=5)
+        try:
+            self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+            event = response.readline()
+            self.assertEqual(response.readline(), b'\n')
+        finally:
+            response.close()
+
+        self.assertTrue(event.startswith(b'data: '))
+        self.assertEqual(json.loads(event[len(b'data: '):].decode('utf-8'))['route'], 1234)
+
+    @istest
+    def sends_keepalives_and_forgets_disconnected_subscribers(self):
+        response = urlopen('http://127.0.0.1:{}/positions/5678'.format(self.server.server_port), timeout=5)
+        try:
+            self.assertEqual(response.readline(), b': keepalive\n')
+        finally:
+            response.close()
+
+        for _ in range(100):
+            if 5678 not in self.broadcaster.route_codes:
+                break
+            threading.Event().wait(0.05)
+        self.assertNotIn(5678, self.broadcaster.route_codes)
+
+    @istest
+    def ends_the_stream_when_the_subscription_is_closed(self):
+        response = urlopen('http://127.0.0.1:{}/positions/5678'.format(self.server.server_port), timeout=5)
+        try:
+            self.assertEqual(response.readline(), b': keepalive\n')
+            subscription, = self.broadcaster._subscriptions[5678]
+            subscription.close()
+            self.assertEqual(response.read().replace(b': keepalive', b'').strip(), b'')
+        finally:
+            response.close()
+
+    @istest
+    def answers_unknown_paths_with_not_found(self):
+        with self.assertRaises(HTTPError) as context:
+            urlopen('http://127.0.0.1:{}/vehicles'.format(self.server.server_port), timeout=5)
+
+        self.assertEqual(context.exception.code, 404)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+from mock import patch
+from nose.tools import istest
+import requests
+
+from . import stub_server, test_fixtures
+from .stub_server import StubServer
+from sptrans.cli import NDJSONWriter, ParquetWriter, RateLimiter, main
+from sptrans.v0 import Client
+
+try:
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+class CommandLineTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer({
+            '/Parada/BuscarParadasPorCorredor': test_fixtures.STOP_SEARCH,
+            '/Parada/BuscarParadasPorLinha': test_fixtures.STOP_SEARCH,
+            '/Parada/Buscar': test_fixtures.STOP_SEARCH,
+            '/Linha/Buscar': test_fixtures.ROUTE_SEARCH,
+            '/Previsao/Parada': test_fixtures.FORECAST_FOR_STOP,
+            '/Previsao/Linha': test_fixtures.FORECAST_FOR_ROUTE,
+        }).start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def run_command(self, *args):
+        output = os.path.join(self.directory, 'output')
+        status = main(['--token', stub_server.TOKEN, '--base-url', self.server.base_url, '--output', output] + list(args))
+        self.assertEqual(status, 0)
+        with io.open(output, encoding='utf-8', newline='') as output_file:
+            return output_file.read()
+
+    @istest
+    def downloads_the_catalogue_as_ndjson(self):
+        output = self.run_command('catalogue', 'lanes')
+
+        self.assertEqual([json.loads(line) for line in output.splitlines()], [{'code': 8, 'cot': 0, 'name': 'Campo Limpo'}])
+
+    @istest
+    def downloads_the_stops_of_all_lanes_as_csv(self):
+        output = self.run_command('--format', 'csv', '--concurrency', '2', 'catalogue', 'lane-stops')
+
+        rows = list(csv.DictReader(io.StringIO(output)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual((rows[0]['lane_code'], rows[0]['code']), ('8', '340015329'))
+
+    @istest
+    def searches_routes_and_stops_of_the_catalogue(self):
+        routes = [json.loads(line) for line in self.run_command('catalogue', 'routes', 'lapa').splitlines()]
+        stops = [json.loads(line) for line in self.run_command('catalogue', 'stops', 'paulista').splitlines()]
+        route_stops = [json.loads(line) for line in self.run_command('catalogue', 'route-stops', '1273').splitlines()]
+
+        self.assertEqual((routes[0]['terms'], routes[0]['code']), ('lapa', 1273))
+        self.assertEqual((stops[0]['terms'], stops[0]['code']), ('paulista', 340015329))
+        self.assertEqual((route_stops[0]['route_code'], route_stops[0]['code']), (1273, 340015329))
+
+    @istest
+    def writes_to_the_standard_output(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            status = main(['--token', stub_server.TOKEN, '--base-url', self.server.base_url, 'catalogue', 'lanes'])
+
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(stdout.getvalue())['name'], 'Campo Limpo')
+
+    @istest
+    def stops_recording_when_interrupted(self):
+        with patch('sptrans.cli.time.sleep', side_effect=KeyboardInterrupt):
+            output = self.run_command('positions', '1', '--interval', '30')
+
+        self.assertEqual(len(output.splitlines()), 2)
+
+    @istest
+    def records_position_sweeps(self):
+        output = self.run_command('--rate', '100', 'positions', '1', '2', '--interval', '0', '--count', '2')
+
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([(row['route_code'], row['vehicles.prefix']) for row in rows], [
+            (1, '11433'), (1, '12132'), (2, '11433'), (2, '12132'),
+        ] * 2)
+        self.assertEqual(self.server.requests['/Posicao'], 4)
+        self.assertIn('observed_at', rows[0])
+
+    @istest
+    def sweeps_forecasts_of_stops_and_routes(self):
+        output = self.run_command('forecasts', '--stops', '4200953', '--routes', '1234')
+
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([row['stop.code'] for row in rows[:3]], [4200953] * 3)
+        self.assertEqual([(row['route_code'], row['stops.code']) for row in rows[3:]], [(1234, 700016623), (1234, 7014417)])
+
+    @istest
+    def skips_failed_requests(self):
+        self.server.responses['/Previsao/Parada'] = test_fixtures.MESSAGE_ERROR
+
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            output = self.run_command('forecasts', '--stops', '4200953', '--routes', '1234')
+
+        self.assertEqual(len(output.splitlines()), 2)
+        self.assertIn('4200953', stderr.getvalue())
+
+    @istest
+    def skips_requests_that_time_out(self):
+        get_positions = Client.get_positions
+
+        def flaky_get_positions(client, route_code):
+            if route_code == 1:
+                raise requests.ReadTimeout('read timed out')
+            return get_positions(client, route_code)
+
+        with patch.object(Client, 'get_positions', flaky_get_positions), \
+                patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            output = self.run_command('positions', '1', '2', '--interval', '0', '--count', '2')
+
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([row['route_code'] for row in rows], [2, 2, 2, 2])
+        self.assertEqual(stderr.getvalue().count('read timed out'), 2)
+
+    @istest
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def writes_parquet_files(self):
+        output = os.path.join(self.directory, 'positions.parquet')
+
+        main(['--token', stub_server.TOKEN, '--base-url', self.server.base_url, '--format', 'parquet', '--output', output,
+              'positions', '1', '--interval', '0', '--count', '3'])
+
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column('vehicles.prefix').to_pylist()[:2], ['11433', '12132'])
+
+    @istest
+    def refuses_csv_sweeps_of_stops_and_routes_together(self):
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertRaises(SystemExit, self.run_command, '--format', 'csv', 'forecasts', '--stops', '4200953',
+                              '--routes', '1234')
+
+        self.assertIn('sweep them separately for csv output', stderr.getvalue())
+        self.assertEqual(self.server.requests['/Previsao/Parada'], 0)
+
+    @istest
+    def refuses_parquet_sweeps_of_stops_and_routes_together(self):
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertRaises(SystemExit, self.run_command, '--format', 'parquet', 'forecasts', '--stops', '4200953',
+                              '--routes', '1234')
+
+        self.assertIn('sweep them separately for parquet output', stderr.getvalue())
+
+    @istest
+    def writes_csv_sweeps_of_route_forecasts(self):
+        output = self.run_command('--format', 'csv', 'forecasts', '--routes', '1234', '5678')
+
+        rows = list(csv.DictReader(io.StringIO(output)))
+        self.assertEqual([(row['route_code'], row['stops.code']) for row in rows], [
+            ('1234', '700016623'), ('1234', '7014417'), ('5678', '700016623'), ('5678', '7014417'),
+        ])
+
+    @istest
+    def fails_with_invalid_tokens(self):
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            status = main(['--token', 'wrong token', '--base-url', self.server.base_url, 'catalogue', 'lanes'])
+
+        self.assertEqual(status, 1)
+        self.assertIn('wrong token', stderr.getvalue())
+
+    @istest
+    def requires_a_token(self):
+        with patch.dict(os.environ, clear=True), patch('sys.stderr', new_callable=io.StringIO):
+            self.assertRaises(SystemExit, main, ['catalogue', 'lanes'])
+
+    @istest
+    def requires_complete_arguments(self):
+        for args in (
+                [],
+                ['--format', 'parquet', 'catalogue', 'lanes'],
+                ['catalogue', 'routes'],
+                ['forecasts']):
+            with patch('sys.stderr', new_callable=io.StringIO):
+                self.assertRaises(SystemExit, main, ['--token', stub_server.TOKEN] + args)
+
+
+class WriterTest(TestCase):
+
+    @istest
+    def refuses_values_without_a_json_form(self):
+        writer = NDJSONWriter(io.StringIO())
+
+        self.assertRaises(TypeError, writer.write, [{'value': object()}])
+
+    @istest
+    def needs_pyarrow_for_parquet(self):
+        with patch('sptrans.cli.import_module', side_effect=ImportError):
+            with self.assertRaises(ImportError) as context:
+                ParquetWriter('output.parquet')
+
+        self.assertIn('pyarrow', str(context.exception))
+
+    @istest
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def writes_no_parquet_file_without_rows(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'output.parquet')
+            writer = ParquetWriter(path)
+            writer.write([])
+            writer.close()
+
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+
+class RateLimiterTest(TestCase):
+
+    @istest
+    @patch('sptrans.cli.time')
+    def spaces_calls_out(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(rate=4)
+
+        for _ in range(3):
+            limiter.wait()
+
+        self.assertEqual([call[0][0] for call in mock_time.sleep.call_args_list], [0.25, 0.5])
+
+    @istest
+    @patch('sptrans.cli.time')
+    def does_not_limit_without_a_rate(self, mock_time):
+        RateLimiter().wait()
+
+        self.assertFalse(mock_time.time.called)
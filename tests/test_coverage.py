@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import istest
+
+from .factories import build_positions
+from sptrans.coverage import CoverageEngine, HyperLogLog
+
+
+class HyperLogLogTest(TestCase):
+
+    @istest
+    def estimates_distinct_values(self):
+        sketch = HyperLogLog(precision=12)
+
+        for repetition in range(2):
+            for value in range(20000):
+                sketch.add('vehicle {}'.format(value))
+
+        self.assertAlmostEqual(sketch.count(), 20000, delta=20000 * 0.05)
+        self.assertEqual(len(sketch.registers), 4096)
+
+    @istest
+    def counts_few_values_precisely(self):
+        sketch = HyperLogLog()
+
+        for value in ['11433', '12132', '11433', '98765']:
+            sketch.add(value)
+
+        self.assertEqual(sketch.count(), 3)
+        self.assertEqual(HyperLogLog().count(), 0)
+
+    @istest
+    def merges_sketches(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for value in range(1000):
+            first.add(str(value))
+            second.add(str(value + 500))
+
+        first.merge(second)
+
+        self.assertAlmostEqual(first.count(), 1500, delta=1500 * 0.1)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(precision=11))
+
+    @istest
+    def refuses_precisions_out_of_range(self):
+        self.assertRaises(ValueError, HyperLogLog, precision=3)
+        self.assertRaises(ValueError, HyperLogLog, precision=17)
+
+
+class CoverageEngineTest(TestCase):
+
+    def setUp(self):
+        self.engine = CoverageEngine(cell_size=500)
+        for _ in range(3):
+            self.engine.record(1, build_positions([('A', -23.500, -46.600, True), ('B', -23.501, -46.601, False)]))
+            self.engine.record(2, build_positions([('A', -23.600, -46.700, True), ('C', -23.600, -46.700, True)]))
+
+    @istest
+    def keeps_statistics_per_route(self):
+        stats = self.engine.route(1)
+
+        self.assertEqual(stats, (1, 6, 3, 0.5, 2, 1))
+        self.assertEqual(sorted(self.engine.routes()), [1, 2])
+        self.assertEqual(self.engine.routes()[2].ratio, 1.0)
+        self.assertIsNone(self.engine.route(3))
+
+    @istest
+    def keeps_statistics_per_grid_cell(self):
+        stats = self.engine.cell(-23.5005, -46.6005)
+
+        self.assertEqual(stats[1:], (6, 3, 0.5, 2, 1))
+        self.assertAlmostEqual(stats.key[0], -23.5005, delta=0.005)
+        self.assertEqual(len(self.engine.cells()), 2)
+        self.assertIsNone(self.engine.cell(-23.7, -46.8))
+
+    @istest
+    def merges_the_cells_of_regions(self):
+        region = self.engine.region([(-23.4, -46.5), (-23.4, -46.8), (-23.7, -46.8), (-23.7, -46.5)])
+        empty = self.engine.region([(-23.0, -46.0), (-23.0, -46.1), (-23.1, -46.1)])
+
+        self.assertEqual(region, (None, 12, 9, 0.75, 3, 2))
+        self.assertEqual(empty, (None, 0, 0, None, 0, 0))
+
+    @istest
+    def takes_single_cell_regions_as_they_are(self):
+        region = self.engine.region([(-23.49, -46.59), (-23.49, -46.61), (-23.51, -46.61), (-23.51, -46.59)])
+
+        self.assertEqual(region[1:], self.engine.cell(-23.5005, -46.6005)[1:])
+
+    @istest
+    def forgets_the_hashes_of_the_vehicles_past_a_limit(self):
+        with patch('sptrans.coverage.MAX_HASHES', 2):
+            self.engine.record(3, build_positions([('D', -23.5), ('E', -23.5)]))
+
+        self.assertEqual(sorted(self.engine._locations), ['D', 'E'])
+        self.assertEqual(self.engine.route(3).vehicles, 2)
+
+    @istest
+    def keeps_statistics_of_the_whole_fleet(self):
+        self.assertEqual(self.engine.overall(), (None, 12, 9, 0.75, 3, 2))
+
+    @istest
+    def uses_constant_memory_per_route_and_cell(self):
+        registers = [len(sketch.registers) for sketch in (self.engine._routes[1].vehicles, self.engine._overall.vehicles)]
+
+        for _ in range(100):
+            self.engine.record(1, build_positions([('A', -23.500, -46.600, True)]))
+
+        self.assertEqual(self.engine.route(1).observations, 106)
+        self.assertEqual(len(self.engine.cells()), 2)
+        self.assertEqual(registers, [1024, 1024])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from nose.tools import istest
+
+from .factories import build_forecast
+from sptrans.diffing import ADDED, CHANGED, REMOVED, ForecastDiffer, diff_forecasts
+
+
+def summarize(change):
+    return (change.stop_code, change.kind, [vehicle.prefix for vehicle in change.added], change.removed,
+            [(vehicle.prefix, previous.strftime('%H:%M')) for vehicle, previous in change.updated])
+
+
+class DiffForecastsTest(TestCase):
+
+    @istest
+    def finds_added_removed_and_updated_vehicles(self):
+        previous = build_forecast([(100, [('A', '10:05'), ('B', '10:10')]), (200, [('A', '10:08')])])
+        current = build_forecast([(100, [('B', '10:12'), ('C', '10:20')]), (200, [('A', '10:08')])])
+
+        changes = diff_forecasts(1, previous, current)
+
+        self.assertEqual([summarize(change) for change in changes], [(100, CHANGED, ['C'], ['A'], [('B', '10:10')])])
+        self.assertEqual(changes[0].route_code, 1)
+        self.assertIs(changes[0].stop, current.stops[0])
+
+    @istest
+    def finds_added_and_removed_stops(self):
+        previous = build_forecast([(100, [('A', '10:05')])])
+        current = build_forecast([(200, [('A', '10:08')])])
+
+        changes = diff_forecasts(1, previous, current)
+
+        self.assertEqual([summarize(change) for change in changes], [(200, ADDED, ['A'], [], []), (100, REMOVED, [], ['A'], [])])
+        self.assertIsNone(changes[1].stop)
+
+    @istest
+    def considers_all_stops_added_without_a_previous_forecast(self):
+        changes = diff_forecasts(1, None, build_forecast([(100, []), (200, [('A', '10:08')])]))
+
+        self.assertEqual([(change.stop_code, change.kind) for change in changes], [(100, ADDED), (200, ADDED)])
+
+    @istest
+    def ignores_moving_and_reordered_vehicles(self):
+        previous = build_forecast([(100, [('A', '10:05'), ('B', '10:10')])])
+        current = build_forecast([(100, [('B', '10:10'), ('A', '10:05')])], vehicle_latitude=-23.6)
+
+        self.assertEqual(diff_forecasts(1, previous, current), [])
+
+
+class ForecastDifferTest(TestCase):
+
+    def setUp(self):
+        self.differ = ForecastDiffer()
+
+    @istest
+    def compares_with_the_previous_update_of_the_route(self):
+        self.differ.update(1, build_forecast([(100, [('A', '10:05')]), (200, [])]))
+        self.differ.update(2, build_forecast([(300, [('B', '10:05')])]))
+
+        changes = self.differ.update(1, build_forecast([(100, [('A', '10:06')]), (200, [])]))
+
+        self.assertEqual([summarize(change) for change in changes], [(100, CHANGED, [], [], [('A', '10:05')])])
+        self.assertEqual(self.differ.update(1, build_forecast([(100, [('A', '10:06')]), (200, [])])), [])
+
+    @istest
+    def forgets_routes(self):
+        self.differ.update(1, build_forecast([(100, [('A', '10:05')])]))
+        self.differ.update(2, build_forecast([(300, [('B', '10:05')]), (400, [])]))
+
+        self.differ.forget(1)
+
+        self.assertEqual(self.differ.route_codes(), [2])
+        self.assertEqual(sorted(self.differ.stop_codes(2)), [300, 400])
+        self.assertEqual(self.differ.stop_codes(1), [])
+        self.assertEqual([change.kind for change in self.differ.update(1, build_forecast([(100, [('A', '10:05')])]))], [ADDED])
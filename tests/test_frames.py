@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from datetime import date, datetime, time
+import json
+from unittest import TestCase, skipUnless
+
+from mock import patch
+from nose.tools import istest
+
+from . import test_fixtures
+from sptrans.frames import to_arrow, to_columns, to_pandas
+from sptrans.v0 import ForecastWithStop, ForecastWithStops, Lane, Positions, Stop, TupleField, TupleListField, build_tuple_class
+
+try:
+    import pandas
+except ImportError:  # pragma: no cover
+    pandas = None
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+def load(fixture):
+    return json.loads(fixture.decode('latin1'))
+
+
+class ToColumnsTest(TestCase):
+
+    @istest
+    def flattens_lists_of_flat_results(self):
+        columns = to_columns(Stop, load(test_fixtures.STOP_SEARCH))
+
+        self.assertEqual(list(columns), ['code', 'name', 'address', 'latitude', 'longitude'])
+        self.assertEqual(columns['code'], [340015329, 340015328, 340015333, 340015331])
+
+    @istest
+    def flattens_nested_results_into_one_row_per_innermost_item(self):
+        columns = to_columns(ForecastWithStop, load(test_fixtures.FORECAST_FOR_STOP))
+        today = date.today()
+
+        self.assertEqual(list(columns), [
+            'time', 'stop.code', 'stop.name', 'stop.latitude', 'stop.longitude',
+            'stop.routes.sign', 'stop.routes.code', 'stop.routes.direction', 'stop.routes.main_to_sec',
+            'stop.routes.sec_to_main', 'stop.routes.quantity',
+            'stop.routes.vehicles.prefix', 'stop.routes.vehicles.accessible', 'stop.routes.vehicles.arriving_at',
+            'stop.routes.vehicles.latitude', 'stop.routes.vehicles.longitude',
+        ])
+        self.assertEqual(columns['time'], [datetime.combine(today, time(23, 20))] * 3)
+        self.assertEqual(columns['stop.code'], [4200953] * 3)
+        self.assertEqual(columns['stop.routes.sign'], ['675K-10', '675K-10', '737A-10'])
+        self.assertEqual(columns['stop.routes.vehicles.prefix'], ['73651', '73816', '72089'])
+
+    @istest
+    def flattens_models_like_raw_results(self):
+        for fixture, tuple_class in [
+                (test_fixtures.FORECAST_FOR_STOP, ForecastWithStop),
+                (test_fixtures.FORECAST_FOR_ROUTE, ForecastWithStops),
+                (test_fixtures.VEHICLE_POSITIONS, Positions)]:
+            result = load(fixture)
+
+            self.assertEqual(to_columns(tuple_class, tuple_class.from_dict(result)), to_columns(tuple_class, result))
+
+    @istest
+    def flattens_many_nested_results(self):
+        positions = load(test_fixtures.VEHICLE_POSITIONS)
+
+        columns = to_columns(Positions, [positions, positions])
+
+        self.assertEqual(columns['vehicles.prefix'], ['11433', '12132'] * 2)
+        self.assertEqual(len(columns['time']), 4)
+
+    @istest
+    def leaves_out_parents_without_children(self):
+        positions = load(test_fixtures.VEHICLE_POSITIONS)
+        empty = dict(positions, vs=[])
+
+        columns = to_columns(Positions, [empty, positions])
+
+        self.assertEqual(columns['vehicles.prefix'], ['11433', '12132'])
+
+    @istest
+    def flattens_nothing_into_empty_columns(self):
+        self.assertEqual(to_columns(Lane, []), {'code': [], 'cot': [], 'name': []})
+
+    @istest
+    def flattens_nested_results_without_lists_into_one_row_per_item(self):
+        Pair = build_tuple_class('Pair', {
+            'origin': TupleField('o', Stop),
+            'destination': TupleField('d', Stop),
+        })
+        first, second = load(test_fixtures.STOP_SEARCH)[:2]
+
+        columns = to_columns(Pair, [{'o': first, 'd': second}, {'o': second, 'd': first}])
+
+        self.assertEqual(columns['origin.code'], [first['CodigoParada'], second['CodigoParada']])
+        self.assertEqual(columns['destination.code'], [second['CodigoParada'], first['CodigoParada']])
+
+    @istest
+    def cannot_flatten_more_than_one_list_of_children(self):
+        Twins = build_tuple_class('Twins', {
+            'first': TupleListField('a', Lane),
+            'second': TupleListField('b', Lane),
+        })
+        lane = load(test_fixtures.LANES)[0]
+
+        self.assertRaises(ValueError, to_columns, Twins, {'a': [lane, lane], 'b': [lane]})
+
+
+class ToDataFrameTest(TestCase):
+
+    @istest
+    @skipUnless(pandas, 'pandas is not installed')
+    def exports_to_pandas(self):
+        frame = to_pandas(ForecastWithStops, load(test_fixtures.FORECAST_FOR_ROUTE))
+
+        self.assertEqual(frame.shape, (2, 10))
+        self.assertEqual(list(frame['stops.code']), [700016623, 7014417])
+
+    @istest
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def exports_to_arrow(self):
+        table = to_arrow(Positions, load(test_fixtures.VEHICLE_POSITIONS))
+
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('vehicles.prefix').to_pylist(), ['11433', '12132'])
+
+    @istest
+    def explains_missing_optional_dependencies(self):
+        with patch('sptrans.frames.import_module', side_effect=ImportError):
+            self.assertRaisesRegexp(ImportError, 'pyarrow', to_arrow, Lane, [])
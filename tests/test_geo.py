@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+from math import pi
+import random
+from unittest import TestCase
+
+from nose.tools import istest
+
+from sptrans.geo import (
+    EARTH_RADIUS,
+    SAO_PAULO_LATITUDE,
+    Grid,
+    Projection,
+    bearing,
+    bearings,
+    coordinates,
+    distance,
+    distance_matrix,
+    distances,
+    nearest,
+    within,
+)
+from sptrans.v0 import Stop, Vehicle
+
+
+class DistanceTest(TestCase):
+
+    @istest
+    def is_zero_for_the_same_point(self):
+        self.assertEqual(distance(-23.5, -46.6, -23.5, -46.6), 0)
+
+    @istest
+    def calculates_the_great_circle_distance(self):
+        self.assertAlmostEqual(distance(-23.0, -46.6, -24.0, -46.6), pi * EARTH_RADIUS / 180)
+        self.assertAlmostEqual(distance(-23.5503, -46.6339, -23.5614, -46.6559), 2560, delta=1)
+
+    @istest
+    def is_symmetric(self):
+        self.assertAlmostEqual(distance(-23.5, -46.6, -23.6, -46.7), distance(-23.6, -46.7, -23.5, -46.6))
+
+
+class BearingTest(TestCase):
+
+    @istest
+    def points_to_the_cardinal_directions(self):
+        self.assertAlmostEqual(bearing(-23.5, -46.6, -23.4, -46.6), 0)
+        self.assertAlmostEqual(bearing(-23.5, -46.6, -23.5, -46.5), 90, places=1)
+        self.assertAlmostEqual(bearing(-23.5, -46.6, -23.6, -46.6), 180)
+        self.assertAlmostEqual(bearing(-23.5, -46.6, -23.5, -46.7), 270, places=1)
+
+
+class CoordinatesTest(TestCase):
+
+    @istest
+    def reads_models(self):
+        stops = [Stop(1, 'A', 'Rua A', -23.5, -46.6), Stop(2, 'B', 'Rua B', -23.6, -46.7)]
+
+        self.assertEqual(coordinates(stops), ([-23.5, -23.6], [-46.6, -46.7]))
+
+    @istest
+    def reads_pairs(self):
+        self.assertEqual(coordinates([(-23.5, -46.6), (-23.6, -46.7)]), ([-23.5, -23.6], [-46.6, -46.7]))
+
+    @istest
+    def reads_columns(self):
+        columns = {'vehicles.prefix': ['1', '2'], 'vehicles.latitude': [-23.5, -23.6], 'vehicles.longitude': [-46.6, -46.7]}
+
+        self.assertEqual(coordinates(columns), ([-23.5, -23.6], [-46.6, -46.7]))
+        self.assertRaises(KeyError, coordinates, {'latitude': [-23.5]})
+
+
+class ManyPointsTest(TestCase):
+
+    @istest
+    def calculates_distances_and_bearings_between_pairs(self):
+        origins = [Vehicle('1', False, -23.5, -46.6), Vehicle('2', False, -23.5, -46.6)]
+        destinations = [(-23.4, -46.6), (-23.5, -46.5)]
+
+        self.assertEqual(distances(origins, destinations), [distance(-23.5, -46.6, -23.4, -46.6), distance(-23.5, -46.6, -23.5, -46.5)])
+        self.assertEqual(bearings(origins, destinations), [bearing(-23.5, -46.6, -23.4, -46.6), bearing(-23.5, -46.6, -23.5, -46.5)])
+
+    @istest
+    def calculates_distance_matrices(self):
+        origins = [(-23.5, -46.6), (-23.5503, -46.6339)]
+        destinations = [(-23.5, -46.6), (-23.5614, -46.6559), (-24.0, -46.6)]
+
+        matrix = distance_matrix(origins, destinations)
+
+        self.assertEqual(len(matrix), 2)
+        for row, origin in zip(matrix, origins):
+            for value, destination in zip(row, destinations):
+                self.assertAlmostEqual(value, distance(origin[0], origin[1], destination[0], destination[1]), delta=0.01)
+
+
+class NearestTest(TestCase):
+
+    @istest
+    def finds_the_nearest_candidates(self):
+        candidates = [(-23.50, -46.60), (-23.51, -46.60), (-23.60, -46.70)]
+        points = [(-23.502, -46.60), (-23.508, -46.601), (-23.70, -46.80), (-23.60, -46.70)]
+
+        matches = nearest(points, candidates)
+
+        self.assertEqual([index for index, _ in matches], [0, 1, 2, 2])
+        self.assertAlmostEqual(matches[0][1], distance(-23.502, -46.60, -23.50, -46.60))
+        self.assertEqual(matches[3][1], 0)
+
+    @istest
+    def limits_the_distance(self):
+        candidates = [(-23.50, -46.60), (-23.51, -46.60)]
+
+        matches = nearest([(-23.5005, -46.60), (-23.505, -46.60)], candidates, max_distance=100)
+
+        self.assertEqual(matches[0][0], 0)
+        self.assertIsNone(matches[1])
+
+    @istest
+    def matches_the_brute_force_search(self):
+        generator = random.Random(42)
+        candidates = [(generator.uniform(-23.7, -23.4), generator.uniform(-46.8, -46.4)) for _ in range(300)]
+        points = [(generator.uniform(-23.8, -23.3), generator.uniform(-46.9, -46.3)) for _ in range(300)]
+
+        matches = nearest(points, candidates)
+
+        for match, row in zip(matches, distance_matrix(points, candidates)):
+            self.assertAlmostEqual(match[1], min(row), delta=1)
+
+    @istest
+    def matches_the_brute_force_search_for_points_far_from_the_candidates(self):
+        generator = random.Random(42)
+        candidates = [(generator.uniform(-23.7, -23.4), generator.uniform(-46.8, -46.4)) for _ in range(300)]
+        points = [(0.0, 0.0), (-25.0, -47.0), (-23.9, -46.9)]
+
+        matches = nearest(points, candidates)
+
+        for match, row in zip(matches, distance_matrix(points, candidates)):
+            self.assertAlmostEqual(match[1], min(row), delta=1)
+        self.assertEqual(nearest(points, candidates, max_distance=50000)[:2], [None, None])
+
+    @istest
+    def matches_the_brute_force_search_within_the_distance(self):
+        generator = random.Random(42)
+        candidates = [(generator.uniform(-23.7, -23.4), generator.uniform(-46.8, -46.4)) for _ in range(300)]
+        points = [(generator.uniform(-23.7, -23.4), generator.uniform(-46.8, -46.4)) for _ in range(300)]
+
+        matches = nearest(points, candidates, max_distance=1000)
+
+        for match, row in zip(matches, distance_matrix(points, candidates)):
+            if min(row) > 1001:
+                self.assertIsNone(match)
+            elif min(row) < 999:
+                self.assertAlmostEqual(match[1], min(row), delta=1)
+
+    @istest
+    def rejects_distances_that_are_not_positive(self):
+        self.assertRaises(ValueError, nearest, [(-23.5, -46.6)], [(-23.5, -46.6)], max_distance=0)
+
+    @istest
+    def handles_no_candidates(self):
+        self.assertEqual(nearest([(-23.5, -46.6)], []), [None])
+
+
+class WithinTest(TestCase):
+
+    @istest
+    def tells_which_points_are_inside_a_polygon(self):
+        # An L-shaped polygon, with its top right quarter missing.
+        polygon = [(-23.50, -46.60), (-23.52, -46.60), (-23.52, -46.56), (-23.54, -46.56), (-23.54, -46.64), (-23.50, -46.64)]
+        points = [(-23.51, -46.62), (-23.53, -46.58), (-23.51, -46.58), (-23.55, -46.62), (-23.51, -46.70)]
+
+        self.assertEqual(within(points, polygon), [True, True, False, False, False])
+
+    @istest
+    def accepts_closed_polygons(self):
+        polygon = [(-23.50, -46.60), (-23.50, -46.62), (-23.52, -46.62), (-23.52, -46.60), (-23.50, -46.60)]
+
+        self.assertEqual(within([(-23.51, -46.61), (-23.53, -46.61)], polygon), [True, False])
+
+
+class ProjectionTest(TestCase):
+
+    @istest
+    def keeps_short_distances(self):
+        projection = Projection()
+        x1, y1 = projection.project(-23.55, -46.63)
+        x2, y2 = projection.project(-23.56, -46.62)
+
+        self.assertAlmostEqual(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5, distance(-23.55, -46.63, -23.56, -46.62), delta=1)
+
+    @istest
+    def finds_the_projected_points(self):
+        latitude, longitude = Projection(-23.6).unproject(*Projection(-23.6).project(-23.55, -46.63))
+
+        self.assertAlmostEqual(latitude, -23.55)
+        self.assertAlmostEqual(longitude, -46.63)
+
+    @istest
+    def centers_around_the_mean_latitude(self):
+        self.assertAlmostEqual(Projection.around([-23.5, -23.7]).latitude, -23.6)
+        self.assertEqual(Projection.around([]).latitude, SAO_PAULO_LATITUDE)
+
+
+class GridTest(TestCase):
+
+    @istest
+    def finds_the_cells_of_points(self):
+        grid = Grid(500)
+
+        self.assertEqual(grid.cell(-23.55, -46.63), grid.cell(-23.5501, -46.6301))
+        self.assertNotEqual(grid.cell(-23.55, -46.63), grid.cell(-23.56, -46.63))
+        self.assertEqual(grid.key(-1, 499), (-1, 0))
+
+    @istest
+    def finds_the_centers_of_cells(self):
+        grid = Grid(500)
+        center = grid.center(grid.cell(-23.55, -46.63))
+
+        self.assertEqual(grid.cell(*center), grid.cell(-23.55, -46.63))
+        self.assertLess(distance(-23.55, -46.63, center[0], center[1]), 500 / 2 ** 0.5)
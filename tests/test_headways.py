@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from nose.tools import istest
+
+from .factories import build_forecast
+from sptrans.headways import BUNCHING, GAP, HeadwayMonitor, stop_headways
+
+
+class StopHeadwaysTest(TestCase):
+
+    @istest
+    def calculates_headways_between_consecutive_arrivals(self):
+        stop = build_forecast([(100, [('B', '10:20'), ('A', '10:05'), ('C', '10:21')])]).stops[0]
+
+        headways = stop_headways(1, stop)
+
+        self.assertEqual([(h.leading.prefix, h.trailing.prefix, h.seconds) for h in headways],
+                         [('A', 'B', 900), ('B', 'C', 60)])
+        self.assertEqual(headways[0].route_code, 1)
+        self.assertEqual(headways[0].stop_code, 100)
+
+    @istest
+    def has_no_headways_with_less_than_two_vehicles(self):
+        stop = build_forecast([(100, [('A', '10:05')])]).stops[0]
+
+        self.assertEqual(stop_headways(1, stop), [])
+
+
+class HeadwayMonitorTest(TestCase):
+
+    def setUp(self):
+        self.monitor = HeadwayMonitor(bunching=60, gap=1200)
+
+    @istest
+    def flags_bunching_and_gaps(self):
+        alerts = self.monitor.update(1, build_forecast([
+            (100, [('A', '10:05'), ('B', '10:06'), ('C', '10:30')]),
+            (200, [('A', '10:01'), ('B', '10:10')]),
+        ]))
+
+        self.assertEqual(sorted((alert.kind, alert.stop_code, alert.leading.prefix, alert.seconds) for alert in alerts),
+                         [(BUNCHING, 100, 'A', 60), (GAP, 100, 'B', 1440)])
+
+    @istest
+    def returns_only_new_alerts(self):
+        self.monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:06')])]))
+
+        alerts = self.monitor.update(1, build_forecast([
+            (100, [('A', '10:06'), ('B', '10:06')]),
+            (200, [('A', '10:08'), ('B', '10:08')]),
+        ]))
+
+        self.assertEqual([(alert.stop_code, alert.seconds) for alert in alerts], [(200, 0)])
+        self.assertEqual(len(self.monitor.alerts(1)), 2)
+
+    @istest
+    def clears_alerts_that_are_gone(self):
+        self.monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:06')])]))
+        self.monitor.update(2, build_forecast([(100, [('C', '10:05'), ('D', '10:05')])]))
+
+        self.monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:15')])]))
+
+        self.assertEqual(self.monitor.alerts(1), [])
+        self.assertEqual([alert.route_code for alert in self.monitor.alerts()], [2])
+
+    @istest
+    def does_not_flag_gaps_when_disabled(self):
+        monitor = HeadwayMonitor(bunching=60)
+
+        alerts = monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '11:06')])]))
+
+        self.assertEqual(alerts, [])
+
+    @istest
+    def lists_headways_per_route_and_stop(self):
+        self.monitor.update(1, build_forecast([
+            (100, [('A', '10:05'), ('B', '10:10')]),
+            (200, [('A', '10:08'), ('B', '10:15')]),
+        ]))
+
+        self.assertEqual([h.seconds for h in self.monitor.headways(1)], [300, 420])
+        self.assertEqual([h.seconds for h in self.monitor.headways(1, stop_code=200)], [420])
+        self.assertEqual(self.monitor.headways(2), [])
+
+    @istest
+    def summarizes_the_headways_of_a_route(self):
+        self.monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:06'), ('C', '10:36')])]))
+
+        summary = self.monitor.summary(1)
+
+        self.assertEqual(summary, (1, 2, 930, 60, 1800, 1, 1))
+
+    @istest
+    def summarizes_a_route_without_headways(self):
+        self.assertEqual(self.monitor.summary(1), (1, 0, None, None, None, 0, 0))
+
+    @istest
+    def forgets_a_route(self):
+        self.monitor.update(1, build_forecast([(100, [('A', '10:05'), ('B', '10:06')])]))
+
+        self.monitor.forget(1)
+        self.monitor.forget(2)
+
+        self.assertEqual(self.monitor.alerts(), [])
+        self.assertEqual(self.monitor.headways(1), [])
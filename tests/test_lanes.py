@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from mock import MagicMock
+from nose.tools import istest
+
+from .factories import build_positions
+from sptrans.lanes import LaneIndex
+from sptrans.v0 import ForecastWithStop, ForecastWithStops, Lane, Stop
+
+
+LANES = [Lane(1, 0, 'NORTH'), Lane(2, 0, 'SOUTH'), Lane(3, 0, 'EMPTY')]
+STOPS = {
+    1: [Stop(10, 'A', 'ADDRESS', -23.50, -46.6), Stop(20, 'B', 'ADDRESS', -23.49, -46.6)],
+    2: [Stop(20, 'B', 'ADDRESS', -23.49, -46.6), Stop(30, 'C', 'ADDRESS', -23.60, -46.6)],
+}
+
+
+def vehicles(arrivals):
+    return [{'p': prefix, 'a': False, 't': arriving_at, 'py': -23.5, 'px': -46.6} for prefix, arriving_at in arrivals]
+
+
+class LaneIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = LaneIndex(LANES, STOPS, max_distance=150)
+
+    @istest
+    def indexes_lanes_and_stops_both_ways(self):
+        self.assertEqual(sorted(self.index.lane_codes), [1, 2, 3])
+        self.assertEqual(self.index.stops(2), [20, 30])
+        self.assertEqual(self.index.stops(3), [])
+        self.assertEqual(sorted(self.index.lanes_of(20)), [1, 2])
+        self.assertEqual(self.index.lanes_of(99), [])
+
+    @istest
+    def builds_from_a_client(self):
+        client = MagicMock()
+        client.list_lanes.return_value = iter(LANES[:2])
+        client.search_stops_by_lane.side_effect = lambda code: iter(STOPS[code])
+
+        index = LaneIndex.build(client)
+
+        self.assertEqual(index.stops(1), [10, 20])
+        self.assertEqual(client.search_stops_by_lane.call_count, 2)
+
+    @istest
+    def finds_the_nearest_stop_within_the_maximum_distance(self):
+        self.assertEqual(self.index.nearest_stop(-23.4995, -46.6), 10)
+        self.assertEqual(self.index.nearest_stop(-23.4905, -46.6), 20)
+        self.assertIsNone(self.index.nearest_stop(-23.495, -46.6))
+
+    @istest
+    def finds_the_nearest_of_close_stops(self):
+        index = LaneIndex(LANES[:1], {1: [Stop(10, 'A', 'ADDRESS', -23.5, -46.6), Stop(20, 'B', 'ADDRESS', -23.5005, -46.6)]})
+
+        self.assertEqual(index.nearest_stop(-23.4999, -46.6), 10)
+        self.assertEqual(index.nearest_stop(-23.5006, -46.6), 20)
+
+    @istest
+    def lists_a_lane_once_for_stops_repeated_in_it(self):
+        index = LaneIndex(LANES[:1], {1: STOPS[1] + STOPS[1][:1]})
+
+        self.assertEqual(index.lanes_of(10), [1])
+
+    @istest
+    def counts_distinct_vehicles_close_to_the_lane_stops(self):
+        counts = self.index.vehicle_counts([
+            build_positions([('X', -23.5), ('Y', -23.49), ('Z', -23.0)]),
+            build_positions([('X', -23.5), ('W', -23.6)]),
+        ])
+
+        self.assertEqual(counts, {1: 2, 2: 2, 3: 0})
+
+    @istest
+    def averages_the_gaps_between_arrivals_per_lane(self):
+        by_route = ForecastWithStops.from_dict({'hr': '10:00', 'ps': [
+            {'cp': 10, 'np': 'A', 'py': -23.5, 'px': -46.6, 'vs': vehicles([('X', '10:05'), ('Y', '10:15')])},
+            {'cp': 99, 'np': 'OUT', 'py': -23.5, 'px': -46.6, 'vs': vehicles([('X', '10:06')])},
+        ]})
+        by_stop = ForecastWithStop.from_dict({'hr': '10:00', 'p': {'cp': 20, 'np': 'B', 'py': -23.49, 'px': -46.6, 'l': [
+            {'c': '1', 'cl': 1, 'sl': 1, 'lt0': 'A', 'lt1': 'B', 'qv': 1, 'vs': vehicles([('X', '10:10')])},
+            {'c': '2', 'cl': 2, 'sl': 1, 'lt0': 'A', 'lt1': 'B', 'qv': 2, 'vs': vehicles([('Z', '10:40'), ('Y', '10:20')])},
+        ]}})
+
+        gaps = self.index.arrival_gaps([by_route, by_stop])
+
+        self.assertEqual(gaps[1], (5, 800))
+        self.assertEqual(gaps[2], (3, 900))
+        self.assertEqual(gaps[3], (0, None))
+
+    @istest
+    def counts_repeated_arrivals_once(self):
+        forecast = ForecastWithStops.from_dict({'hr': '10:00', 'ps': [
+            {'cp': 10, 'np': 'A', 'py': -23.5, 'px': -46.6, 'vs': vehicles([('X', '10:05'), ('Y', '10:15')])},
+        ]})
+
+        self.assertEqual(self.index.arrival_gaps([forecast, forecast])[1], (2, 600))
+
+    @istest
+    def aggregates_positions_and_forecasts(self):
+        forecast = ForecastWithStops.from_dict({'hr': '10:00', 'ps': [
+            {'cp': 30, 'np': 'C', 'py': -23.6, 'px': -46.6, 'vs': vehicles([('X', '10:05'), ('Y', '10:07')])},
+        ]})
+
+        stats = self.index.aggregate([build_positions([('W', -23.6)])], [forecast])
+
+        self.assertEqual(stats[2], (2, 'SOUTH', 2, 1, 2, 120))
+        self.assertEqual(stats[1].vehicles, 0)
+        self.assertIsNone(stats[1].average_gap)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from unittest import TestCase
+
+from mock import MagicMock, patch
+from nose.tools import istest
+
+from . import test_fixtures
+from sptrans.routes import RouteResolver, route_sign
+from sptrans.v0 import RequestError, Route
+
+
+ROUTES = [Route.from_dict(route_dict) for route_dict in json.loads(test_fixtures.ROUTE_SEARCH.decode('latin1'))]
+NIGHT_ROUTE = Route(4321, False, 'n137', 1, 11, 'TERMINAL A', 'TERMINAL B', None)
+
+
+class RouteSignTest(TestCase):
+
+    @istest
+    def joins_the_sign_and_the_type(self):
+        self.assertEqual(route_sign(ROUTES[0]), '8000-10')
+        self.assertEqual(route_sign(NIGHT_ROUTE), 'N137-11')
+
+
+class RouteResolverTest(TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.search_routes.side_effect = lambda terms: iter({'1': ROUTES, '3': [NIGHT_ROUTE, ROUTES[0]]}.get(terms, []))
+        self.resolver = RouteResolver(self.client, terms=['1', '2', '3'])
+
+    @istest
+    def sweeps_the_routes_once(self):
+        self.assertEqual(self.resolver.refresh(), 2)
+
+        self.assertEqual([call[0][0] for call in self.client.search_routes.call_args_list], ['1', '2', '3'])
+        self.assertEqual(len(self.resolver), 2)
+        self.assertIsNotNone(self.resolver.refreshed_at)
+
+    @istest
+    def resolves_signs_and_directions(self):
+        self.resolver.refresh()
+
+        self.assertEqual(self.resolver.resolve('8000-10'), 1273)
+        self.assertEqual(self.resolver.resolve(' 8000-10', direction=2), 34041)
+        self.assertEqual(self.resolver.resolve('n137-11'), 4321)
+        self.assertIsNone(self.resolver.resolve('N137-11', direction=2))
+        self.assertIsNone(self.resolver.resolve('8000-11'))
+        self.assertRaises(ValueError, self.resolver.resolve, '8000-10', direction=0)
+
+    @istest
+    def resolves_many_signs_at_once(self):
+        self.resolver.load(ROUTES + [NIGHT_ROUTE])
+
+        codes = self.resolver.resolve_many(['8000-10', ('8000-10', 2), 'N137-11', '675K-10'])
+
+        self.assertEqual(codes, [1273, 34041, 4321, None])
+        self.assertEqual(self.resolver.resolve_many(['8000-10'], direction=2), [34041])
+        self.assertRaises(ValueError, self.resolver.resolve_many, [('8000-10', 3)])
+
+    @istest
+    def skips_routes_of_unknown_directions(self):
+        self.assertEqual(self.resolver.load([NIGHT_ROUTE._replace(code=5, direction=0), ROUTES[0]]), 1)
+
+        self.assertIsNone(self.resolver.resolve('N137-11'))
+        self.assertEqual(self.resolver.resolve('8000-10'), 1273)
+
+    @istest
+    def keeps_the_table_when_a_refresh_fails(self):
+        self.resolver.refresh()
+        self.client.search_routes.side_effect = RequestError('Failed')
+
+        self.assertRaises(RequestError, self.resolver.refresh)
+        self.assertEqual(self.resolver.resolve('8000-10'), 1273)
+
+    @istest
+    def refreshes_in_the_background(self):
+        refreshed = threading.Event()
+        self.resolver.load = lambda routes: refreshed.set() or RouteResolver.load(self.resolver, routes)
+
+        self.resolver.start()
+        refreshed.wait(1)
+        self.resolver.stop()
+
+        self.assertEqual(self.resolver.resolve('N137-11'), 4321)
+
+    @istest
+    def stops_without_being_started(self):
+        self.resolver.stop()
+
+        self.assertFalse(self.client.search_routes.called)
+
+    @istest
+    def retries_failed_background_refreshes_sooner(self):
+        refreshed = threading.Event()
+        search_routes = self.client.search_routes.side_effect
+        self.client.search_routes.side_effect = [RequestError('Not authenticated')] * 2 + [search_routes(terms) for terms in '123']
+        self.resolver.load = lambda routes: refreshed.set() or RouteResolver.load(self.resolver, routes)
+        self.resolver.retry_interval = 0.01
+
+        with patch('sptrans.routes.logger') as logger:
+            self.resolver.start()
+            refreshed.wait(1)
+            self.resolver.stop()
+
+        self.assertEqual(self.resolver.resolve('N137-11'), 4321)
+        self.assertIsNone(self.resolver.last_error)
+        self.assertEqual(logger.exception.call_count, 2)
+
+    @istest
+    def keeps_the_last_background_error(self):
+        failed = threading.Event()
+        error = RequestError('Not authenticated')
+
+        def search_routes(terms):
+            failed.set()
+            raise error
+
+        self.client.search_routes.side_effect = search_routes
+
+        with patch('sptrans.routes.logger'):
+            self.resolver.start()
+            failed.wait(1)
+            self.resolver.stop()
+
+        self.assertIs(self.resolver.last_error, error)
+        self.assertEqual(len(self.resolver), 0)
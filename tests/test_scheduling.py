@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from mock import MagicMock
+from nose.tools import istest
+import requests
+
+from .factories import build_positions
+from sptrans.scheduling import PollScheduler
+from sptrans.v0 import RequestError
+
+
+class PollSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.scheduler = PollScheduler(min_interval=10, max_interval=100, budget=10, burst=5, factor=2)
+
+    @istest
+    def makes_new_routes_due_immediately(self):
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.add_route(2, moment=0)
+
+        self.assertEqual(sorted(self.scheduler.due(0)), [1, 2])
+        self.assertEqual(self.scheduler.due(0), [])
+
+    @istest
+    def schedules_the_next_poll_after_recording(self):
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.due(0)
+
+        self.scheduler.record(1, build_positions([('A', -23.5)], '10:00'), 0)
+
+        self.assertEqual(self.scheduler.due(9), [])
+        self.assertEqual(self.scheduler.due(10), [1])
+
+    @istest
+    def speeds_up_routes_where_vehicles_move(self):
+        self.scheduler.add_route(1, interval=40, moment=0)
+        self.scheduler.record(1, build_positions([('A', -23.5), ('B', -23.5)], '10:00'), 0)
+
+        interval = self.scheduler.record(1, build_positions([('A', -23.6), ('B', -23.6)], '10:01'), 40)
+
+        self.assertEqual(interval, 20)
+
+    @istest
+    def slows_down_routes_where_vehicles_stand_still(self):
+        self.scheduler.add_route(1, interval=40, moment=0)
+        self.scheduler.record(1, build_positions([('A', -23.5), ('B', -23.5)], '10:00'), 0)
+
+        interval = self.scheduler.record(1, build_positions([('A', -23.5), ('B', -23.5)], '10:01'), 40)
+
+        self.assertEqual(interval, 80)
+
+    @istest
+    def backs_off_routes_without_vehicles_or_new_data(self):
+        self.scheduler.add_route(1, interval=20, moment=0)
+        self.scheduler.add_route(2, interval=20, moment=0)
+        self.scheduler.record(1, build_positions([('A', -23.5)], '10:00'), 0)
+
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.6)], '10:00'), 80), 40)
+        self.assertEqual(self.scheduler.record(2, build_positions([], '10:00'), 0), 40)
+        self.assertEqual(self.scheduler.record(2, None, 40), 80)
+        self.assertEqual(self.scheduler.record(2, None, 120), 100)
+
+    @istest
+    def speeds_up_busy_routes_polled_within_the_same_minute(self):
+        self.scheduler.add_route(1, interval=40, moment=0)
+        self.scheduler.record(1, build_positions([('A', -23.50)], '10:00'), 0)
+
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.51)], '10:00'), 15), 20)
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.52)], '10:00'), 30), 10)
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.53)], '10:01'), 40), 10)
+
+    @istest
+    def keeps_the_vehicles_of_stale_polls(self):
+        self.scheduler.add_route(1, interval=20, moment=0)
+        self.scheduler.record(1, build_positions([('A', -23.5)], '23:59'), 0)
+
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.6)], '23:59'), 90), 40)
+        self.assertEqual(self.scheduler.record(1, build_positions([('A', -23.6)], '00:00'), 130), 80)
+        self.assertEqual(self.scheduler._routes[1].vehicles, {'A': (-23.6, -46.6)})
+
+    @istest
+    def keeps_the_interval_of_routes_neither_busy_nor_quiet(self):
+        self.scheduler.add_route(1, interval=40, moment=0)
+        vehicles = [('A', -23.5), ('B', -23.5), ('C', -23.5), ('D', -23.5)]
+        self.scheduler.record(1, build_positions(vehicles, '10:00'), 0)
+
+        interval = self.scheduler.record(1, build_positions([('A', -23.6)] + vehicles[1:], '10:01'), 40)
+
+        self.assertEqual(interval, 40)
+
+    @istest
+    def ignores_polls_of_unknown_routes(self):
+        self.assertIsNone(self.scheduler.record(1, build_positions([], '10:00'), 0))
+
+    @istest
+    def stretches_intervals_to_fit_the_budget(self):
+        scheduler = PollScheduler(min_interval=10, budget=0.2)
+        for route_code in range(4):
+            scheduler.add_route(route_code, moment=0)
+
+        self.assertAlmostEqual(scheduler.demand, 0.4)
+        self.assertAlmostEqual(scheduler.effective_interval(0), 20)
+
+    @istest
+    def limits_bursts_of_due_routes(self):
+        for route_code in range(8):
+            self.scheduler.add_route(route_code, moment=0)
+
+        self.assertEqual(len(self.scheduler.due(0)), 5)
+        self.assertAlmostEqual(self.scheduler.wait_time(0), 0.1)
+        self.assertEqual(len(self.scheduler.due(0.2)), 2)
+
+    @istest
+    def forgets_removed_routes(self):
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.remove_route(1)
+
+        self.assertEqual(self.scheduler.due(0), [])
+        self.assertIsNone(self.scheduler.wait_time(0))
+        self.assertEqual(self.scheduler.demand, 0)
+
+    @istest
+    def waits_for_the_routes_still_scheduled(self):
+        self.scheduler.add_route(1, moment=5)
+        self.scheduler.add_route(2, moment=0)
+        self.scheduler.remove_route(2)
+
+        self.assertEqual(self.scheduler.route_codes, [1])
+        self.assertEqual(self.scheduler.wait_time(0), 5)
+
+    @istest
+    def polls_due_routes_with_a_client(self):
+        client = MagicMock()
+        positions = build_positions([('A', -23.5)], '10:00')
+        client.get_positions.side_effect = [RequestError, positions]
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.add_route(2, moment=1)
+
+        results = self.scheduler.run_once(client, moment=1)
+
+        self.assertEqual(results, {2: positions})
+        self.assertEqual(self.scheduler.interval(1), 20)
+        self.assertEqual(self.scheduler.wait_time(1), 10)
+
+    @istest
+    def backs_off_routes_whose_polls_time_out(self):
+        client = MagicMock()
+        client.get_positions.side_effect = [requests.ConnectTimeout, requests.ConnectionError]
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.add_route(2, moment=0)
+
+        results = self.scheduler.run_once(client, moment=0)
+
+        self.assertEqual(results, {})
+        self.assertEqual(self.scheduler.interval(1), 20)
+        self.assertEqual(self.scheduler.interval(2), 20)
+        self.assertEqual(self.scheduler.wait_time(0), 20)
+        self.assertEqual(sorted(self.scheduler.due(20)), [1, 2])
+
+    @istest
+    def reschedules_taken_routes_when_an_unexpected_error_interrupts_the_polls(self):
+        client = MagicMock()
+        client.get_positions.side_effect = ValueError
+        self.scheduler.add_route(1, moment=0)
+        self.scheduler.add_route(2, moment=0)
+
+        with self.assertRaises(ValueError):
+            self.scheduler.run_once(client, moment=0)
+
+        self.assertEqual(self.scheduler.interval(1), 20)
+        self.assertEqual(self.scheduler.interval(2), 20)
+        self.assertEqual(sorted(self.scheduler.due(20)), [1, 2])
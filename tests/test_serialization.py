@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import json
+from unittest import TestCase, skipUnless
+
+from mock import patch
+from nose.tools import istest
+
+from . import test_fixtures
+from sptrans import serialization
+from sptrans.serialization import JSON, MSGPACK, dumps, loads, register
+from sptrans.v0 import (
+    STRING_POOL,
+    ForecastWithStop,
+    ForecastWithStops,
+    Positions,
+    Route,
+    TimeField,
+    TupleListField,
+    Vehicle,
+    build_tuple_class,
+)
+
+
+def decode(fixture, tuple_class):
+    return tuple_class.from_dict(json.loads(fixture.decode('latin1')))
+
+
+class SerializationTest(TestCase):
+
+    @istest
+    def round_trips_nested_models(self):
+        for fixture, tuple_class in [
+                (test_fixtures.FORECAST_FOR_STOP, ForecastWithStop),
+                (test_fixtures.FORECAST_FOR_ROUTE, ForecastWithStops),
+                (test_fixtures.VEHICLE_POSITIONS, Positions)]:
+            model = decode(fixture, tuple_class)
+
+            self.assertEqual(loads(dumps(model, JSON)), model)
+
+    @istest
+    def round_trips_lists_of_models(self):
+        routes = [Route.from_dict(route_dict) for route_dict in json.loads(test_fixtures.ROUTE_SEARCH.decode('latin1'))]
+
+        self.assertEqual(loads(dumps(routes, JSON)), routes)
+        self.assertEqual(loads(dumps([], JSON)), [])
+
+    @istest
+    def keeps_datetimes_of_any_day(self):
+        positions = Positions(datetime(2015, 3, 2, 23, 59, 30, 123456), [Vehicle('11433', True, -23.5, -46.6)])
+
+        self.assertEqual(loads(dumps(positions, JSON)).time, positions.time)
+
+    @istest
+    def pools_the_decoded_strings(self):
+        positions = decode(test_fixtures.VEHICLE_POSITIONS, Positions)
+
+        decoded = loads(dumps(positions, JSON))
+
+        self.assertIs(decoded.vehicles[0].prefix, STRING_POOL.intern(positions.vehicles[0].prefix))
+
+    @istest
+    def is_smaller_than_the_api_results(self):
+        data = dumps(decode(test_fixtures.FORECAST_FOR_STOP, ForecastWithStop), JSON)
+
+        self.assertLess(len(data), len(test_fixtures.FORECAST_FOR_STOP))
+
+    @istest
+    @skipUnless(serialization.msgpack, 'msgpack is not installed')
+    def encodes_with_msgpack(self):
+        forecast = decode(test_fixtures.FORECAST_FOR_ROUTE, ForecastWithStops)
+
+        data = dumps(forecast, MSGPACK)
+
+        self.assertEqual(data[3:4], MSGPACK)
+        self.assertEqual(loads(data), forecast)
+
+    @istest
+    def keeps_empty_lists_and_missing_times(self):
+        positions = Positions(None, [])
+
+        self.assertEqual(loads(dumps(positions, JSON)), positions)
+
+    @istest
+    def encodes_with_msgpack_when_installed(self):
+        data = dumps(decode(test_fixtures.VEHICLE_POSITIONS, Positions))
+
+        self.assertEqual(data[3:4], JSON if serialization.msgpack is None else MSGPACK)
+
+    @istest
+    def needs_msgpack_for_its_codec(self):
+        positions = decode(test_fixtures.VEHICLE_POSITIONS, Positions)
+
+        with patch.object(serialization, 'msgpack', None):
+            self.assertRaises(ImportError, dumps, positions, MSGPACK)
+            self.assertEqual(dumps(positions)[3:4], JSON)
+
+    @istest
+    def refuses_unknown_data(self):
+        data = dumps(decode(test_fixtures.VEHICLE_POSITIONS, Positions), JSON)
+
+        self.assertRaises(ValueError, loads, b'{"hr": "10:00"}')
+        self.assertRaises(ValueError, loads, data[:3] + b'x' + data[4:])
+        self.assertRaises(ValueError, loads, data[:2] + b'\x09' + data[3:])
+
+
+class RegisterTest(TestCase):
+
+    def setUp(self):
+        self.Trip = build_tuple_class('Trip', {
+            'started_at': TimeField('t'),
+            'stops': 's',
+            'vehicles': TupleListField('vs', Vehicle),
+        })
+
+    def tearDown(self):
+        serialization._classes.pop(100, None)
+        serialization._schemas.pop(self.Trip, None)
+
+    @istest
+    def serializes_user_defined_models(self):
+        register(self.Trip, 100)
+        trip = self.Trip(datetime(2015, 3, 2, 10, 0), [1, 2], [Vehicle('11433', True, -23.5, -46.6)])
+
+        self.assertEqual(loads(dumps(trip, JSON)), trip)
+
+    @istest
+    def refuses_data_of_unregistered_models(self):
+        register(self.Trip, 100)
+        data = dumps(self.Trip(None, [], []), JSON)
+        serialization._classes.pop(100)
+
+        self.assertRaises(ValueError, loads, data)
+
+    @istest
+    def refuses_unregistered_models(self):
+        self.assertRaises(ValueError, dumps, self.Trip(None, [], []), JSON)
+
+    @istest
+    def refuses_ids_already_taken(self):
+        self.assertRaises(ValueError, register, self.Trip, 1)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import errno
+import json
+import os
+import shutil
+import tempfile
+import threading
+from time import time as now
+from unittest import TestCase
+
+from mock import MagicMock, patch
+from nose.tools import istest
+
+from . import stub_server, test_fixtures
+from .stub_server import StubServer
+from sptrans.sharedcache import SharedCache, default_directory
+from sptrans.v0 import Client, RequestError
+
+
+URL = 'http://api.olhovivo.sptrans.com.br/v0/Posicao?codigoLinha=1234'
+
+
+class SharedCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SharedCache(os.path.join(self.directory, 'cache'), ttl=15, static_ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @istest
+    def stores_and_reads_entries(self):
+        self.cache.put(URL, 'abc', '"v1"', None, 100.0, {'hr': '10:00', 'vs': [u'ônibus']})
+
+        entry = SharedCache(self.cache.directory).get(URL)
+
+        self.assertEqual(entry[:5], (URL, 'abc', '"v1"', None, 100.0))
+        self.assertEqual(json.loads(entry.content.tobytes().decode('utf-8')), {'hr': '10:00', 'vs': [u'ônibus']})
+
+    @istest
+    def replaces_entries(self):
+        self.cache.put(URL, 'abc', None, None, 100.0, [1])
+        self.cache.put(URL, 'def', None, None, 200.0, [2])
+
+        self.assertEqual(self.cache.get(URL).digest, 'def')
+        self.assertEqual([name for name in os.listdir(self.cache.directory) if name.endswith('.tmp')], [])
+
+    @istest
+    def misses_unknown_urls(self):
+        self.assertIsNone(self.cache.get(URL))
+
+    @istest
+    def misses_truncated_foreign_and_colliding_entries(self):
+        self.cache.put(URL, 'abc', None, None, 100.0, [1])
+        with open(self.cache._path(URL), 'rb') as entry_file:
+            data = entry_file.read()
+        for url, content in ((URL + '0', data[:8]), (URL + '1', b'XX' + data[2:]), (URL + '2', data)):
+            with open(self.cache._path(url), 'wb') as entry_file:
+                entry_file.write(content)
+
+            self.assertIsNone(self.cache.get(url))
+
+    @istest
+    def removes_the_temporary_file_of_failed_writes(self):
+        with patch('sptrans.sharedcache.os.rename', side_effect=OSError(errno.EXDEV, 'failed')):
+            self.assertRaises(OSError, self.cache.put, URL, 'abc', None, None, 100.0, [1])
+
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    @istest
+    def raises_unexpected_locking_errors(self):
+        with patch('sptrans.sharedcache.fcntl.flock', side_effect=IOError(errno.EBADF, 'failed')):
+            with self.assertRaises(IOError):
+                with self.cache.lock(URL):
+                    pass
+
+    @istest
+    def tells_whether_entries_are_fresh(self):
+        self.cache.put(URL, 'abc', None, None, now() - 30, [])
+        entry = self.cache.get(URL)
+
+        self.assertFalse(self.cache.is_fresh(entry))
+        self.assertTrue(self.cache.is_fresh(entry, static=True))
+
+    @istest
+    def lets_a_single_holder_lock_an_entry(self):
+        events = []
+
+        def wait_for_lock():
+            with self.cache.lock(URL) as waited:
+                events.append(('acquired', waited))
+
+        with self.cache.lock(URL) as waited:
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            thread.join(0.2)
+            events.append(('released', waited))
+        thread.join()
+
+        self.assertEqual(events, [('released', False), ('acquired', True)])
+
+    @istest
+    def purges_old_entries(self):
+        self.cache.put(URL, 'abc', None, None, now(), [])
+        self.cache.put(URL + '0', 'abc', None, None, now(), [])
+        old_path = self.cache._path(URL)
+        os.utime(old_path, (now() - 120, now() - 120))
+
+        self.assertEqual(self.cache.purge(60), 1)
+        self.assertIsNone(self.cache.get(URL))
+        self.assertEqual(self.cache.purge(), 1)
+
+    @istest
+    def purges_unused_lock_files_and_stale_temporary_files(self):
+        self.cache.put(URL, 'abc', None, None, now(), [])
+        for url in (URL, URL + '0', URL + '1'):
+            with self.cache.lock(url):
+                pass
+        for name, age in (('old.tmp', 120), ('new.tmp', 0)):
+            path = os.path.join(self.cache.directory, name)
+            open(path, 'w').close()
+            os.utime(path, (now() - age, now() - age))
+
+        with self.cache.lock(URL + '1'):
+            self.cache.purge(60)
+
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), sorted([
+            os.path.basename(self.cache._path(URL)),
+            os.path.basename(self.cache._path(URL)) + '.lock',
+            os.path.basename(self.cache._path(URL + '1')) + '.lock',
+            'new.tmp',
+        ]))
+
+    @istest
+    def skips_files_removed_while_purging(self):
+        self.cache.put(URL, 'abc', None, None, now(), [])
+        os.mkdir(self.cache._path(URL + '0') + '.lock')
+
+        with patch('sptrans.sharedcache.os.path.getmtime', side_effect=OSError(errno.ENOENT, 'removed')):
+            self.assertEqual(self.cache.purge(60), 0)
+
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    @istest
+    def keeps_the_default_directory_per_user(self):
+        self.assertTrue(default_directory().endswith('sptrans-{}'.format(os.getuid())))
+        with patch('sptrans.sharedcache.os.path.isdir', return_value=False):
+            self.assertEqual(default_directory(), os.path.join(tempfile.gettempdir(), 'sptrans-{}'.format(os.getuid())))
+
+    @istest
+    def raises_when_the_directory_cannot_be_created(self):
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+
+        self.assertRaises(OSError, SharedCache, os.path.join(path, 'cache'))
+
+    @istest
+    def refuses_directories_other_users_can_access(self):
+        directory = os.path.join(self.directory, 'open')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+
+        self.assertRaises(OSError, SharedCache, directory)
+
+    @istest
+    def refuses_directories_of_other_users(self):
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(OSError, SharedCache, self.cache.directory)
+
+    @istest
+    def refuses_symbolic_links(self):
+        link = os.path.join(self.directory, 'link')
+        os.symlink(self.cache.directory, link)
+
+        self.assertRaises(OSError, SharedCache, link)
+
+
+class ClientWithSharedCacheTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self.server.delay is not None:
+            self.server.delay.set()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def build_client(self, ttl=15):
+        client = Client(token=stub_server.TOKEN, base_url=self.server.base_url, cache=SharedCache(self.directory, ttl=ttl))
+        client.authenticate()
+        return client
+
+    @istest
+    def shares_results_among_clients(self):
+        first = self.build_client()
+        second = self.build_client()
+
+        positions = first.get_positions(1234)
+        shared_positions = second.get_positions(1234)
+
+        self.assertEqual(shared_positions, positions)
+        self.assertTrue(second.fresh)
+        self.assertEqual(self.server.requests['/Posicao'], 1)
+
+    @istest
+    def keeps_the_objects_built_from_unchanged_entries(self):
+        client = self.build_client()
+        positions = client.get_positions(1234)
+
+        self.assertIs(client.get_positions(1234), positions)
+        self.assertFalse(client.fresh)
+        self.assertEqual(self.server.requests['/Posicao'], 1)
+
+    @istest
+    def refreshes_expired_entries_once(self):
+        clients = [self.build_client() for _ in range(4)]
+        clients[0].get_positions(1234)
+        cache = clients[0].cache
+        url = clients[0]._build_url('Posicao', codigoLinha=1234)
+        entry = cache.get(url)
+        cache.put(url, entry.digest, entry.etag, entry.last_modified, now() - 60, json.loads(entry.content.tobytes().decode('utf-8')))
+        self.server.delay = threading.Event()
+        results = []
+
+        threads = [threading.Thread(target=lambda client=client: results.append(client.get_positions(1234))) for client in clients]
+        for thread in threads:
+            thread.start()
+        threading.Timer(0.2, self.server.delay.set).start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.server.requests['/Posicao'], 2)
+
+    @istest
+    def fetches_by_itself_when_the_lock_holder_did_not_refresh_the_entry(self):
+        client = self.build_client()
+
+        @contextmanager
+        def lock(url):
+            yield True
+
+        client.cache.lock = MagicMock(side_effect=lock)
+
+        self.assertEqual(len(client.get_positions(1234).vehicles), 2)
+        self.assertEqual(self.server.requests['/Posicao'], 1)
+        self.assertIsNotNone(client.cache.get(client._build_url('Posicao', codigoLinha=1234)))
+
+    @istest
+    def does_not_share_error_messages(self):
+        client = self.build_client()
+        self.server.responses['/Posicao'] = test_fixtures.MESSAGE_ERROR
+
+        self.assertRaises(RequestError, client.get_positions, 1234)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.entry')], [])
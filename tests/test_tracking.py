@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from unittest import TestCase
+
+from nose.tools import istest
+
+from .factories import build_positions
+from sptrans.geo import distance
+from sptrans.tracking import VehicleTracker, to_timestamp
+
+
+class ToTimestampTest(TestCase):
+
+    @istest
+    def converts_datetimes_and_numbers(self):
+        self.assertEqual(to_timestamp(datetime(1970, 1, 1, 0, 1)), 60.0)
+        self.assertEqual(to_timestamp(30), 30.0)
+
+
+class VehicleTrackerTest(TestCase):
+
+    def setUp(self):
+        self.tracker = VehicleTracker(size=4, max_idle=600, stall_distance=30)
+
+    @istest
+    def estimates_speed_and_heading_of_a_moving_vehicle(self):
+        for moment, latitude in enumerate([-23.50, -23.49, -23.48]):
+            self.tracker.update(1, build_positions([('A', latitude, -46.6)]), observed_at=moment * 60)
+
+        state = self.tracker.state('A')
+
+        expected_speed = distance(-23.50, -46.6, -23.48, -46.6) / 120
+        self.assertEqual(state.prefix, 'A')
+        self.assertEqual(state.route_code, 1)
+        self.assertEqual(state.latitude, -23.48)
+        self.assertEqual(state.seen_at, 120)
+        self.assertAlmostEqual(state.speed, expected_speed)
+        self.assertAlmostEqual(state.heading, 0, places=3)
+        self.assertEqual(state.dwell, 0)
+
+    @istest
+    def has_no_speed_or_heading_with_a_single_position(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)]), observed_at=0)
+
+        state = self.tracker.state('A')
+
+        self.assertIsNone(state.speed)
+        self.assertIsNone(state.heading)
+        self.assertEqual(state.dwell, 0)
+
+    @istest
+    def ignores_snapshots_not_newer_than_the_last_one(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)]), observed_at=60)
+        self.tracker.update(1, build_positions([('A', -23.4, -46.6)]), observed_at=60)
+
+        self.assertEqual(self.tracker.state('A').latitude, -23.5)
+
+    @istest
+    def uses_the_api_time_by_default(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)], time='10:00'))
+
+        self.assertEqual(datetime.utcfromtimestamp(self.tracker.state('A').seen_at).minute, 0)
+
+    @istest
+    def keeps_only_the_most_recent_positions(self):
+        for moment in range(10):
+            self.tracker.update(1, build_positions([('A', -23.5 + moment * 0.001, -46.6)]), observed_at=moment)
+
+        state = self.tracker.state('A')
+
+        self.assertAlmostEqual(state.speed, distance(-23.494, -46.6, -23.491, -46.6) / 3)
+
+    @istest
+    def finds_stalled_vehicles_of_a_route(self):
+        for moment in range(4):
+            self.tracker.update(1, build_positions([
+                ('A', -23.5 + moment * 0.01, -46.6),
+                ('B', -23.5, -46.6 + moment * 0.00001),
+            ]), observed_at=moment * 120)
+            self.tracker.update(2, build_positions([('C', -23.5, -46.6)]), observed_at=moment * 120)
+
+        stalled = self.tracker.stalled(1, min_dwell=300)
+
+        self.assertEqual([state.prefix for state in stalled], ['B'])
+        self.assertEqual(stalled[0].dwell, 360)
+        self.assertEqual(sorted(state.prefix for state in self.tracker.stalled(min_dwell=300)), ['B', 'C'])
+
+    @istest
+    def lists_vehicles_per_route(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)]), observed_at=0)
+        self.tracker.update(2, build_positions([('B', -23.5, -46.6)]), observed_at=0)
+
+        self.assertEqual([state.prefix for state in self.tracker.vehicles(2)], ['B'])
+        self.assertEqual(len(self.tracker.vehicles()), 2)
+
+    @istest
+    def forgets_vehicles_not_seen_for_a_while(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)]), observed_at=0)
+        self.tracker.update(1, build_positions([('B', -23.5, -46.6)]), observed_at=601)
+
+        self.assertIsNone(self.tracker.state('A'))
+        self.assertEqual(len(self.tracker), 1)
+
+    @istest
+    def forgets_all_vehicles_after_a_snapshot_without_any(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6), ('B', -23.5, -46.6)]), observed_at=0)
+        self.tracker.update(1, build_positions([]), observed_at=601)
+
+        self.assertEqual(len(self.tracker), 0)
+
+    @istest
+    def forgets_idle_vehicles_behind_ones_seen_again(self):
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6), ('B', -23.5, -46.6)]), observed_at=0)
+        self.tracker.update(1, build_positions([('A', -23.5, -46.6)]), observed_at=500)
+        self.tracker.update(2, build_positions([('C', -23.5, -46.6)]), observed_at=700)
+
+        self.assertEqual(list(self.tracker._tracks), ['A', 'C'])
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from mock import MagicMock
+from nose.tools import istest
+
+from .factories import build_positions
+from sptrans.traveltimes import TravelTimeEstimator
+from sptrans.v0 import Stop
+
+
+STOPS = [Stop(code, 'STOP {}'.format(code), 'ADDRESS', latitude, -46.6)
+         for code, latitude in [(10, -23.50), (20, -23.49), (30, -23.48)]]
+
+
+def at_ten(seconds):
+    return datetime(2026, 10, 19, 10) + timedelta(seconds=seconds)
+
+
+class TravelTimeEstimatorTest(TestCase):
+
+    def setUp(self):
+        self.estimator = TravelTimeEstimator(bucket_minutes=60)
+        self.estimator.add_route(1, STOPS)
+
+    def drive(self, prefix, trip, route_code=1):
+        travels = 0
+        for seconds, latitude in trip:
+            travels += self.estimator.update(route_code, build_positions([(prefix, latitude, -46.6)]), observed_at=at_ten(seconds))
+        return travels
+
+    @istest
+    def measures_the_travel_time_of_traversed_segments(self):
+        travels = self.drive('A', [(0, -23.50), (10, -23.495), (20, -23.485), (30, -23.48)])
+
+        self.assertEqual(travels, 2)
+        first, second = self.estimator.estimates(1)
+        self.assertEqual((first.from_stop, first.to_stop, first.count), (10, 20, 1))
+        self.assertAlmostEqual(first.mean, 15)
+        self.assertAlmostEqual(second.mean, 15)
+        self.assertEqual(first.deviation, 0)
+
+    @istest
+    def accumulates_statistics_per_time_of_the_day(self):
+        self.drive('A', [(0, -23.50), (20, -23.49)])
+        self.drive('B', [(0, -23.50), (40, -23.49)])
+
+        estimate = self.estimator.estimate(1, 0, at=at_ten(0))
+
+        self.assertEqual(estimate.bucket, 10)
+        self.assertEqual(estimate.count, 2)
+        self.assertAlmostEqual(estimate.mean, 30)
+        self.assertAlmostEqual(estimate.deviation, 10)
+        self.assertEqual(self.estimator.estimate(1, 0, at=datetime(2026, 10, 19, 11)).count, 0)
+        self.assertAlmostEqual(self.estimator.estimate(1, 0).mean, 30)
+
+    @istest
+    def keeps_a_shorter_last_bucket_when_the_size_does_not_divide_a_day(self):
+        estimator = TravelTimeEstimator(bucket_minutes=50)
+        estimator.add_route(1, STOPS)
+        for seconds, latitude in [(0, -23.50), (20, -23.49), (40, -23.48)]:
+            estimator.update(1, build_positions([('A', latitude)]), observed_at=datetime(2026, 10, 19, 23, 30, seconds))
+
+        estimate = estimator.estimate(1, 1, at=datetime(2026, 10, 19, 23, 30))
+
+        self.assertEqual(estimator.buckets, 29)
+        self.assertEqual((estimate.bucket, estimate.count), (28, 1))
+        self.assertEqual(estimator.estimate(1, 0, at=datetime(2026, 10, 19, 23, 30)).count, 1)
+
+    @istest
+    def estimates_travel_times_between_stops(self):
+        self.drive('A', [(0, -23.50), (10, -23.495), (20, -23.485), (30, -23.48)])
+
+        self.assertAlmostEqual(self.estimator.travel_time(1, 10, 30), 30)
+        self.assertAlmostEqual(self.estimator.travel_time(1, 20, 30), 15)
+        self.assertEqual(self.estimator.travel_time(1, 20, 20), 0)
+
+    @istest
+    def has_no_estimate_without_travels(self):
+        self.drive('A', [(0, -23.50), (10, -23.495)])
+
+        self.assertIsNone(self.estimator.estimate(1, 0).mean)
+        self.assertIsNone(self.estimator.travel_time(1, 10, 30))
+
+    @istest
+    def ignores_vehicles_far_from_the_route(self):
+        travels = self.estimator.update(1, build_positions([('A', -23.50, -46.7)]), observed_at=0)
+
+        self.assertEqual(travels, 0)
+        self.assertEqual(self.estimator._vehicles, {})
+
+    @istest
+    def tolerates_stopped_vehicles_and_gps_noise(self):
+        travels = self.drive('A', [(0, -23.50), (10, -23.495), (20, -23.4951), (30, -23.495), (40, -23.49)])
+
+        self.assertEqual(travels, 1)
+        self.assertAlmostEqual(self.estimator.estimate(1, 0).mean, 40)
+
+    @istest
+    def measures_no_time_between_stops_at_the_same_place(self):
+        self.estimator.add_route(2, [Stop(5, 'STOP 5', 'ADDRESS', -23.50, -46.6)] + STOPS)
+
+        travels = self.drive('A', [(0, -23.50), (10, -23.4951), (20, -23.4905), (30, -23.48)], route_code=2)
+
+        self.assertEqual(travels, 3)
+        first, second, third = self.estimator.estimates(2)
+        self.assertEqual((first.from_stop, first.to_stop, first.mean), (5, 10, 0))
+        self.assertAlmostEqual(second.mean + third.mean, 30)
+
+    @istest
+    def restarts_when_a_vehicle_goes_back_to_the_start(self):
+        travels = self.drive('A', [(0, -23.50), (10, -23.485), (20, -23.50), (30, -23.495), (40, -23.49)])
+
+        self.assertEqual(travels, 2)
+        self.assertEqual(self.estimator.estimate(1, 0).count, 2)
+        self.assertAlmostEqual(self.estimator.estimate(1, 0).mean, (6.6667 + 20) / 2, places=3)
+
+    @istest
+    def ignores_older_snapshots(self):
+        self.drive('A', [(10, -23.50), (0, -23.49), (20, -23.49)])
+
+        self.assertAlmostEqual(self.estimator.estimate(1, 0).mean, 10)
+
+    @istest
+    def forgets_idle_vehicles(self):
+        self.drive('A', [(0, -23.50)])
+        self.drive('B', [(1000, -23.50)])
+
+        self.assertEqual(list(self.estimator._vehicles), [(1, 'B')])
+
+    @istest
+    def forgets_idle_vehicles_behind_ones_seen_again(self):
+        self.drive('A', [(0, -23.50)])
+        self.drive('B', [(0, -23.50)])
+        self.drive('A', [(500, -23.495)])
+        self.drive('C', [(1000, -23.50)])
+
+        self.assertEqual(list(self.estimator._vehicles), [(1, 'A'), (1, 'C')])
+
+    @istest
+    def forgets_the_vehicles_of_routes_added_again(self):
+        self.estimator.add_route(2, STOPS)
+        self.drive('A', [(0, -23.50)])
+        self.drive('A', [(0, -23.50)], route_code=2)
+
+        self.estimator.add_route(1, STOPS)
+
+        self.assertEqual(list(self.estimator._vehicles), [(2, 'A')])
+
+    @istest
+    def loads_the_stops_of_a_route(self):
+        client = MagicMock()
+        client.search_stops_by_route.return_value = iter(STOPS)
+
+        self.estimator.load_route(client, 2)
+
+        client.search_stops_by_route.assert_called_once_with(2)
+        self.assertEqual(len(self.estimator.estimates(2)), 2)
+
+    @istest
+    def needs_at_least_two_stops(self):
+        self.assertRaises(ValueError, self.estimator.add_route, 2, STOPS[:1])
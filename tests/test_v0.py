@@ -1,31 +1,63 @@
 # -*- coding: utf-8 -*-
 from datetime import date, datetime, time
+import hashlib
 import json
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 from unittest import TestCase, skipUnless
 
-from mock import patch
+from mock import MagicMock, patch
 from nose.tools import istest
+import requests
 
 
-from . import test_fixtures
+from . import stub_server, test_fixtures
+from .stub_server import StubServer
 from sptrans.v0 import (
     BASE_URL,
     AuthenticationError,
+    ChoiceField,
+    CircuitBreaker,
+    CircuitOpenError,
     Client,
+    Field,
+    FloatField,
     ForecastWithStop,
     ForecastWithStops,
     Lane,
     Route,
     Positions,
+    RawResponse,
     RequestError,
+    STRING_POOL,
     Stop,
+    StringPool,
+    TimeField,
+    TransferStats,
+    TupleListField,
+    Vehicle,
+    build_tuple_class,
+    content_encodings,
+    select,
 )
 
 
 TOKEN = os.environ.get('SPTRANS_TOKEN', None)
 
 
+def respond_with(mock_requests, content, status_code=200, headers=None):
+    response = mock_requests.Session.return_value.get.return_value
+    response.iter_content.return_value = [content[:10], content[10:]]
+    response.raw = None
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
 class ClientTest(TestCase):
 
     client = None
@@ -52,31 +84,31 @@ class ClientTest(TestCase):
     def gets_content_from_a_certain_endpoint(self, mock_requests):
         url = '{}/foo/bar?baz=joe'.format(BASE_URL)
         content = u'some façade'
-        mock_requests.get.return_value.content = content.encode('latin1')
+        respond_with(mock_requests, content.encode('latin1'))
 
         content = self.client._get_content('foo/bar', baz='joe')
 
         self.assertEqual(content, content)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def authenticates_the_user(self, mock_requests):
         token = 'some token'
         client = Client()
-        mock_requests.post.return_value.content = b'true'
+        mock_requests.Session.return_value.post.return_value.content = b'true'
 
         client.authenticate(token)
 
         url = self.client._build_url('Login/Autenticar', token=token)
-        mock_requests.post.assert_called_once_with(url)
+        mock_requests.Session.return_value.post.assert_called_once_with(url, timeout=client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def cannot_authenticate_the_user_if_token_is_invalid(self, mock_requests):
         token = 'some wrong token'
         client = Client()
-        mock_requests.post.return_value.content = b'false'
+        mock_requests.Session.return_value.post.return_value.content = b'false'
 
         self.assertRaises(AuthenticationError, client.authenticate, token)
 
@@ -89,7 +121,7 @@ class ClientTest(TestCase):
         class response:
             cookies = 'some cookies'
             content = b'true'
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.post.return_value = response
 
         client.authenticate(token)
 
@@ -100,7 +132,7 @@ class ClientTest(TestCase):
     def searches_routes(self, mock_requests):
         keywords = 'my search'
 
-        mock_requests.get.return_value.content = test_fixtures.ROUTE_SEARCH
+        respond_with(mock_requests, test_fixtures.ROUTE_SEARCH)
 
         routes = list(self.client.search_routes(keywords))
 
@@ -108,14 +140,14 @@ class ClientTest(TestCase):
                            for route_dict in json.loads(test_fixtures.ROUTE_SEARCH.decode('latin1'))]
         url = self.client._build_url('Linha/Buscar', termosBusca=keywords)
         self.assertEqual(routes, expected_routes)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def searches_routes_returns_generator(self, mock_requests):
         keywords = 'my search'
 
-        mock_requests.get.return_value.content = test_fixtures.ROUTE_SEARCH
+        respond_with(mock_requests, test_fixtures.ROUTE_SEARCH)
 
         routes = self.client.search_routes(keywords)
 
@@ -126,7 +158,7 @@ class ClientTest(TestCase):
     def searches_stops(self, mock_requests):
         keywords = 'my search'
 
-        mock_requests.get.return_value.content = test_fixtures.STOP_SEARCH
+        respond_with(mock_requests, test_fixtures.STOP_SEARCH)
 
         stops = list(self.client.search_stops(keywords))
 
@@ -134,14 +166,39 @@ class ClientTest(TestCase):
                           for stop_dict in json.loads(test_fixtures.STOP_SEARCH.decode('latin1'))]
         url = self.client._build_url('Parada/Buscar', termosBusca=keywords)
         self.assertEqual(stops, expected_stops)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def iterates_routes_with_filters(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.ROUTE_SEARCH)
+
+        routes = self.client.iter_routes('8000', direction=2, circular=False)
+
+        self.assert_is_a_generator(routes)
+        self.assertEqual([route.code for route in routes], [34041])
+        url = self.client._build_url('Linha/Buscar', termosBusca='8000')
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def iterates_stops_within_a_bounding_box_by_pages(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.STOP_SEARCH)
+        bbox = (-23.596, -46.674, -23.593, -46.672)
+
+        first_page = list(self.client.iter_stops('afonso braz', bbox=bbox, limit=1))
+        second_page = list(self.client.iter_stops('afonso braz', bbox=bbox, offset=1, limit=1))
+
+        self.assertEqual([stop.code for stop in first_page + second_page], [340015328, 340015331])
+        self.assertEqual(list(self.client.iter_stops('afonso braz', bbox=bbox, offset=2)), [])
+        self.assertEqual(mock_requests.Session.return_value.get.call_count, 3)
 
     @istest
     @patch('sptrans.v0.requests')
     def searches_stops_by_route(self, mock_requests):
         code = '1234'
 
-        mock_requests.get.return_value.content = test_fixtures.STOP_SEARCH_BY_ROUTE
+        respond_with(mock_requests, test_fixtures.STOP_SEARCH_BY_ROUTE)
 
         stops = list(self.client.search_stops_by_route(code))
 
@@ -149,14 +206,14 @@ class ClientTest(TestCase):
                           for stop_dict in json.loads(test_fixtures.STOP_SEARCH_BY_ROUTE.decode('latin1'))]
         url = self.client._build_url('Parada/BuscarParadasPorLinha', codigoLinha=code)
         self.assertEqual(stops, expected_stops)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def searches_stops_by_lane(self, mock_requests):
         code = '1234'
 
-        mock_requests.get.return_value.content = test_fixtures.STOP_SEARCH_BY_LANE
+        respond_with(mock_requests, test_fixtures.STOP_SEARCH_BY_LANE)
 
         stops = list(self.client.search_stops_by_lane(code))
 
@@ -164,12 +221,12 @@ class ClientTest(TestCase):
                           for stop_dict in json.loads(test_fixtures.STOP_SEARCH_BY_LANE.decode('latin1'))]
         url = self.client._build_url('Parada/BuscarParadasPorCorredor', codigoCorredor=code)
         self.assertEqual(stops, expected_stops)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def lists_lanes(self, mock_requests):
-        mock_requests.get.return_value.content = test_fixtures.LANES
+        respond_with(mock_requests, test_fixtures.LANES)
 
         lanes = list(self.client.list_lanes())
 
@@ -177,7 +234,7 @@ class ClientTest(TestCase):
                           for lane_dict in json.loads(test_fixtures.LANES.decode('latin1'))]
         url = self.client._build_url('Corredor')
         self.assertEqual(lanes, expected_lanes)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
@@ -185,14 +242,14 @@ class ClientTest(TestCase):
         fixture = test_fixtures.VEHICLE_POSITIONS
         code = '1234'
 
-        mock_requests.get.return_value.content = fixture
+        respond_with(mock_requests, fixture)
 
         positions = self.client.get_positions(code)
 
         expected_positions = Positions.from_dict(json.loads(fixture.decode('latin1')))
         url = self.client._build_url('Posicao', codigoLinha=code)
         self.assertEqual(positions, expected_positions)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
@@ -201,14 +258,14 @@ class ClientTest(TestCase):
         stop_code = '1234'
         route_code = '2345'
 
-        mock_requests.get.return_value.content = fixture
+        respond_with(mock_requests, fixture)
 
         forecast = self.client.get_forecast(stop_code=stop_code, route_code=route_code)
 
         expected_forecast = ForecastWithStop.from_dict(json.loads(fixture.decode('latin1')))
         url = self.client._build_url('Previsao', codigoParada=stop_code, codigoLinha=route_code)
         self.assertEqual(forecast, expected_forecast)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
@@ -216,14 +273,14 @@ class ClientTest(TestCase):
         fixture = test_fixtures.FORECAST_FOR_ROUTE
         route_code = '2345'
 
-        mock_requests.get.return_value.content = fixture
+        respond_with(mock_requests, fixture)
 
         forecast = self.client.get_forecast(route_code=route_code)
 
         expected_forecast = ForecastWithStops.from_dict(json.loads(fixture.decode('latin1')))
         url = self.client._build_url('Previsao/Linha', codigoLinha=route_code)
         self.assertEqual(forecast, expected_forecast)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
@@ -231,25 +288,521 @@ class ClientTest(TestCase):
         fixture = test_fixtures.FORECAST_FOR_STOP
         stop_code = '1234'
 
-        mock_requests.get.return_value.content = fixture
+        respond_with(mock_requests, fixture)
 
         forecast = self.client.get_forecast(stop_code=stop_code)
 
         expected_forecast = ForecastWithStop.from_dict(json.loads(fixture.decode('latin1')))
         url = self.client._build_url('Previsao/Parada', codigoParada=stop_code)
         self.assertEqual(forecast, expected_forecast)
-        mock_requests.get.assert_called_once_with(url, cookies=self.client._cookies)
+        mock_requests.Session.return_value.get.assert_called_once_with(url, cookies=self.client._cookies, headers=self.client.headers, stream=True, timeout=self.client.timeout)
 
     @istest
     @patch('sptrans.v0.requests')
     def raises_request_error_if_not_authenticated(self, mock_requests):
         fixture = test_fixtures.MESSAGE_ERROR
-        mock_requests.get.return_value.content = fixture
+        respond_with(mock_requests, fixture)
 
         expected_message = json.loads(fixture.decode('latin1'))[u'Message']
 
         self.assertRaisesRegexp(RequestError, expected_message, self.client._get_json, 'Some/Endpoint')
 
+    @istest
+    @patch('sptrans.v0.requests')
+    def reuses_the_previous_result_when_the_content_is_unchanged(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+        first = self.client.get_positions(1234)
+        self.assertTrue(self.client.fresh)
+
+        with patch('sptrans.v0.json') as mock_json:
+            second = self.client.get_positions(1234)
+
+        self.assertIs(second, first)
+        self.assertFalse(self.client.fresh)
+        self.assertFalse(mock_json.loads.called)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def builds_a_new_result_when_the_content_changes(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+        first = self.client.get_positions(1234)
+
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS.replace(b'22:57', b'22:58'))
+        second = self.client.get_positions(1234)
+
+        self.assertTrue(self.client.fresh)
+        self.assertEqual(second.time.minute, 58)
+        self.assertNotEqual(second, first)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def sends_conditional_headers_and_reuses_result_when_not_modified(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.LANES, headers={
+            'ETag': '"abc"',
+            'Last-Modified': 'Sat, 19 Oct 2026 10:00:00 GMT',
+        })
+        first = list(self.client.list_lanes())
+
+        respond_with(mock_requests, b'', status_code=304)
+        second = list(self.client.list_lanes())
+
+        self.assertEqual(second, first)
+        self.assertFalse(self.client.fresh)
+        mock_requests.Session.return_value.get.assert_called_with(self.client._build_url('Corredor'), cookies=self.client._cookies, headers={
+            'Accept-Encoding': self.client.headers['Accept-Encoding'],
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Sat, 19 Oct 2026 10:00:00 GMT',
+        }, stream=True, timeout=self.client.timeout)
+
+    @istest
+    def asks_for_compressed_content(self):
+        encodings = self.client.headers['Accept-Encoding'].split(', ')
+
+        self.assertEqual(encodings, content_encodings())
+        self.assertIn('gzip', encodings)
+        self.assertIn('deflate', encodings)
+
+    @istest
+    def sends_extra_headers(self):
+        client = Client(headers={'User-Agent': 'my agent'})
+
+        self.assertEqual(client.headers['User-Agent'], 'my agent')
+        self.assertIn('Accept-Encoding', client.headers)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def accounts_for_wire_and_decoded_bytes_per_endpoint(self, mock_requests):
+        response = respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+        response.raw = MagicMock()
+        response.raw.tell.return_value = 100
+        self.client.get_positions(1)
+        response.raw = None
+        response.headers = {'Content-Length': '50'}
+        self.client.get_positions(2)
+        respond_with(mock_requests, test_fixtures.LANES)
+        list(self.client.list_lanes())
+
+        size = len(test_fixtures.VEHICLE_POSITIONS)
+        self.assertEqual(self.client.transfer_stats['Posicao'], TransferStats(2, 150, 2 * size))
+        self.assertEqual(self.client.transfer_stats['Corredor'], TransferStats(1, len(test_fixtures.LANES), len(test_fixtures.LANES)))
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def hashes_the_content_chunk_by_chunk(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+
+        response, content, digest = self.client._download('Posicao', 'http://some/url', None, {})
+
+        self.assertEqual(content, test_fixtures.VEHICLE_POSITIONS)
+        self.assertEqual(digest, hashlib.sha1(test_fixtures.VEHICLE_POSITIONS).hexdigest())
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def does_not_remember_error_messages(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.MESSAGE_ERROR)
+        self.assertRaises(RequestError, self.client._get_json, 'Some/Endpoint')
+
+        self.assertRaises(RequestError, self.client._get_json, 'Some/Endpoint')
+        self.assertEqual(len(self.client._payloads), 0)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def forgets_the_oldest_responses_beyond_the_limit(self, mock_requests):
+        client = Client(max_payloads=2)
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+
+        for code in (1, 2, 1, 3):
+            client.get_positions(code)
+
+        self.assertEqual(list(client._payloads), [client._build_url('Posicao', codigoLinha=code) for code in (1, 3)])
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def authenticates_again_with_its_token_when_the_session_expires(self, mock_requests):
+        session = mock_requests.Session.return_value
+        session.post.return_value.content = b'true'
+        fixture = test_fixtures.VEHICLE_POSITIONS
+        expired = respond_with(mock_requests, test_fixtures.MESSAGE_ERROR)
+        valid = MagicMock(status_code=200, headers={}, raw=None)
+        valid.iter_content.return_value = [fixture]
+        session.get.side_effect = [expired, valid]
+        client = Client(token='some token')
+
+        positions = client.get_positions(1234)
+
+        self.assertEqual(positions, Positions.from_dict(json.loads(fixture.decode('latin1'))))
+        session.post.assert_called_once_with(client._build_url('Login/Autenticar', token='some token'), timeout=client.timeout)
+        self.assertIs(client._cookies, session.post.return_value.cookies)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def authenticates_with_the_token_it_was_created_with(self, mock_requests):
+        session = mock_requests.Session.return_value
+        session.post.return_value.content = b'true'
+        client = Client(token='some token')
+
+        client.authenticate()
+
+        session.post.assert_called_once_with(client._build_url('Login/Autenticar', token='some token'), timeout=client.timeout)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def returns_undecoded_responses_in_raw_mode(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.LANES, headers={'Content-Type': 'application/json; charset=utf-8', 'ETag': '"abc"'})
+        calls = [
+            (lambda: self.client.search_routes('foo', raw=True), 'Linha/Buscar'),
+            (lambda: self.client.search_stops('foo', raw=True), 'Parada/Buscar'),
+            (lambda: self.client.search_stops_by_route(1, raw=True), 'Parada/BuscarParadasPorLinha'),
+            (lambda: self.client.search_stops_by_lane(1, raw=True), 'Parada/BuscarParadasPorCorredor'),
+            (lambda: self.client.list_lanes(raw=True), 'Corredor'),
+            (lambda: self.client.get_positions(1, raw=True), 'Posicao'),
+            (lambda: self.client.get_forecast(stop_code=1, raw=True), 'Previsao/Parada'),
+            (lambda: self.client.get_forecast(route_code=1, raw=True), 'Previsao/Linha'),
+            (lambda: self.client.get_forecast(stop_code=1, route_code=1, raw=True), 'Previsao'),
+        ]
+
+        for call, endpoint in calls:
+            response = call()
+
+            self.assertIsInstance(response, RawResponse)
+            self.assertIsInstance(response.content, memoryview)
+            self.assertEqual(response.content.tobytes(), test_fixtures.LANES)
+            self.assertEqual(response.url.split('?')[0], '{}/{}'.format(BASE_URL, endpoint))
+            self.assertEqual((response.content_type, response.etag), ('application/json; charset=utf-8', '"abc"'))
+        self.assertEqual(self.client._payloads, {})
+        self.assertEqual(self.client.transfer_stats['Corredor'].requests, 1)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def raises_error_messages_in_raw_mode(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.MESSAGE_ERROR)
+
+        self.assertRaisesRegexp(RequestError, 'Authorization has been denied', self.client.get_positions, 1234, raw=True)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def authenticates_again_in_raw_mode(self, mock_requests):
+        session = mock_requests.Session.return_value
+        session.post.return_value.content = b'true'
+        expired = respond_with(mock_requests, test_fixtures.MESSAGE_ERROR)
+        valid = MagicMock(status_code=200, headers={}, raw=None)
+        valid.iter_content.return_value = [test_fixtures.VEHICLE_POSITIONS]
+        session.get.side_effect = [expired, valid]
+        client = Client(token='some token')
+
+        response = client.get_positions(1234, raw=True)
+
+        self.assertEqual(bytes(response.content), test_fixtures.VEHICLE_POSITIONS)
+        self.assertEqual(session.post.call_count, 1)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def keeps_the_token_for_authenticating_again(self, mock_requests):
+        mock_requests.Session.return_value.post.return_value.content = b'true'
+        client = Client()
+
+        client.authenticate('some token')
+
+        self.assertEqual(client.token, 'some token')
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def shares_the_connection_pool(self, mock_requests):
+        client = Client(pool_size=32)
+
+        self.assertIs(client._get_session(), client._get_session())
+        mock_requests.adapters.HTTPAdapter.assert_called_once_with(pool_connections=32, pool_maxsize=32)
+        self.assertEqual(mock_requests.Session.call_count, 1)
+
+
+class PersistedStateTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session_path = os.path.join(self.directory, 'session.json')
+        self.snapshot_path = os.path.join(self.directory, 'snapshot.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def saves_and_restores_the_session(self, mock_requests):
+        mock_requests.Session.return_value.post.return_value.content = b'true'
+        mock_requests.Session.return_value.post.return_value.cookies = {'apiCredentials': 'abc'}
+        client = Client()
+        client.authenticate('some token')
+        client.save_session(self.session_path)
+
+        restored = Client(session_file=self.session_path)
+
+        self.assertEqual(restored._cookies, {'apiCredentials': 'abc'})
+        self.assertEqual(restored.authenticated_at, client.authenticated_at)
+        self.assertIsNone(restored.session_expires_at)
+
+    @istest
+    def saves_the_session_readable_only_by_its_owner(self):
+        open(self.session_path, 'w').close()
+        os.chmod(self.session_path, 0o644)
+        client = Client()
+
+        client.save_session(self.session_path)
+        client.save_session(os.path.join(self.directory, 'new.json'))
+
+        self.assertEqual(os.stat(self.session_path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(os.path.join(self.directory, 'new.json')).st_mode & 0o777, 0o600)
+
+    @istest
+    def does_not_restore_expired_sessions(self):
+        with open(self.session_path, 'w') as session_file:
+            json.dump({'cookies': {'apiCredentials': 'abc'}, 'authenticated_at': 1, 'expires_at': 2}, session_file)
+        client = Client()
+
+        self.assertFalse(client.load_session(self.session_path))
+        self.assertIsNone(client._cookies)
+
+    @istest
+    def ignores_missing_files(self):
+        client = Client(session_file=self.session_path, snapshot_file=self.snapshot_path)
+
+        self.assertIsNone(client._cookies)
+        self.assertEqual(len(client._payloads), 0)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def serves_static_data_from_a_snapshot(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.LANES)
+        client = Client()
+        lanes = list(client.list_lanes())
+        respond_with(mock_requests, test_fixtures.VEHICLE_POSITIONS)
+        client.get_positions(1234)
+        client.save_snapshot(self.snapshot_path)
+        mock_requests.Session.return_value.get.reset_mock()
+
+        warm = Client(static_ttl=60, snapshot_file=self.snapshot_path)
+
+        self.assertEqual(list(warm.list_lanes()), lanes)
+        self.assertFalse(warm.fresh)
+        self.assertFalse(mock_requests.Session.return_value.get.called)
+        self.assertEqual(list(warm._payloads), [warm._build_url('Corredor')])
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def revalidates_snapshot_data_without_a_static_ttl(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.LANES)
+        client = Client()
+        lanes = list(client.list_lanes())
+        client.save_snapshot(self.snapshot_path)
+
+        warm = Client(snapshot_file=self.snapshot_path)
+
+        with patch('sptrans.v0.json') as mock_json:
+            self.assertEqual(list(warm.list_lanes()), lanes)
+        self.assertFalse(mock_json.loads.called)
+        self.assertEqual(mock_requests.Session.return_value.get.call_count, 2)
+
+    @istest
+    def ignores_snapshots_of_other_versions(self):
+        with open(self.snapshot_path, 'w') as snapshot_file:
+            json.dump({'version': 0, 'payloads': {'foo': [1, 2, 3, 4, 5]}}, snapshot_file)
+
+        self.assertEqual(Client().load_snapshot(self.snapshot_path), 0)
+
+    @istest
+    def starts_cold_with_unreadable_snapshots(self):
+        with open(self.snapshot_path, 'w') as snapshot_file:
+            snapshot_file.write('{"version": 1, "payloads": {"foo": [1, 2')
+
+        client = Client(snapshot_file=self.snapshot_path)
+
+        self.assertEqual(len(client._payloads), 0)
+        with open(self.snapshot_path, 'w') as snapshot_file:
+            snapshot_file.write('[1]')
+        self.assertEqual(client.load_snapshot(self.snapshot_path), 0)
+
+    @istest
+    @patch('sptrans.v0.requests')
+    def replaces_snapshots_atomically(self, mock_requests):
+        respond_with(mock_requests, test_fixtures.LANES)
+        client = Client()
+        list(client.list_lanes())
+        client.save_snapshot(self.snapshot_path)
+        with open(self.snapshot_path) as snapshot_file:
+            saved = snapshot_file.read()
+
+        with patch('sptrans.v0.os.rename', side_effect=OSError):
+            self.assertRaises(OSError, client.save_snapshot, self.snapshot_path, endpoints=())
+
+        with open(self.snapshot_path) as snapshot_file:
+            self.assertEqual(snapshot_file.read(), saved)
+        self.assertEqual(os.listdir(self.directory), ['snapshot.json'])
+        self.assertEqual(Client(snapshot_file=self.snapshot_path).load_snapshot(self.snapshot_path), 1)
+
+    @istest
+    def does_not_import_heavy_optional_dependencies(self):
+        heavy = ['brotli', 'brotlicffi', 'numpy', 'pandas', 'pyarrow', 'msgpack']
+        code = 'import sys, sptrans.v0; print(sorted(set(sys.modules) & set({!r})))'.format(heavy)
+
+        output = subprocess.check_output([sys.executable, '-c', code])
+
+        self.assertEqual(output.strip(), b'[]')
+
+
+class ConcurrentClientTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    @istest
+    def can_be_shared_by_many_threads_with_a_single_authentication(self):
+        client = Client(token=stub_server.TOKEN, base_url=self.server.base_url, pool_size=16)
+        expected = Positions.from_dict(json.loads(test_fixtures.VEHICLE_POSITIONS.decode('latin1')))
+        results = []
+        errors = []
+
+        def work(thread_number):
+            try:
+                for call in range(20):
+                    results.append(client.get_positions(thread_number * 100 + call))
+                    results.append(list(client.list_lanes()))
+            except Exception as error:  # pragma: no cover
+                errors.append(error)
+
+        threads = [threading.Thread(target=work, args=(number, )) for number in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 16 * 20 * 2)
+        self.assertEqual([result for result in results if result != expected and len(result) != 1], [])
+        self.assertEqual(self.server.requests['/Login/Autenticar'], 1)
+        self.assertEqual(self.server.sessions, 1)
+        self.assertEqual(client.transfer_stats['Posicao'].requests, self.server.requests['/Posicao'])
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    @istest
+    def opens_after_failures_in_a_row(self):
+        self.breaker.fail()
+        self.breaker.succeed()
+        self.breaker.fail()
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.fail()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    @istest
+    @patch('sptrans.v0.now')
+    def lets_a_single_trial_through_after_the_reset_timeout(self, mock_now):
+        mock_now.return_value = 100
+        self.breaker.fail()
+        self.breaker.fail()
+
+        mock_now.return_value = 130
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+        self.breaker.succeed()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    @istest
+    @patch('sptrans.v0.now')
+    def opens_again_when_the_trial_fails(self, mock_now):
+        mock_now.return_value = 100
+        self.breaker.fail()
+        self.breaker.fail()
+        mock_now.return_value = 130
+        self.breaker.allow()
+
+        self.breaker.fail()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+
+class UnhealthyUpstreamTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        if self.server.delay is not None:
+            self.server.delay.set()
+        self.server.stop()
+
+    def build_client(self, **kwargs):
+        client = Client(token=stub_server.TOKEN, base_url=self.server.base_url, timeout=(1, 0.2), failure_threshold=2, **kwargs)
+        client.authenticate()
+        return client
+
+    @istest
+    def times_out_and_then_fails_fast(self):
+        client = self.build_client()
+        self.server.delay = threading.Event()
+
+        self.assertRaises(requests.Timeout, client.get_positions, 1234)
+        self.assertRaises(requests.Timeout, client.get_positions, 1234)
+        self.assertRaises(CircuitOpenError, client.get_positions, 1234)
+
+        self.assertEqual(self.server.requests['/Posicao'], 2)
+        self.assertEqual(self.server.requests['/Login/Autenticar'], 1)
+        self.assertEqual(client.breakers['Posicao'].state, CircuitBreaker.OPEN)
+        self.server.delay.set()
+        self.assertEqual(len(list(client.list_lanes())), 1)
+
+    @istest
+    def serves_stale_results_while_the_upstream_is_unhealthy(self):
+        client = self.build_client(serve_stale=True)
+        positions = client.get_positions(1234)
+        self.server.delay = threading.Event()
+
+        results = [client.get_positions(1234) for _ in range(3)]
+
+        self.assertEqual(results, [positions] * 3)
+        self.assertFalse(client.fresh)
+        self.assertEqual(self.server.requests['/Posicao'], 3)
+        self.assertRaises(CircuitOpenError, client.get_positions, 5678)
+
+    @istest
+    def counts_server_errors_as_failures(self):
+        client = self.build_client()
+        self.server.responses['/Posicao'] = 503
+
+        self.assertRaises(requests.HTTPError, client.get_positions, 1234)
+        self.assertEqual(client.breakers['Posicao'].failures, 1)
+
+    @istest
+    def closes_the_responses_of_server_errors(self):
+        client = self.build_client()
+        self.server.responses['/Posicao'] = 503
+        session = client._get_session()
+        get = session.get
+        responses = []
+
+        def spying_get(*args, **kwargs):
+            response = get(*args, **kwargs)
+            response.close = MagicMock(wraps=response.close)
+            responses.append(response)
+            return response
+
+        with patch.object(session, 'get', spying_get):
+            self.assertRaises(requests.HTTPError, client.get_positions, 1234)
+
+        self.assertTrue(responses[0].close.called)
+
 
 @skipUnless(TOKEN, 'Please provide an SPTRANS_TOKEN env variable')
 class ClientFunctionalTest(TestCase):
@@ -393,3 +946,192 @@ class ForecastWithStopsTest(TestCase):
         self.assertEqual(forecast.stops[0].vehicles[0].accessible, False)
         self.assertEqual(forecast.stops[0].vehicles[0].latitude, -23.528119999999998)
         self.assertEqual(forecast.stops[0].vehicles[0].longitude, -46.670674999999996)
+
+
+class StringPoolTest(TestCase):
+
+    @istest
+    def keeps_a_single_copy_of_equal_strings(self):
+        pool = StringPool()
+        first = ''.join(['foo', 'bar'])
+        second = ''.join(['foo', 'bar'])
+
+        self.assertIs(pool.intern(first), first)
+        self.assertIs(pool.intern(second), first)
+
+        report = pool.report()
+        self.assertEqual(report.size, 1)
+        self.assertEqual(report.hits, 1)
+        self.assertEqual(report.misses, 1)
+        self.assertEqual(report.saved_bytes, sys.getsizeof(second))
+
+    @istest
+    def does_not_count_the_same_object_as_a_hit(self):
+        pool = StringPool()
+        value = ''.join(['foo', 'bar'])
+
+        pool.intern(value)
+        pool.intern(value)
+
+        self.assertEqual(pool.report().hits, 0)
+
+    @istest
+    def returns_none_and_unhashable_values_as_they_are(self):
+        pool = StringPool()
+        value = ['foo']
+
+        self.assertIsNone(pool.intern(None))
+        self.assertIs(pool.intern(value), value)
+        self.assertEqual(pool.report().size, 0)
+
+    @istest
+    def is_emptied_when_full(self):
+        pool = StringPool(max_size=2)
+
+        for value in ('a', 'b', 'c'):
+            pool.intern(value)
+
+        self.assertEqual(pool.report().size, 1)
+
+    @istest
+    def clears_the_strings_and_counters(self):
+        pool = StringPool()
+        pool.intern('foo')
+
+        pool.clear()
+
+        self.assertEqual(pool.report(), (0, 0, 0, 0))
+
+    @istest
+    def is_used_when_decoding_repeated_fields(self):
+        first = Positions.from_dict(json.loads(test_fixtures.VEHICLE_POSITIONS.decode('latin1')))
+        second = Positions.from_dict(json.loads(test_fixtures.VEHICLE_POSITIONS.decode('latin1')))
+        first_forecast = ForecastWithStop.from_dict(json.loads(test_fixtures.FORECAST_FOR_STOP.decode('latin1')))
+        second_forecast = ForecastWithStop.from_dict(json.loads(test_fixtures.FORECAST_FOR_STOP.decode('latin1')))
+
+        self.assertIs(second.vehicles[0].prefix, first.vehicles[0].prefix)
+        self.assertIs(second_forecast.stop.name, first_forecast.stop.name)
+        first_route, second_route = first_forecast.stop.routes[0], second_forecast.stop.routes[0]
+        self.assertIs(second_route.sign, first_route.sign)
+        self.assertIs(second_route.main_to_sec, first_route.main_to_sec)
+        self.assertIs(second_route.sec_to_main, first_route.sec_to_main)
+        self.assertIs(second_route.vehicles[0].prefix, first_route.vehicles[0].prefix)
+        self.assertGreater(STRING_POOL.report().hits, 0)
+
+
+class FieldTest(TestCase):
+
+    @istest
+    def resolves_one_or_many_values_with_either_method_overridden(self):
+        class SingleField(Field):
+            def resolve(self, result_dict):
+                return result_dict[self.field] * 2
+
+        class BatchField(Field):
+            def resolve_many(self, result_dicts):
+                return [result_dict[self.field] * 3 for result_dict in result_dicts]
+
+        self.assertEqual(SingleField('a').resolve_many([{'a': 1}, {'a': 2}]), [2, 4])
+        self.assertEqual(BatchField('a').resolve({'a': 1}), 3)
+
+    @istest
+    def resolves_times_once_per_distinct_string(self):
+        values = TimeField('t').resolve_many([{'t': '10:05'}, {'t': '10:06'}, {'t': '10:05'}])
+
+        self.assertEqual(values, [TimeField('t').resolve({'t': time_string}) for time_string in ('10:05', '10:06', '10:05')])
+        self.assertIs(values[0], values[2])
+
+    @istest
+    def coerces_floats(self):
+        field = FloatField('py')
+
+        self.assertEqual(field.resolve_many([{'py': -23}, {'py': None}, {'py': '1.5'}]), [-23.0, None, 1.5])
+        self.assertIsInstance(field.resolve({'py': -23}), float)
+        self.assertIsNone(field.resolve({'py': None}))
+
+    @istest
+    def maps_choices(self):
+        field = ChoiceField('sl', {1: 'main_to_sec', 2: 'sec_to_main'}, default='unknown')
+
+        self.assertEqual(field.resolve_many([{'sl': 2}, {'sl': 1}, {'sl': 3}]), ['sec_to_main', 'main_to_sec', 'unknown'])
+
+    @istest
+    def decodes_nested_lists_in_a_single_batch(self):
+        field = TupleListField('vs', Vehicle)
+        result_dicts = [
+            {'vs': [{'p': '1', 'a': True, 'py': 1.0, 'px': 2.0}, {'p': '2', 'a': False, 'py': 3.0, 'px': 4.0}]},
+            {'vs': []},
+            {'vs': [{'p': '3', 'a': True, 'py': 5.0, 'px': 6.0}]},
+        ]
+
+        with patch.object(Vehicle, 'from_dicts', wraps=Vehicle.from_dicts) as from_dicts:
+            values = field.resolve_many(result_dicts)
+
+        self.assertEqual(from_dicts.call_count, 1)
+        self.assertEqual([[vehicle.prefix for vehicle in vehicles] for vehicles in values], [['1', '2'], [], ['3']])
+        self.assertEqual(values, [field.resolve(result_dict) for result_dict in result_dicts])
+
+
+class BuildTupleClassTest(TestCase):
+
+    @istest
+    def decodes_many_results_like_one_at_a_time(self):
+        for fixture, tuple_class in [
+                (test_fixtures.FORECAST_FOR_STOP, ForecastWithStop),
+                (test_fixtures.FORECAST_FOR_ROUTE, ForecastWithStops),
+                (test_fixtures.VEHICLE_POSITIONS, Positions)]:
+            result_dict = json.loads(fixture.decode('latin1'))
+
+            self.assertEqual(tuple_class.from_dicts(iter([result_dict, result_dict])), [tuple_class.from_dict(result_dict)] * 2)
+
+    @istest
+    def accepts_user_defined_fields(self):
+        class LegacyField(object):
+            def resolve(self, result_dict):
+                return result_dict['n'] + 1
+
+        Point = build_tuple_class('Point', {
+            'latitude': FloatField('py'),
+            'direction': ChoiceField('sl', {1: 'out', 2: 'back'}),
+            'next': LegacyField(),
+            'name': 'np',
+        })
+
+        points = Point.from_dicts([{'py': -23, 'sl': 2, 'n': 1, 'np': 'foo'}])
+
+        self.assertEqual(points, [Point(latitude=-23.0, direction='back', next=2, name='foo')])
+        self.assertEqual(Point.from_dict({'py': -23, 'sl': 2, 'n': 1, 'np': 'foo'}), points[0])
+
+
+class SelectTest(TestCase):
+
+    def setUp(self):
+        self.route_dicts = json.loads(test_fixtures.ROUTE_SEARCH.decode('latin1'))
+
+    @istest
+    def decodes_only_the_matching_results(self):
+        with patch.object(Route, 'from_dicts', wraps=Route.from_dicts) as from_dicts:
+            routes = select(Route, self.route_dicts, code=lambda code: code > 2000)
+
+        self.assertEqual(routes, [Route.from_dict(self.route_dicts[1])])
+        from_dicts.assert_called_once_with([self.route_dicts[1]])
+
+    @istest
+    def pages_the_matching_results(self):
+        self.assertEqual(select(Route, self.route_dicts, sign='8000', offset=1), [Route.from_dict(self.route_dicts[1])])
+        self.assertEqual(select(Route, self.route_dicts, limit=1), [Route.from_dict(self.route_dicts[0])])
+        self.assertEqual(select(Route, self.route_dicts, type=11), [])
+
+    @istest
+    def filters_by_fields_with_raw_keys(self):
+        vehicle_dicts = json.loads(test_fixtures.VEHICLE_POSITIONS.decode('latin1'))['vs']
+
+        vehicles = select(Vehicle, vehicle_dicts, prefix='11433')
+
+        self.assertEqual([vehicle.prefix for vehicle in vehicles], ['11433'])
+
+    @istest
+    def refuses_unknown_or_converted_attributes(self):
+        self.assertRaises(TypeError, select, Route, self.route_dicts, color='red')
+        self.assertRaises(TypeError, select, Route, self.route_dicts, bbox=(-24, -47, -23, -46))
+        self.assertRaises(TypeError, select, Positions, [], time='10:00')